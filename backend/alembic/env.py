@@ -2,6 +2,7 @@ import asyncio
 
 from alembic import context
 from app.config import settings
+from app.models import transcription  # noqa: F401, registers the tables in Base.metadata
 from app.models.base import Base
 from app.utils.logging import AppLogger
 from sqlalchemy.ext.asyncio import create_async_engine
@@ -26,6 +27,23 @@ def do_run_migrations(connection):
         context.run_migrations()
 
 
+def run_migrations_offline():
+    """Run migrations in 'offline' mode.
+
+    Prints the SQL instead of running it, e.g. `alembic upgrade head --sql`.
+
+    """
+    context.configure(
+        url=settings.asyncpg_url.unicode_string(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
 async def run_migrations_online():
     """Run migrations in 'online' mode.
 
@@ -40,4 +58,7 @@ async def run_migrations_online():
         await connection.run_sync(do_run_migrations)
 
 
-asyncio.run(run_migrations_online())
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_migrations_online())
@@ -0,0 +1,68 @@
+"""add transcription persistence
+
+Revision ID: 12186afa6bab
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '12186afa6bab'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'transcription_session',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('source', sa.String(length=16), nullable=False),
+        sa.Column('language', sa.String(length=16), nullable=True),
+        sa.Column('words', sa.Integer(), nullable=False),
+        sa.Column('closed_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_transcription_session_created_at', 'transcription_session', ['created_at'], unique=False)
+    op.create_table(
+        'transcription_word',
+        sa.Column('session_id', sa.Uuid(), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('word', sa.Text(), nullable=False),
+        sa.Column('start_ms', sa.Integer(), nullable=False),
+        sa.Column('end_ms', sa.Integer(), nullable=False),
+        sa.Column('probability', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['session_id'], ['transcription_session.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('session_id', 'seq')
+    )
+    op.create_table(
+        'generated_note',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('session_id', sa.Uuid(), nullable=True),
+        sa.Column('kind', sa.String(length=32), nullable=False),
+        sa.Column('prompt_name', sa.String(length=128), nullable=True),
+        sa.Column('prompt_version', sa.Integer(), nullable=True),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['session_id'], ['transcription_session.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_generated_note_created_at', 'generated_note', ['created_at'], unique=False)
+    op.create_index('ix_generated_note_session_id', 'generated_note', ['session_id'], unique=False, postgresql_where=sa.text('session_id IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_generated_note_session_id', table_name='generated_note', postgresql_where=sa.text('session_id IS NOT NULL'))
+    op.drop_index('ix_generated_note_created_at', table_name='generated_note')
+    op.drop_table('generated_note')
+    op.drop_table('transcription_word')
+    op.drop_index('ix_transcription_session_created_at', table_name='transcription_session')
+    op.drop_table('transcription_session')
@@ -0,0 +1,204 @@
+import base64
+import io
+import wave
+
+import numpy as np
+from app.utils.metrics import audio_base64_decode_seconds, audio_decode_seconds
+
+SAMPLE_RATE = 16000
+
+# Taps of the low-pass filter used before integer decimation, e.g. 48 kHz -> 16 kHz
+RESAMPLE_FILTER_TAPS = 63
+
+def decode_audio(audio_bytes: bytes, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decodes audio bytes in memory into a mono float32 array at the given sample rate.
+    WAV is parsed with numpy directly, any other container (Opus/WebM, Ogg, MP3...) is decoded with PyAV in-process.
+
+    Parameters:
+        audio_bytes (bytes): Audio file content
+        sampling_rate (int): Target sample rate. Default is 16000, which is what Whisper expects.
+
+    Returns:
+        np.ndarray: Mono float32 samples in [-1, 1]
+    """
+    if audio_bytes[:4] == b"RIFF" and audio_bytes[8:12] == b"WAVE":
+        try:
+            with audio_decode_seconds.labels("wav").time():
+                return decode_wav(audio_bytes, sampling_rate=sampling_rate)
+        except (wave.Error, ValueError):
+            # e.g. float or extensible WAV, PyAV handles those
+            pass
+
+    # PyAV comes with faster-whisper, import it lazily so plain WAV decoding does not need it
+    from faster_whisper.audio import decode_audio as av_decode_audio
+    with audio_decode_seconds.labels("av").time():
+        return av_decode_audio(io.BytesIO(audio_bytes), sampling_rate=sampling_rate)
+
+def decode_audio_file(path: str, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decodes an audio file into a mono float32 array at the given sample rate.
+    The file is decoded with PyAV frame by frame, it is never read into memory as a whole.
+
+    Parameters:
+        path (str): Path of the audio file, any container PyAV reads (WAV, Opus/WebM, Ogg, MP3...)
+        sampling_rate (int): Target sample rate. Default is 16000.
+
+    Returns:
+        np.ndarray: Mono float32 samples in [-1, 1]
+    """
+    from faster_whisper.audio import decode_audio as av_decode_audio
+    with audio_decode_seconds.labels("av").time():
+        return av_decode_audio(path, sampling_rate=sampling_rate)
+
+def decode_base64_audio(blob: str, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decodes a base64 encoded audio blob into a mono float32 array.
+
+    Parameters:
+        blob (str): Base64 encoded audio file bytes
+        sampling_rate (int): Target sample rate. Default is 16000.
+
+    Returns:
+        np.ndarray: Mono float32 samples in [-1, 1]
+    """
+    with audio_base64_decode_seconds.time():
+        audio_bytes = base64.b64decode(blob)
+    return decode_audio(audio_bytes, sampling_rate=sampling_rate)
+
+def decode_wav(audio_bytes: bytes, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decodes WAV bytes into a mono float32 array at the given sample rate.
+
+    Parameters:
+        audio_bytes (bytes): WAV file content
+        sampling_rate (int): Target sample rate. Default is 16000, which is what Whisper expects.
+
+    Returns:
+        np.ndarray: Mono float32 samples in [-1, 1]
+    """
+    with wave.open(io.BytesIO(audio_bytes), "rb") as wav:
+        channels = wav.getnchannels()
+        sample_width = wav.getsampwidth()
+        source_rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if sample_width == 2:
+        return decode_pcm16(frames, source_rate, channels=channels, sampling_rate=sampling_rate)
+
+    if sample_width == 1:
+        audio = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 4:
+        audio = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width}")
+
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+
+    return resample(audio, source_rate, sampling_rate)
+
+def decode_pcm16(frames: bytes, source_rate: int, channels: int = 1, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decodes raw little-endian 16-bit PCM into a mono float32 array.
+
+    Parameters:
+        frames (bytes): Interleaved PCM16 samples
+        source_rate (int): Sample rate of `frames`
+        channels (int): Number of interleaved channels. Default is 1.
+        sampling_rate (int): Target sample rate. Default is 16000.
+
+    Returns:
+        np.ndarray: Mono float32 samples in [-1, 1]
+    """
+    audio = np.frombuffer(frames, dtype="<i2")
+    if channels > 1:
+        audio = audio[:len(audio) - len(audio) % channels].reshape(-1, channels).mean(axis=1, dtype=np.float32)
+    audio = audio.astype(np.float32) * (1.0 / 32768.0)
+
+    return resample(audio, source_rate, sampling_rate)
+
+class OpusDecoder:
+    """
+    Stateful decoder of raw Opus packets, e.g. the frames of a WebRTC or WebCodecs encoder.
+    Opus frames depend on the previous ones, so use one decoder per stream.
+
+    Attributes:
+        source_rate (int): Sample rate of the stream.
+        channels (int): Number of channels of the stream.
+
+    Methods:
+        decode(packet, sampling_rate): Decodes one packet into mono float32 samples.
+    """
+
+    def __init__(self, source_rate: int = 48000, channels: int = 1):
+        # PyAV comes with faster-whisper, import it lazily so plain WAV decoding does not need it
+        import av
+
+        self.source_rate = source_rate
+        self.channels = channels
+        self._av = av
+        self._codec = av.CodecContext.create("opus", "r")
+        self._codec.sample_rate = source_rate
+        self._codec.layout = "stereo" if channels > 1 else "mono"
+
+    def decode(self, packet: bytes, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+        """
+        Parameters:
+            packet (bytes): One Opus packet
+            sampling_rate (int): Target sample rate. Default is 16000.
+
+        Returns:
+            np.ndarray: Mono float32 samples in [-1, 1]
+        """
+        frames = [frame.to_ndarray() for frame in self._codec.decode(self._av.Packet(packet))]
+        if not frames:
+            return np.zeros(0, dtype=np.float32)
+
+        # Planar float frames are (channels, samples), packed ones (1, samples * channels)
+        audio = np.concatenate(frames, axis=1).astype(np.float32, copy=False)
+        if audio.shape[0] == 1 and self.channels > 1:
+            audio = audio.reshape(-1, self.channels).T
+        audio = audio.mean(axis=0) if audio.shape[0] > 1 else audio[0]
+
+        return resample(audio, self.source_rate, sampling_rate)
+
+def resample(audio: np.ndarray, source_rate: int, target_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Resamples mono audio.
+    Integer down-sampling ratios (48 kHz, 32 kHz -> 16 kHz) are low-pass filtered and decimated,
+    any other ratio falls back to linear interpolation.
+
+    Parameters:
+        audio (np.ndarray): Mono float32 samples
+        source_rate (int): Sample rate of `audio`
+        target_rate (int): Wanted sample rate. Default is 16000.
+
+    Returns:
+        np.ndarray: Resampled float32 samples
+    """
+    if source_rate == target_rate or len(audio) == 0:
+        return audio.astype(np.float32, copy=False)
+
+    if source_rate > target_rate and source_rate % target_rate == 0:
+        factor = source_rate // target_rate
+        kernel = _low_pass_filter(factor)
+        padding = len(kernel) // 2
+        padded = np.pad(audio.astype(np.float32, copy=False), (padding, padding))
+        # Only evaluate the filter at the samples kept after decimation
+        windows = np.lib.stride_tricks.sliding_window_view(padded, len(kernel))[::factor]
+        return windows @ kernel
+
+    target_length = int(round(len(audio) * target_rate / source_rate))
+    positions = np.arange(target_length, dtype=np.float64) * (source_rate / target_rate)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+_low_pass_filters = {}
+
+def _low_pass_filter(factor: int) -> np.ndarray:
+    """ Windowed-sinc low-pass filter with the cutoff at the Nyquist frequency of the decimated signal. """
+    if factor not in _low_pass_filters:
+        taps = np.arange(RESAMPLE_FILTER_TAPS) - (RESAMPLE_FILTER_TAPS - 1) / 2
+        kernel = np.sinc(taps / factor) * np.hamming(RESAMPLE_FILTER_TAPS)
+        _low_pass_filters[factor] = (kernel / kernel.sum()).astype(np.float32)
+    return _low_pass_filters[factor]
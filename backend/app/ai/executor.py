@@ -0,0 +1,109 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import settings
+from app.exceptions.inference_exceptions import InferenceQueueFullError
+from app.utils.logging import AppLogger
+from app.utils.metrics import inference_pending, inference_queue_wait_seconds
+
+logger = AppLogger().get_logger()
+
+class InferenceExecutor:
+    """
+    Runs blocking model inference on dedicated worker threads, so it never blocks the event loop.
+
+    Work beyond the worker count waits in a bounded queue. When the queue is full, new work is rejected
+    right away with `InferenceQueueFullError`, so callers can answer with 503 and Retry-After instead of stalling.
+
+    Attributes:
+        name (str): Name of the model, used in logs and errors.
+        max_workers (int): Number of worker threads.
+        max_queue_size (int): Number of calls allowed to wait for a worker.
+        retry_after (int): Seconds suggested to rejected callers.
+
+    Methods:
+        run(fn, *args, **kwargs): Awaitable that runs `fn` on a worker thread.
+
+    Example:
+        >>> executor = InferenceExecutor("whisper", max_queue_size=8)
+        >>> segments, info = await executor.run(model.transcribe_from_blob, blob=blob)
+    """
+
+    def __init__(self, name: str, max_workers: int = 1, max_queue_size: int = 8, retry_after: int = 5):
+        """
+        Parameters:
+            name (str): Name of the model, used in logs and errors.
+            max_workers (int): Number of worker threads. Default is 1, as one model instance runs one call at a time.
+            max_queue_size (int): Number of calls allowed to wait for a worker. Default is 8.
+            retry_after (int): Seconds suggested to rejected callers. Default is 5.
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-inference")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._queue_wait_seconds = inference_queue_wait_seconds.labels(name)
+        inference_pending.labels(name).set_function(lambda: self._pending)
+
+    @property
+    def pending(self) -> int:
+        """ Number of running and queued calls """
+        return self._pending
+
+    @property
+    def is_busy(self) -> bool:
+        """ True when every worker is running a call """
+        return self._pending >= self.max_workers
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` on a worker thread and waits for the result.
+
+        Raises:
+            InferenceQueueFullError: If all workers are busy and the queue is full.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue_size:
+                logger.warning(f"{self.name} inference queue is full ({self._pending} pending)")
+                raise InferenceQueueFullError(self.name, self.retry_after)
+            self._pending += 1
+
+        # Copy the context so langfuse observations and logging context follow the call into the thread
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, self._timed, time.perf_counter(), functools.partial(fn, *args, **kwargs))
+        # Release the slot when the work is actually done, not when the caller stops waiting
+        future.add_done_callback(self._release)
+
+        return await asyncio.wrap_future(future)
+
+    def _timed(self, submitted: float, fn):
+        self._queue_wait_seconds.observe(time.perf_counter() - submitted)
+        return fn()
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self, wait: bool = True):
+        """ Stops the worker threads """
+        self._executor.shutdown(wait=wait)
+
+whisper_executor = InferenceExecutor(
+    "whisper",
+    # One worker per call the whisper replicas can run at the same time
+    max_workers=settings.whisper_replicas * settings.whisper_num_workers,
+    max_queue_size=settings.whisper_queue_size,
+    retry_after=settings.inference_retry_after_seconds
+)
+
+llm_executor = InferenceExecutor(
+    "llm",
+    max_queue_size=settings.llm_queue_size,
+    retry_after=settings.inference_retry_after_seconds
+)
@@ -0,0 +1,243 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+from app.config import settings
+from app.utils.logging import AppLogger
+
+logger = AppLogger().get_logger()
+
+MODEL_STATE_UNLOADED = "unloaded"
+MODEL_STATE_LOADING = "loading"
+MODEL_STATE_LOADED = "loaded"
+MODEL_STATE_UNLOADING = "unloading"
+MODEL_STATE_FAILED = "failed"
+
+@dataclass
+class RegisteredModel:
+    """
+    name (str): model name
+    load (Callable[[], None]): loads the weights
+    unload (Callable[[], None]): frees the weights
+    memory_mb (int): estimated RAM/VRAM footprint of the loaded model
+    """
+    name: str
+    load: Callable[[], None]
+    unload: Callable[[], None]
+    memory_mb: int
+    state: str = MODEL_STATE_UNLOADED
+    in_use: int = 0
+    last_used: float = 0.0
+    load_count: int = 0
+    error: Optional[str] = None
+
+class ModelRegistry:
+    """
+    Central registry of the AI models, loading them lazily and unloading idle ones under a memory budget.
+
+    Models are loaded on first use or in the background by `warmup`. When loading a model would exceed
+    `memory_budget_mb`, least recently used models that are not running a call are unloaded first.
+
+    Attributes:
+        memory_budget_mb (int): Budget for the estimated footprint of loaded models, 0 for no limit.
+
+    Methods:
+        register(name, load, unload, memory_mb): Registers a model.
+        use(name): Context manager loading the model if needed and protecting it from eviction meanwhile.
+        load(name): Loads a model, blocking.
+        load_async(name): Loads a model on a thread.
+        unload(name): Unloads a model.
+        warmup(names): Loads models on a background thread.
+        is_ready(): Whether the warmup models are loaded.
+        status(): State of each model.
+
+    Example:
+        >>> model_registry.register("whisper", load=model.load_model, unload=model.unload_model, memory_mb=4000)
+        >>> with model_registry.use("whisper"):
+        >>>     model.model.transcribe(audio)
+    """
+
+    def __init__(self, memory_budget_mb: int = 0):
+        self.memory_budget_mb = memory_budget_mb
+        self._models: Dict[str, RegisteredModel] = {}
+        # Guards the bookkeeping only, held briefly
+        self._state_lock = threading.Lock()
+        # Serializes loading and unloading, held for the whole load
+        self._load_lock = threading.Lock()
+        self._warmup_names: List[str] = []
+        self._warmup_thread: Optional[threading.Thread] = None
+
+    def __contains__(self, name: str):
+        return name in self._models
+
+    def register(self, name: str, load: Callable[[], None], unload: Callable[[], None], memory_mb: int = 0):
+        """
+        Registers a model without loading it.
+
+        Parameters:
+            name (str): Model name
+            load (Callable[[], None]): Loads the weights
+            unload (Callable[[], None]): Frees the weights
+            memory_mb (int): Estimated footprint of the loaded model
+        """
+        self._models[name] = RegisteredModel(name=name, load=load, unload=unload, memory_mb=memory_mb)
+
+    @contextmanager
+    def use(self, name: str):
+        """
+        Loads the model if needed and keeps it from being evicted until the block exits.
+        Blocking, call it from inference worker threads.
+        """
+        model = self._models[name]
+        while True:
+            with self._state_lock:
+                if model.state == MODEL_STATE_LOADED:
+                    model.in_use += 1
+                    model.last_used = time.monotonic()
+                    break
+            self.load(name)
+
+        try:
+            yield
+        finally:
+            with self._state_lock:
+                model.in_use -= 1
+                model.last_used = time.monotonic()
+
+    def load(self, name: str):
+        """
+        Loads a model, unloading least recently used idle models first if the memory budget requires it.
+
+        Raises:
+            Exception: Whatever the loader raised, the model is marked as failed.
+        """
+        model = self._models[name]
+        with self._load_lock:
+            with self._state_lock:
+                if model.state == MODEL_STATE_LOADED:
+                    return
+                evicted = self._select_evictions(model)
+                for other in evicted:
+                    other.state = MODEL_STATE_UNLOADING
+                model.state = MODEL_STATE_LOADING
+
+            for other in evicted:
+                self._unload(other)
+
+            logger.info(f"{name} model loading...")
+            started = time.monotonic()
+            try:
+                model.load()
+            except Exception as e:
+                logger.error(f"{name} model failed to load: {e}")
+                with self._state_lock:
+                    model.state = MODEL_STATE_FAILED
+                    model.error = str(e)
+                raise
+
+            with self._state_lock:
+                model.state = MODEL_STATE_LOADED
+                model.error = None
+                model.last_used = time.monotonic()
+                model.load_count += 1
+            logger.info(f"{name} model loaded in {time.monotonic() - started:.1f} seconds")
+
+    async def load_async(self, name: str):
+        """
+        Loads a model on a thread, so the event loop is not blocked. Returns right away if it is loaded.
+        """
+        model = self._models[name]
+        if model.state == MODEL_STATE_LOADED:
+            model.last_used = time.monotonic()
+            return
+        await asyncio.to_thread(self.load, name)
+
+    def unload(self, name: str) -> bool:
+        """
+        Unloads a model unless it is running a call.
+
+        Returns:
+            bool: True if the model was unloaded
+        """
+        model = self._models[name]
+        with self._load_lock:
+            with self._state_lock:
+                if model.state != MODEL_STATE_LOADED or model.in_use:
+                    return False
+                model.state = MODEL_STATE_UNLOADING
+            self._unload(model)
+        return True
+
+    def _select_evictions(self, model: RegisteredModel) -> List[RegisteredModel]:
+        if not self.memory_budget_mb:
+            return []
+
+        loaded = [other for other in self._models.values() if other.state == MODEL_STATE_LOADED]
+        used_mb = sum(other.memory_mb for other in loaded)
+        candidates = sorted((other for other in loaded if not other.in_use), key=lambda other: other.last_used)
+
+        evicted = []
+        while used_mb + model.memory_mb > self.memory_budget_mb and candidates:
+            other = candidates.pop(0)
+            evicted.append(other)
+            used_mb -= other.memory_mb
+
+        if used_mb + model.memory_mb > self.memory_budget_mb:
+            logger.warning(f"Loading {model.name} exceeds the model memory budget ({used_mb + model.memory_mb} > {self.memory_budget_mb} MB), models in use can't be unloaded")
+        return evicted
+
+    def _unload(self, model: RegisteredModel):
+        logger.info(f"{model.name} model unloading...")
+        try:
+            model.unload()
+        finally:
+            with self._state_lock:
+                model.state = MODEL_STATE_UNLOADED
+
+    def warmup(self, names: Iterable[str]):
+        """
+        Loads models one after another on a background thread. Readiness waits for them.
+
+        Parameters:
+            names (Iterable[str]): Model names
+        """
+        names = [name for name in names if name]
+        for name in names:
+            if name not in self._models:
+                raise KeyError(f"Unknown model {name}")
+            if name not in self._warmup_names:
+                self._warmup_names.append(name)
+
+        def load_all():
+            for name in names:
+                try:
+                    self.load(name)
+                except Exception:
+                    # Already logged, the model stays failed and readiness reports it
+                    pass
+
+        self._warmup_thread = threading.Thread(target=load_all, name="model-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def is_ready(self) -> bool:
+        """ True when every warmup model has been loaded once, models evicted later are loaded again on use """
+        return all(self._models[name].load_count and self._models[name].state != MODEL_STATE_FAILED for name in self._warmup_names)
+
+    def status(self) -> Dict[str, dict]:
+        """ State of each registered model """
+        return {
+            name: {
+                "state": model.state,
+                "memory_mb": model.memory_mb,
+                "in_use": model.in_use,
+                "load_count": model.load_count,
+                "idle_seconds": round(time.monotonic() - model.last_used, 1) if model.last_used else None,
+                "error": model.error,
+            }
+            for name, model in self._models.items()
+        }
+
+model_registry = ModelRegistry(memory_budget_mb=settings.model_memory_budget_mb)
@@ -0,0 +1,3 @@
+from app.ai.model_server.server import main
+
+main()
@@ -0,0 +1,243 @@
+import asyncio
+import itertools
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import app.constants as constants
+import numpy as np
+from app.ai.model_server import protocol
+from app.ai.models.faster_whisper import FasterWhisperModel
+from app.config import settings
+from app.exceptions.inference_exceptions import InferenceQueueFullError, ModelServerError
+from app.utils.logging import AppLogger
+
+logger = AppLogger().get_logger()
+
+class ModelServerClient:
+    """
+    Connection of an API worker process to the model server, check `ModelServer`.
+
+    One Unix-domain socket carries all requests of the process, answers are matched by request id.
+    The connection is opened on first use and opened again after the server restarts.
+
+    Attributes:
+        path (str): Path of the model server socket.
+        loop (asyncio.AbstractEventLoop): Event loop of the connection, set by the first `connect` even when it fails.
+
+    Methods:
+        connect(): Opens the connection, raises `ModelServerError` if the server can't be reached. Requests connect lazily too.
+        close(): Closes the connection.
+        request(method, args, payload): Awaitable returning the result of a request.
+        request_stream(method, args): Yields the tokens of a streamed request.
+
+    Example:
+        >>> client = ModelServerClient("/tmp/model-server.sock")
+        >>> segments, info = await client.request(protocol.METHOD_TRANSCRIBE, {"cfg": cfg}, audio)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Queue] = {}
+        self._ids = itertools.count()
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    async def connect(self):
+        # Kept when the server is not up yet, blocking callers submit their requests to it and they connect then
+        self.loop = asyncio.get_running_loop()
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                raise ModelServerError(f"can't connect to {self.path}: {e}")
+            self._reader_task = asyncio.create_task(self._read())
+            logger.info(f"Connected to model server at {self.path}")
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+
+    async def _read(self):
+        try:
+            while True:
+                header, _ = await protocol.read_message(self._reader)
+                queue = self._pending.get(header["id"])
+                if queue is not None:
+                    queue.put_nowait(header)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.warning(f"Model server connection lost: {e}")
+        finally:
+            # Waiting requests fail, the next request connects again
+            self._writer = None
+            for queue in self._pending.values():
+                queue.put_nowait({"error": {"type": "ConnectionError", "message": "connection to the model server was lost"}})
+
+    async def _send(self, header: dict, payload=b""):
+        if self._writer is None:
+            await self.connect()
+        self._writer.writelines(protocol.encode_message(header, payload))
+        async with self._write_lock:
+            await self._writer.drain()
+
+    async def request(self, method: str, args: dict | None = None, payload=b""):
+        """
+        Parameters:
+            method (str): Request method, e.g. `protocol.METHOD_TRANSCRIBE`
+            args (Optional[dict]): Picklable arguments
+            payload (bytes | np.ndarray): Binary payload, e.g. audio samples, sent without copying
+
+        Returns:
+            The result of the request.
+
+        Raises:
+            InferenceQueueFullError: If the inference queue of the model server is full.
+            ModelServerError: If the model server can't be reached or the request failed.
+        """
+        request_id, queue = await self._start(method, args, payload)
+        done = False
+        try:
+            while True:
+                header = await self._receive(method, queue)
+                if "result" in header:
+                    done = True
+                    return header["result"]
+        except (InferenceQueueFullError, ModelServerError):
+            done = True
+            raise
+        finally:
+            await self._finish(request_id, done)
+
+    async def request_stream(self, method: str, args: dict | None = None) -> AsyncIterator[str]:
+        """
+        Yields the tokens of a streamed request. The request is cancelled on the server when iteration stops early.
+        """
+        request_id, queue = await self._start(method, args)
+        done = False
+        try:
+            while True:
+                header = await self._receive(method, queue)
+                if "result" in header:
+                    done = True
+                    return
+                yield header["token"]
+        except (InferenceQueueFullError, ModelServerError):
+            done = True
+            raise
+        finally:
+            await self._finish(request_id, done)
+
+    async def _start(self, method: str, args: dict | None, payload=b""):
+        request_id = next(self._ids)
+        queue = asyncio.Queue()
+        self._pending[request_id] = queue
+        try:
+            await self._send({"id": request_id, "method": method, "args": args or {}}, payload)
+        except (OSError, AttributeError) as e:
+            self._pending.pop(request_id, None)
+            raise ModelServerError(f"can't send {method} request: {e}")
+        return request_id, queue
+
+    @staticmethod
+    async def _receive(method: str, queue: asyncio.Queue) -> dict:
+        header = await queue.get()
+        error = header.get("error")
+        if error is None:
+            return header
+        if error["type"] == "InferenceQueueFullError":
+            raise InferenceQueueFullError(error["name"], error["retry_after"])
+        raise ModelServerError(f"{method} failed with {error['type']}: {error['message']}")
+
+    async def _finish(self, request_id: int, done: bool):
+        self._pending.pop(request_id, None)
+        if not done and self._writer is not None:
+            # Stops work nobody waits for anymore, e.g. a generation whose client went away
+            try:
+                await self._send({"id": request_id, "method": protocol.METHOD_CANCEL})
+            except Exception:
+                pass
+
+class RemoteWhisperModel:
+    """
+    Stands in for `FasterWhisperModel` in API worker processes, transcriptions run in the model server.
+    `transcribe_from_array` blocks like the local model, so it runs on `whisper_executor` the same way.
+
+    Methods:
+        transcribe_from_array(audio, cfg, on_segment): Transcribes 16 kHz float32 samples in the model server.
+        detect_language(audio, max_seconds): Detects the language of 16 kHz float32 samples in the model server.
+        effective_config(cfg): Returns the transcription settings used for `cfg`.
+    """
+
+    effective_config = staticmethod(FasterWhisperModel.effective_config)
+
+    def __init__(self, client: ModelServerClient, model_size: str, compute_type: str):
+        self.client = client
+        self.name = constants.WHISPER_MODEL_NAME
+        self.model_size = model_size
+        self.compute_type = compute_type
+
+    def transcribe_from_array(self, audio: np.ndarray, cfg=None, on_segment: Callable | None = None):
+        segments, info = self._request(protocol.METHOD_TRANSCRIBE, {"cfg": cfg}, audio)
+        if on_segment:
+            # The model server answers with all segments at once
+            for segment in segments:
+                on_segment(segment)
+        return segments, info
+
+    def detect_language(self, audio: np.ndarray, max_seconds: float = 30):
+        return self._request(protocol.METHOD_DETECT_LANGUAGE, {"max_seconds": max_seconds}, audio)
+
+    def _request(self, method: str, args: dict, audio: np.ndarray):
+        # Runs on the loop of the client, which connects on the first request when the server was not up at startup
+        if self.client.loop is None:
+            raise ModelServerError("the model server client was never started, `connect` runs at app startup")
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        return asyncio.run_coroutine_threadsafe(self.client.request(method, args, audio), self.client.loop).result()
+
+class RemoteLLM:
+    """
+    Stands in for `NorskLlama38b` in API worker processes, generation runs in the model server.
+    Langfuse prompt clients are sent as prompt name and version.
+
+    Methods:
+        invoke(prompt, cfg, langfuse_args, prefix): Awaitable returning the generated text.
+        stream(prompt, cfg, langfuse_args, prefix): Yields the generated text as it is generated.
+        count_tokens(texts): Awaitable returning the number of tokens of each text.
+    """
+
+    def __init__(self, client: ModelServerClient, name: str = constants.NORSK_LLAMA3_MODEL_NAME, model_id: str = constants.NORSK_LLAMA3_MODEL):
+        self.client = client
+        self.name = name
+        self.model_id = model_id
+
+    async def invoke(self, prompt: str, cfg=None, langfuse_args: dict | None = None, prefix: str | None = None) -> str:
+        return await self.client.request(protocol.METHOD_GENERATE, self._args(prompt, cfg, langfuse_args, prefix))
+
+    async def stream(self, prompt: str, cfg=None, langfuse_args: dict | None = None, prefix: str | None = None) -> AsyncIterator[str]:
+        async for token in self.client.request_stream(protocol.METHOD_STREAM, self._args(prompt, cfg, langfuse_args, prefix)):
+            yield token
+
+    async def count_tokens(self, texts: List[str]) -> List[int]:
+        return await self.client.request(protocol.METHOD_COUNT_TOKENS, {"texts": texts})
+
+    @staticmethod
+    def _args(prompt: str, cfg, langfuse_args: dict | None, prefix: str | None) -> dict:
+        langfuse_args = dict(langfuse_args or {})
+        prompt_client = langfuse_args.pop("prompt", None)
+        return {
+            "prompt": prompt,
+            "cfg": cfg,
+            "prefix": prefix,
+            "langfuse_args": langfuse_args,
+            "prompt_name": getattr(prompt_client, "name", None),
+            "prompt_version": getattr(prompt_client, "version", None),
+        }
+
+model_server_client = ModelServerClient(settings.model_server_socket) if settings.model_server_socket else None
@@ -0,0 +1,39 @@
+import asyncio
+import pickle
+import struct
+from typing import Any, Tuple
+
+# Header length and payload length of a message
+FRAME = struct.Struct("<II")
+
+# Requests, check `ModelServer` for their arguments and results
+METHOD_TRANSCRIBE = "transcribe"
+METHOD_DETECT_LANGUAGE = "detect_language"
+METHOD_GENERATE = "generate"
+METHOD_STREAM = "stream"
+METHOD_COUNT_TOKENS = "count_tokens"
+METHOD_STATUS = "status"
+METHOD_WARMUP = "warmup"
+METHOD_METRICS = "metrics"
+METHOD_CANCEL = "cancel"
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[dict, bytes]:
+    """
+    Reads one message: a pickled header dict followed by a raw binary payload (e.g. float32 audio samples).
+    The payload is kept out of the header, so audio is neither base64 encoded nor pickled.
+
+    Raises:
+        asyncio.IncompleteReadError: If the other side closed the connection.
+    """
+    header_length, payload_length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    header = pickle.loads(await reader.readexactly(header_length))
+    payload = await reader.readexactly(payload_length) if payload_length else b""
+    return header, payload
+
+def encode_message(header: dict, payload: Any = b"") -> list:
+    """
+    Encodes a message as buffers for `StreamWriter.writelines`, the payload buffer (bytes, or e.g. a numpy array) is not copied.
+    """
+    data = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+    payload = memoryview(payload).cast("B")
+    return [FRAME.pack(len(data), len(payload)), data, payload] if len(payload) else [FRAME.pack(len(data), 0), data]
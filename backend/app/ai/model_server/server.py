@@ -0,0 +1,164 @@
+import asyncio
+import os
+from typing import Dict
+
+import app.constants as constants
+import numpy as np
+from app.ai.executor import whisper_executor
+from app.ai.model_registry import model_registry
+from app.ai.model_server import protocol
+from app.ai.models.faster_whisper import FasterWhisperModel, faster_whisper_model
+from app.ai.models.llms.norsk_llama3_8b import NorskLlama38b
+from app.ai.models.llms.norsk_llama3_8b import model as norsk_llama3_8b
+from app.ai.prompts import prompt_registry
+from app.config import settings
+from app.exceptions.inference_exceptions import InferenceQueueFullError
+from app.utils.logging import AppLogger
+from app.utils.metrics import metrics_registry
+
+logger = AppLogger().get_logger()
+
+class ModelServer:
+    """
+    Owns the models and serves them to the API worker processes over a Unix-domain socket, check `protocol`.
+
+    The API tier can then run several worker processes without each loading its own copy of the models, and
+    request parsing and websocket handling don't share a GIL with inference. Requests of all workers meet
+    in one process, so concurrent generations are still batched together.
+
+    Every connection can have many requests in flight, each one runs in its own task and is answered by id.
+    Errors are sent back by type, an `InferenceQueueFullError` is raised again in the worker.
+
+    Attributes:
+        path (str): Path of the socket.
+        whisper (FasterWhisperModel): Transcription model.
+        llm (NorskLlama38b): Generation model.
+
+    Methods:
+        serve(): Listens on the socket until cancelled.
+    """
+
+    def __init__(self, path: str, whisper: FasterWhisperModel, llm: NorskLlama38b):
+        self.path = path
+        self.whisper = whisper
+        self.llm = llm
+        self._handlers = {
+            protocol.METHOD_TRANSCRIBE: self._transcribe,
+            protocol.METHOD_DETECT_LANGUAGE: self._detect_language,
+            protocol.METHOD_GENERATE: self._generate,
+            protocol.METHOD_STREAM: self._stream,
+            protocol.METHOD_COUNT_TOKENS: self._count_tokens,
+            protocol.METHOD_STATUS: self._status,
+            protocol.METHOD_WARMUP: self._warmup,
+            protocol.METHOD_METRICS: self._metrics,
+        }
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self._handle_connection, path=self.path)
+        # Results are pickled, only the user running the server may connect
+        os.chmod(self.path, 0o600)
+        logger.info(f"Model server listening on {self.path}")
+
+        prompt_registry.warmup([
+            (constants.LANGFUSE_PROMPT_NORSK_SUMMARIZATION_DEFAULT, None),
+            (constants.LANGFUSE_PROMPT_NORSK_CHUNK_SUMMARIZATION, None)
+        ])
+        model_registry.warmup(name.strip() for name in settings.model_warmup.split(","))
+
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks: Dict[int, asyncio.Task] = {}
+        write_lock = asyncio.Lock()
+
+        async def send(header: dict):
+            # Messages are written whole, the lock only serializes waiting for the socket buffer
+            writer.writelines(protocol.encode_message(header))
+            async with write_lock:
+                await writer.drain()
+
+        try:
+            while True:
+                header, payload = await protocol.read_message(reader)
+                if header["method"] == protocol.METHOD_CANCEL:
+                    task = tasks.get(header["id"])
+                    if task is not None:
+                        task.cancel()
+                    continue
+
+                task = asyncio.create_task(self._dispatch(header, payload, send))
+                tasks[header["id"]] = task
+                task.add_done_callback(lambda _, request_id=header["id"]: tasks.pop(request_id, None))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # The worker is gone, nobody waits for the results
+            for task in tasks.values():
+                task.cancel()
+            writer.close()
+
+    async def _dispatch(self, header: dict, payload: bytes, send):
+        request_id = header["id"]
+        try:
+            result = await self._handlers[header["method"]](request_id, header.get("args", {}), payload, send)
+            await send({"id": request_id, "result": result})
+        except asyncio.CancelledError:
+            pass
+        except InferenceQueueFullError as e:
+            await send({"id": request_id, "error": {"type": "InferenceQueueFullError", "name": e.name, "retry_after": e.retry_after, "message": e.message}})
+        except Exception as e:
+            logger.error(f"Model server request {header['method']} failed: {e}")
+            await send({"id": request_id, "error": {"type": type(e).__name__, "message": str(e)}})
+
+    async def _transcribe(self, request_id: int, args: dict, payload: bytes, send):
+        audio = np.frombuffer(payload, dtype=np.float32)
+        return await whisper_executor.run(self.whisper.transcribe_from_array, audio, cfg=args.get("cfg"))
+
+    async def _detect_language(self, request_id: int, args: dict, payload: bytes, send):
+        audio = np.frombuffer(payload, dtype=np.float32)
+        return await whisper_executor.run(self.whisper.detect_language, audio, max_seconds=args.get("max_seconds", 30))
+
+    async def _generate(self, request_id: int, args: dict, payload: bytes, send):
+        return await self.llm.invoke(prompt=args["prompt"], cfg=args.get("cfg"), langfuse_args=self._langfuse_args(args), prefix=args.get("prefix"))
+
+    async def _stream(self, request_id: int, args: dict, payload: bytes, send):
+        tokens = []
+        async for token in self.llm.stream(prompt=args["prompt"], cfg=args.get("cfg"), langfuse_args=self._langfuse_args(args), prefix=args.get("prefix")):
+            tokens.append(token)
+            await send({"id": request_id, "token": token})
+        return "".join(tokens)
+
+    async def _count_tokens(self, request_id: int, args: dict, payload: bytes, send):
+        return await self.llm.count_tokens(args["texts"])
+
+    async def _status(self, request_id: int, args: dict, payload: bytes, send):
+        return {"ready": model_registry.is_ready(), "models": model_registry.status()}
+
+    async def _warmup(self, request_id: int, args: dict, payload: bytes, send):
+        unknown = [name for name in args["models"] if name not in model_registry]
+        if unknown:
+            raise ValueError(f"Unknown models: {', '.join(unknown)}")
+        model_registry.warmup(args["models"])
+        return model_registry.status()
+
+    async def _metrics(self, request_id: int, args: dict, payload: bytes, send):
+        return metrics_registry.collect(labels={"process": "model_server"})
+
+    @staticmethod
+    def _langfuse_args(args: dict) -> dict:
+        # Langfuse prompt clients stay in their process, the prompt is looked up again by name and version
+        langfuse_args = dict(args.get("langfuse_args") or {})
+        if args.get("prompt_name"):
+            langfuse_args["prompt"] = prompt_registry.get(name=args["prompt_name"], version=args.get("prompt_version"))
+        return langfuse_args
+
+def main():
+    if not settings.model_server_socket:
+        raise SystemExit("MODEL_SERVER_SOCKET is not set")
+    asyncio.run(ModelServer(settings.model_server_socket, faster_whisper_model, norsk_llama3_8b).serve())
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,104 @@
-import base64
-import tempfile
-import io
-from pydub import AudioSegment
-from typing import List
-from faster_whisper import WhisperModel
+import gc
+import os
+from typing import Callable, Dict, List, Tuple
+
+import app.constants as constants
+import numpy as np
+from app.ai.audio import SAMPLE_RATE, decode_audio_file, decode_base64_audio
+from app.ai.model_registry import model_registry
+from app.ai.replica_pool import ReplicaPool
+from app.config import settings
+from app.utils.logging import ElapsedTimer
+from app.utils.metrics import audio_concat_seconds, whisper_audio_seconds, whisper_decode_seconds, whisper_language_detection_seconds, whisper_vad_seconds
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from faster_whisper.vad import get_speech_timestamps
 
 class FasterWhisperModel:
     """
     A class for transcribing audio files using a pretrained Whisper model,
     with support for various model sizes and configurations.
+    The weights are loaded lazily through `model_registry`, which may also unload them while idle.
+
+    Several replicas of the model can be loaded, spread over device indices on GPU or over the cores on CPU.
+    Each transcription runs on the least loaded replica, so concurrent transcriptions don't serialize on one model.
+
+    Long recordings are split into windows at VAD boundaries and the windows are decoded in batches,
+    instead of one window after another.
 
     Attributes:
+        name (str): Name of the model in `model_registry`.
         model_size (str): Size of the Whisper model to be loaded. Default is "large-v3".
-        device (str): The device type ('cuda' or 'cpu') on which the model will operate.
-        compute_type (str): The precision ('float16' or 'float32') for computation.
-        model (WhisperModel): The loaded Whisper model object, ready for transcriptions.
+        device (str): The device type ('cuda', 'cpu' or 'auto') on which the model will operate.
+        compute_type (str): The precision ('float16', 'float32', 'int8', 'int8_float16', 'int8_float32', ...) for computation.
+        cpu_threads (int): Threads per replica on CPU, 0 to split the cores between the replicas.
+        num_workers (int): Concurrent transcriptions each replica accepts.
+        replicas (int): Number of model replicas.
+        device_index (int | List[int]): Device index, or indices the replicas are spread over.
+        pool (ReplicaPool[WhisperModel]): The loaded replicas, None while the model is not loaded.
 
     Methods:
-        load_model(): Loads the Whisper model based on the initialization parameters.
-        transcribe(path, cfg): Transcribes the audio file at the given path using the specified or default configuration.
+        load_model(): Loads the Whisper model replicas based on the initialization parameters.
+        unload_model(): Frees the Whisper model replicas.
+        transcribe_from_file(path, cfg, on_segment): Transcribes the audio file at the given path using the specified or default configuration.
+        transcribe_from_array(audio, cfg, on_segment): Transcribes already decoded 16 kHz float32 samples.
+        detect_language(audio, max_seconds): Returns the language probabilities of the speech in decoded samples.
+        effective_config(cfg): Returns the transcription settings used for `cfg`.
     """
 
-    def __init__(self, model_size: str = "large-v3", device="cuda", compute_type="float16"):
+    def __init__(self, model_size: str = "large-v3", device="cuda", compute_type="float16", cpu_threads: int = 0, num_workers: int = 1, replicas: int = 1, device_index: int | List[int] = 0, name: str = constants.WHISPER_MODEL_NAME):
         """
-        Initializes the FasterWhisperModel instance by setting up the model configuration
-        and loading the Whisper model.
+        Initializes the FasterWhisperModel instance by setting up the model configuration.
+        The Whisper model is not loaded yet.
 
         Parameters:
             model_size (str): The size of the Whisper model to load. Default is "large-v3".
             device (str): The computation device ('cuda' or 'cpu'). Default is 'cuda'.
-            compute_type (str): The precision of computation ('float16' or 'float32'). Default is 'float16'.
+            compute_type (str): The precision of computation ('float16', 'int8', 'int8_float32', ...). Default is 'float16'.
+            cpu_threads (int): Threads per replica on CPU. Default is 0, the cores are split between the replicas.
+            num_workers (int): Concurrent transcriptions each replica accepts. Default is 1.
+            replicas (int): Number of model replicas. Default is 1.
+            device_index (int | List[int]): Device index, or indices the replicas are spread over. Default is 0.
+            name (str): Name of the model in `model_registry`.
         """
+        self.name = name
         self.model_size = model_size
         self.device = device
         self.compute_type = compute_type
-        self.load_model()
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.replicas = replicas
+        self.device_index = device_index
+        self.pool = None
 
     def load_model(self):
-        """ Loads the Whisper model based on the initialized parameters. """
-        self.model = WhisperModel(self.model_size, device=self.device, compute_type=self.compute_type)
+        """ Loads the Whisper model replicas based on the initialized parameters. """
+        device_indices = self.device_index if isinstance(self.device_index, list) else [self.device_index]
+        cpu_threads = self.cpu_threads
+        if not cpu_threads and self.replicas > 1:
+            # Without a limit every replica would use all cores and they would compete for them
+            cpu_threads = max(1, (os.cpu_count() or 1) // self.replicas)
+
+        self.pool = ReplicaPool([
+            WhisperModel(
+                self.model_size,
+                device=self.device,
+                device_index=device_indices[replica % len(device_indices)],
+                compute_type=self.compute_type,
+                cpu_threads=cpu_threads,
+                num_workers=self.num_workers
+            )
+            for replica in range(self.replicas)
+        ])
+
+    def unload_model(self):
+        """ Frees the Whisper model replicas, they are loaded again on next use. """
+        self.pool = None
+        gc.collect()
 
     def transcribe_from_blobs(self, blobs: List[str] | None, cfg=None):
         """
         Transcribes an audio file from list of blobs by concatenating blobs into one.
+        Blobs are decoded and concatenated in memory, nothing is written to disk.
 
         Parameters:
             blob (List[str]): List of base64 encoded blob bytes
@@ -51,33 +107,16 @@ class FasterWhisperModel:
         Returns:
             tuple: Returns a tuple containing the segmentation data and metadata about the transcription. For more information, check `transcribe_from_file` documentation.
         """
+        audio = [decode_base64_audio(base64_blob) for base64_blob in blobs or []]
+        with audio_concat_seconds.time():
+            combined_audio = np.concatenate(audio) if audio else np.zeros(0, dtype=np.float32)
 
-        # Start with an empty audio segment
-        combined_audio = AudioSegment.silent(duration=0)
-        
-        # Decode and load each blob into pydub's AudioSegment and concatenate
-        for base64_blob in blobs:
-            # Decode base64 string to bytes
-            audio_bytes = base64.b64decode(base64_blob)
-            
-            # Create an AudioSegment from these bytes
-            audio_segment = AudioSegment.from_file(io.BytesIO(audio_bytes), format="wav")
-            
-            # Concatenate audio segments
-            combined_audio += audio_segment
-
-        # Create a temporary file to save the concatenated audio so it can be read by another process or function
-        with tempfile.NamedTemporaryFile(suffix='.wav') as fp:
-            combined_audio.export(fp.name, format='wav')
-            # Ensure the file is written and ready for other processes to read
-            fp.flush()
-            
-            # Now you can pass the filename to the transcription function
-            return self.transcribe_from_file(fp.name, cfg=cfg)
+        return self.transcribe_from_array(combined_audio, cfg=cfg)
 
     def transcribe_from_blob(self, blob: str | None = None, cfg=None):
         """
         Transcribes an audio file from blob.
+        The blob is decoded in memory, nothing is written to disk.
 
         Parameters:
             blob (str): Base64 encoded blob bytes
@@ -86,19 +125,68 @@ class FasterWhisperModel:
         Returns:
             tuple: Returns a tuple containing the segmentation data and metadata about the transcription. For more information, check `transcribe_from_file` documentation.
         """
-        audio_data = base64.b64decode(blob)
-        with tempfile.NamedTemporaryFile(suffix='.wav') as fp:
-            fp.write(audio_data)
-            fp.flush()
+        return self.transcribe_from_array(decode_base64_audio(blob), cfg=cfg)
+
+    def transcribe_from_array(self, audio: np.ndarray, cfg=None, on_segment: Callable | None = None):
+        """
+        Transcribes decoded audio without touching the disk.
+
+        Parameters:
+            audio (np.ndarray): Mono float32 samples at 16 kHz
+            cfg (Optional[dict]):  A dictionary containing configuration settings that overwrite default settings. For more information, check `transcribe_from_file` documentation.
+            on_segment (Optional[Callable[[Segment], None]]): Called with each segment as soon as it is decoded, check `transcribe_from_file`.
+
+        Returns:
+            tuple: Returns a tuple containing the segmentation data and metadata about the transcription. For more information, check `transcribe_from_file` documentation.
+        """
+        return self.transcribe_from_file(audio, cfg=cfg, on_segment=on_segment)
+
+    def detect_language(self, audio: np.ndarray, max_seconds: float = 30) -> Tuple[Dict[str, float], float]:
+        """
+        Detects the language of the speech in decoded audio, without transcribing it: one encoder pass and one
+        decoder step, against a full beam search with word timestamps for a transcription.
+        Non-speech is removed with VAD first, audio without speech is not encoded at all.
+
+        Parameters:
+            audio (np.ndarray): Mono float32 samples at 16 kHz
+            max_seconds (float): Seconds of speech used at most, Whisper looks at 30 seconds at most
+
+        Returns:
+            tuple: Probability of each language, e.g. {"no": 0.93, "da": 0.04, ...}, empty without speech, and the seconds of speech used
+        """
+        with ElapsedTimer(histogram=whisper_vad_seconds):
+            speech_chunks = get_speech_timestamps(audio)
+        if not speech_chunks:
+            return {}, 0.0
+        speech = np.concatenate([audio[chunk["start"]:chunk["end"]] for chunk in speech_chunks])[:int(max_seconds * SAMPLE_RATE)]
 
-            return self.transcribe_from_file(fp.name, cfg=cfg)
+        with model_registry.use(self.name), self.pool.acquire() as model, ElapsedTimer(histogram=whisper_language_detection_seconds):
+            _, _, probabilities = model.detect_language(audio=speech)
+        return dict(probabilities), len(speech) / SAMPLE_RATE
 
-    def transcribe_from_file(self, path: str = "", cfg=None):
+    @staticmethod
+    def effective_config(cfg=None) -> dict:
+        """
+        Transcription settings used for `cfg`, the defaults overwritten by `cfg`, check `transcribe_from_file`.
+        Keys other than the transcription settings (e.g. websocket settings) are left out.
+        """
+        default_cfg = {
+            "beam_size": 5,
+            "language": "en",
+            "word_timestamps": True,
+            "vad_filter": True,
+            "no_speech_prob": 0.5,
+            "batch_size": None,
+            "initial_prompt": None
+        }
+        return {key: (cfg or {}).get(key, default) for key, default in default_cfg.items()}
+
+    def transcribe_from_file(self, path: str | np.ndarray = "", cfg=None, on_segment: Callable | None = None):
         """
         Transcribes an audio file using the Whisper model, according to the specified configuration.
 
         Parameters:
-            path (str): The file path of the audio to be transcribed. Default is an empty string.
+            path (str | np.ndarray): The file path of the audio to be transcribed, or already decoded 16 kHz samples. Default is an empty string.
             cfg (dict, optional): A dictionary containing configuration settings that overwrite default settings.
                 If None is passed, default settings are used. Default configuration includes:
                     {
@@ -106,22 +194,27 @@ class FasterWhisperModel:
                         "language": "en",
                         "word_timestamps": True,
                         "vad_filter": True
-                        "no_speech_prob": 0.5
+                        "no_speech_prob": 0.5,
+                        "batch_size": None,
+                        "initial_prompt": None
                     }
+                "batch_size" is the number of windows decoded together, 1 decodes sequentially and None decodes
+                audio longer than `WHISPER_LONG_FORM_SECONDS` in batches of `WHISPER_BATCH_SIZE`.
+                "initial_prompt" is text preceding the audio, e.g. the already transcribed part of a stream.
+            on_segment (Optional[Callable[[Segment], None]]): Called from the inference thread with each kept segment
+                as soon as it is decoded, in recording order, e.g. to report progress of a long recording.
 
         Returns:
-            tuple: Returns a tuple containing the segmentation data and metadata about the transcription.
+            tuple: Returns a tuple containing the segmentation data, ordered by start time, and metadata about the transcription.
         """
-        if cfg is None:
-            cfg = {}
-        default_cfg = {
-            "beam_size": 5,
-            "language": "en",
-            "word_timestamps": True,
-            "vad_filter": True,
-            "no_speech_prob": 0.5
-        }
-        final_cfg = {**default_cfg, **cfg}
+        final_cfg = self.effective_config(cfg)
+
+        if isinstance(path, str):
+            path = decode_audio_file(path)
+
+        batch_size = final_cfg["batch_size"]
+        if batch_size is None:
+            batch_size = settings.whisper_batch_size if len(path) >= settings.whisper_long_form_seconds * SAMPLE_RATE else 1
 
         transcribe_params = {
             "audio": path,
@@ -133,8 +226,59 @@ class FasterWhisperModel:
         if final_cfg["language"] != "auto":
             transcribe_params["language"] = final_cfg["language"]
 
-        segments, info = self.model.transcribe(**transcribe_params)
+        if final_cfg["initial_prompt"]:
+            transcribe_params["initial_prompt"] = final_cfg["initial_prompt"]
+
+        # Segments are decoded lazily, the model must stay loaded until they are consumed
+        with model_registry.use(self.name), self.pool.acquire() as model:
+            # VAD runs inside `transcribe`, so it is part of the decode time
+            with ElapsedTimer(histogram=whisper_decode_seconds.labels("batched" if batch_size > 1 else "sequential")):
+                if batch_size > 1:
+                    segments, info = self._transcribe_batched(model, transcribe_params, batch_size)
+                else:
+                    segments, info = model.transcribe(**transcribe_params)
+
+                kept = []
+                for segment in segments:
+                    if segment.no_speech_prob <= final_cfg["no_speech_prob"]:
+                        kept.append(segment)
+                        if on_segment:
+                            on_segment(segment)
+                # Windows are stitched back by their offset in the recording, word timestamps are already absolute
+                segments = sorted(kept, key=lambda segment: segment.start) if batch_size > 1 else kept
+
+        whisper_audio_seconds.inc(len(path) / SAMPLE_RATE)
+        return segments, info
+
+    def _transcribe_batched(self, model: WhisperModel, transcribe_params: dict, batch_size: int):
+        audio = transcribe_params["audio"]
+        if not transcribe_params["vad_filter"]:
+            # Without VAD boundaries the audio is split into fixed windows
+            chunk_length = model.feature_extractor.chunk_length
+            duration = len(audio) / SAMPLE_RATE
+            transcribe_params = {
+                **transcribe_params,
+                "clip_timestamps": [
+                    {"start": start, "end": min(start + chunk_length, duration)}
+                    for start in np.arange(0, duration, chunk_length)
+                ]
+            }
 
-        return [segment for segment in segments if segment.no_speech_prob <= final_cfg["no_speech_prob"]], info
+        # Segments are yielded batch by batch, windows in recording order
+        return BatchedInferencePipeline(model=model).transcribe(**transcribe_params, batch_size=batch_size)
 
-faster_whisper_model = FasterWhisperModel()
\ No newline at end of file
+faster_whisper_model = FasterWhisperModel(
+    model_size=settings.whisper_model_size,
+    device=settings.whisper_device,
+    compute_type=settings.whisper_compute_type,
+    cpu_threads=settings.whisper_cpu_threads,
+    num_workers=settings.whisper_num_workers,
+    replicas=settings.whisper_replicas,
+    device_index=[int(index) for index in settings.whisper_device_index.split(",")]
+)
+model_registry.register(
+    faster_whisper_model.name,
+    load=faster_whisper_model.load_model,
+    unload=faster_whisper_model.unload_model,
+    memory_mb=settings.whisper_memory_mb * settings.whisper_replicas
+)
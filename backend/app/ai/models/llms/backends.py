@@ -0,0 +1,396 @@
+import gc
+import os
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, List
+
+import torch
+import transformers
+from app.ai.models.llms.prefix_cache import PrefixCache
+from app.ai.models.llms.streaming import CallbackStreamer, GenerationTimer, StopOnEvent
+from app.config import settings
+from app.utils.logging import AppLogger
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteriaList
+
+logger = AppLogger().get_logger()
+
+BACKEND_TRANSFORMERS = "transformers"
+BACKEND_CTRANSLATE2 = "ctranslate2"
+
+class GenerationBackend(ABC):
+    """
+    Runs the generation of an `LLM`: loads the weights and the tokenizer, and generates text from prompt tokens.
+
+    Generation configurations use the names of transformers `generate` (max_new_tokens, do_sample, temperature,
+    top_p, top_k, repetition_penalty, eos_token_id), each backend maps them to its own options.
+    The tokenizer is a transformers tokenizer on every backend, so prompts are tokenized the same way.
+
+    Attributes:
+        name (str): Backend name, the value of `LLM_BACKEND`.
+        tokenizer (transformers.PreTrainedTokenizer): Tokenizer of the model, set by `load`.
+        device (str): Device the model runs on, set by `load`.
+
+    Methods:
+        load(model_id, access_token): Loads the model.
+        unload(): Frees the model weights, the tokenizer is kept.
+        generate_batch(input_ids, cfg): Blocking generation of several prompts at once.
+        generate_one(input_ids, cfg, prefix, on_token, stop_event): Blocking generation of one prompt, optionally streamed.
+    """
+    name = ""
+    tokenizer = None
+    device = None
+
+    @abstractmethod
+    def load(self, model_id: str, access_token: str = ""):
+        """ Loads the weights and the tokenizer """
+
+    @abstractmethod
+    def unload(self):
+        """ Frees the model weights, the tokenizer is kept """
+
+    @abstractmethod
+    def generate_batch(self, input_ids: List[List[int]], cfg: dict) -> List[str]:
+        """
+        Parameters:
+            input_ids (List[List[int]]): Prompt tokens of each request
+            cfg (dict): Generation configuration
+
+        Returns:
+            List[str]: Generated text of each request, without the prompt
+        """
+
+    @abstractmethod
+    def generate_one(self, input_ids: List[int], cfg: dict, prefix: str | None = None, on_token: Callable[[str], None] | None = None, stop_event: threading.Event | None = None) -> str:
+        """
+        Parameters:
+            input_ids (List[int]): Prompt tokens
+            cfg (dict): Generation configuration
+            prefix (Optional[str]): Static beginning of the prompt, backends may reuse its model state
+            on_token (Optional[Callable[[str], None]]): Called with each piece of generated text
+            stop_event (Optional[threading.Event]): Stops generation when set
+
+        Returns:
+            str: Generated text, without the prompt
+        """
+
+class TransformersBackend(GenerationBackend):
+    """
+    Generation with a transformers text generation pipeline, bfloat16 weights spread over the devices with `device_map="auto"`.
+
+    Single prompts reuse the cached key/values of their static prefix (check `PrefixCache`), and are decoded
+    speculatively when a draft model is configured (check `load_draft_model`).
+
+    Attributes:
+        pipeline (transformers.Pipeline): The loaded pipeline, None while the model is not loaded.
+        prefix_cache (PrefixCache): Key/values of prompt prefixes.
+        draft_model_id (str): Draft model for speculative decoding, empty for none.
+        draft_lookahead (int): Tokens drafted per step.
+        draft_schedule (str): "heuristic" or "constant" lookahead.
+        draft_model (transformers.PreTrainedModel): The loaded draft model.
+        draft_enabled (bool): Whether single prompts are decoded with the draft model once it is loaded, e.g.
+            False to compare with plain decoding.
+    """
+    name = BACKEND_TRANSFORMERS
+
+    def __init__(self, prefix_cache_mb: int = 0, draft_model_id: str = "", draft_lookahead: int = 5, draft_schedule: str = "heuristic"):
+        self.pipeline = None
+        self.prefix_cache = PrefixCache(max_bytes=prefix_cache_mb * 2 ** 20)
+        self.draft_model_id = draft_model_id
+        self.draft_lookahead = draft_lookahead
+        self.draft_schedule = draft_schedule
+        self.draft_model = None
+        self.draft_enabled = True
+        self._access_token = ""
+        self._draft_kwargs = {}
+        self._draft_forwards = 0
+
+    def load(self, model_id: str, access_token: str = ""):
+        self._access_token = access_token
+        self.pipeline = transformers.pipeline(
+            "text-generation",
+            model=model_id,
+            token=access_token,
+            model_kwargs={"torch_dtype": torch.bfloat16, "low_cpu_mem_usage": True},
+            device_map="auto"
+        )
+        # Batched generation pads prompts on the left, Llama 3 tokenizers have no pad token
+        if self.pipeline.tokenizer.pad_token is None:
+            self.pipeline.tokenizer.pad_token = self.pipeline.tokenizer.eos_token
+        self.pipeline.tokenizer.padding_side = "left"
+        self.tokenizer = self.pipeline.tokenizer
+        self.device = str(self.pipeline.model.device)
+
+        if self.draft_model_id:
+            self.load_draft_model()
+
+    def load_draft_model(self):
+        """
+        Loads the draft model used for speculative decoding of single prompts.
+
+        The draft model proposes `draft_lookahead` tokens, which the model verifies in one forward pass, so
+        every step of the large model yields one or more tokens. With sampling, drafted tokens are accepted
+        by speculative sampling, so the output follows the distribution of the model alone.
+        With the "heuristic" schedule the lookahead grows while all drafted tokens are accepted and shrinks
+        otherwise, with "constant" it stays at `draft_lookahead`.
+        A draft model with another tokenizer works too (universal assisted decoding), but is slower.
+        """
+        target = self.pipeline.model
+        self.draft_model = AutoModelForCausalLM.from_pretrained(
+            self.draft_model_id,
+            token=self._access_token or None,
+            dtype=target.dtype,
+            low_cpu_mem_usage=True
+        ).to(target.device)
+        self.draft_model.generation_config.num_assistant_tokens = self.draft_lookahead
+        self.draft_model.generation_config.num_assistant_tokens_schedule = self.draft_schedule
+        # Every forward pass of the draft model proposes one token
+        self.draft_model.register_forward_hook(self._count_draft_forward)
+
+        self._draft_kwargs = {"assistant_model": self.draft_model}
+        if self.draft_model.config.vocab_size != target.config.vocab_size:
+            self._draft_kwargs["tokenizer"] = self.tokenizer
+            self._draft_kwargs["assistant_tokenizer"] = AutoTokenizer.from_pretrained(self.draft_model_id, token=self._access_token or None)
+        logger.info(f"Loaded draft model {self.draft_model_id} for speculative decoding")
+
+    def _count_draft_forward(self, module, args, output):
+        self._draft_forwards += 1
+
+    def unload(self):
+        """ Frees the model weights, the draft model, and the key/values cached with them """
+        self.prefix_cache.clear()
+        self.draft_model = None
+        self._draft_kwargs = {}
+        self.pipeline = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _generate_kwargs(self, cfg: dict) -> dict:
+        return {
+            "eos_token_id": self.tokenizer.eos_token_id,
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "do_sample": True,
+            **cfg
+        }
+
+    def generate_batch(self, input_ids: List[List[int]], cfg: dict) -> List[str]:
+        """
+        Generates a batch of prompts in one left-padded `generate` call, check `GenerationBackend.generate_batch`.
+        """
+        tokenizer = self.tokenizer
+        batch = tokenizer.pad({"input_ids": input_ids}, padding=True, return_tensors="pt").to(self.pipeline.model.device)
+
+        timer = GenerationTimer("batch")
+        outputs = self.pipeline.model.generate(
+            **batch,
+            stopping_criteria=StoppingCriteriaList([timer]),
+            **self._generate_kwargs(cfg)
+        )
+        generated = outputs[:, batch["input_ids"].shape[1]:]
+        # Sequences that ended early are padded
+        timer.finish(int((generated != tokenizer.pad_token_id).sum()))
+        return tokenizer.batch_decode(generated, skip_special_tokens=True)
+
+    def generate_one(self, input_ids: List[int], cfg: dict, prefix: str | None = None, on_token: Callable[[str], None] | None = None, stop_event: threading.Event | None = None) -> str:
+        """
+        Generates one prompt, reusing the cached key/values of `prefix` when possible.
+        With a draft model, unless `draft_enabled` is False, the prompt is decoded speculatively, check `load_draft_model`.
+        """
+        tokenizer = self.tokenizer
+        model = self.pipeline.model
+        input_tensor = torch.tensor([input_ids], device=model.device)
+
+        # Prefilling a prefix that is not cached yet is part of the prefill time
+        speculative = self.draft_model is not None and self.draft_enabled
+        timer = GenerationTimer("speculative" if speculative else "single")
+        draft_forwards = self._draft_forwards
+        generate_kwargs = {}
+        past_key_values = self.prefix_cache.get(model, tokenizer, prefix, input_ids)
+        if past_key_values is not None:
+            generate_kwargs["past_key_values"] = past_key_values
+
+        stopping_criteria = [timer]
+        if on_token:
+            generate_kwargs["streamer"] = CallbackStreamer(tokenizer, on_token)
+            stopping_criteria.append(StopOnEvent(stop_event or threading.Event()))
+
+        outputs = model.generate(
+            input_tensor,
+            attention_mask=torch.ones_like(input_tensor),
+            stopping_criteria=StoppingCriteriaList(stopping_criteria),
+            # Speculative decoding only works for one sequence, batches are decoded normally
+            **(self._draft_kwargs if speculative else {}),
+            **generate_kwargs,
+            **self._generate_kwargs(cfg)
+        )
+        timer.finish(
+            outputs.shape[1] - input_tensor.shape[1],
+            drafted=self._draft_forwards - draft_forwards if speculative else None
+        )
+        return tokenizer.decode(outputs[0, input_tensor.shape[1]:], skip_special_tokens=True)
+
+class CTranslate2Backend(GenerationBackend):
+    """
+    Generation with a quantized CTranslate2 `Generator`, e.g. int8 weights on CPU nodes, about a quarter of the
+    memory of bfloat16 weights and a lot faster than transformers on CPU.
+
+    The model is converted from its transformers checkpoint on first load and the conversion is kept in
+    `cache_dir`, later loads only read it. Single prompts pass their static prefix as static prompt, so the
+    model state after it is cached by CTranslate2.
+
+    Attributes:
+        compute_type (str): Quantization of the converted weights and compute type, e.g. "int8", "int8_float16".
+        cache_dir (str): Directory of the converted models.
+        threads (int): Threads of the generator on CPU, 0 for all cores.
+        generator (ctranslate2.Generator): The loaded generator, None while the model is not loaded.
+
+    Methods:
+        convert(model_id, access_token): Returns the path of the converted model, converting it if it is not cached.
+    """
+    name = BACKEND_CTRANSLATE2
+
+    def __init__(self, compute_type: str = "int8", device: str = "cpu", device_index: int = 0, threads: int = 0, cache_dir: str = ""):
+        self.compute_type = compute_type
+        self.device = device
+        self.device_index = device_index
+        self.threads = threads
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "ctranslate2")
+        self.generator = None
+
+    def load(self, model_id: str, access_token: str = ""):
+        import ctranslate2
+
+        path = self.convert(model_id, access_token)
+        self.generator = ctranslate2.Generator(
+            path,
+            device=self.device,
+            device_index=self.device_index,
+            compute_type=self.compute_type,
+            intra_threads=self.threads
+        )
+        if self.tokenizer is None:
+            self.tokenizer = AutoTokenizer.from_pretrained(path)
+
+    def convert(self, model_id: str, access_token: str = "") -> str:
+        """
+        Converts a transformers checkpoint to CTranslate2 with `compute_type` quantization, unless it is cached.
+        Delete the directory to convert again, e.g. after the checkpoint changed.
+
+        Parameters:
+            model_id (str): Hub id or local path of the checkpoint
+            access_token (str): Hugging Face token, for gated models
+
+        Returns:
+            str: Directory of the converted model, with the tokenizer
+        """
+        import ctranslate2
+        from huggingface_hub import snapshot_download
+
+        path = os.path.join(self.cache_dir, f"{model_id.strip('/').replace('/', '--')}-{self.compute_type}")
+        if os.path.exists(os.path.join(path, "model.bin")):
+            return path
+
+        logger.info(f"Converting {model_id} to CTranslate2 {self.compute_type} in {path}, this is done once")
+        checkpoint = model_id if os.path.isdir(model_id) else snapshot_download(model_id, token=access_token or None)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Converted next to the target and moved in place, an interrupted conversion never looks complete
+        staging = tempfile.mkdtemp(prefix=".converting-", dir=self.cache_dir)
+        try:
+            ctranslate2.converters.TransformersConverter(checkpoint, load_as_float16=True, low_cpu_mem_usage=True).convert(staging, quantization=self.compute_type, force=True)
+            AutoTokenizer.from_pretrained(checkpoint).save_pretrained(staging)
+            try:
+                os.replace(staging, path)
+            except OSError:
+                # Converted by another process meanwhile
+                if not os.path.exists(os.path.join(path, "model.bin")):
+                    raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return path
+
+    def unload(self):
+        """ Frees the generator, the tokenizer is kept """
+        self.generator = None
+        gc.collect()
+
+    def _options(self, cfg: dict) -> dict:
+        eos_token_id = cfg.get("eos_token_id", self.tokenizer.eos_token_id)
+        return {
+            "max_length": cfg.get("max_new_tokens", 512),
+            # Greedy is top-k 1, transformers samples from the top 50 by default
+            "sampling_topk": (cfg.get("top_k") or 50) if cfg.get("do_sample", True) else 1,
+            "sampling_topp": cfg.get("top_p") or 1,
+            "sampling_temperature": cfg.get("temperature") or 1,
+            "repetition_penalty": cfg.get("repetition_penalty") or 1,
+            "end_token": eos_token_id if isinstance(eos_token_id, list) else [eos_token_id],
+        }
+
+    def generate_batch(self, input_ids: List[List[int]], cfg: dict) -> List[str]:
+        """
+        Generates a batch of prompts in one `generate_batch` call, check `GenerationBackend.generate_batch`.
+        """
+        timer = GenerationTimer("batch")
+        results = self.generator.generate_batch(
+            [self.tokenizer.convert_ids_to_tokens(ids) for ids in input_ids],
+            include_prompt_in_result=False,
+            callback=lambda step: timer(),
+            **self._options(cfg)
+        )
+        sequences = [result.sequences_ids[0] for result in results]
+        timer.finish(sum(len(sequence) for sequence in sequences))
+        return self.tokenizer.batch_decode(sequences, skip_special_tokens=True)
+
+    def generate_one(self, input_ids: List[int], cfg: dict, prefix: str | None = None, on_token: Callable[[str], None] | None = None, stop_event: threading.Event | None = None) -> str:
+        """
+        Generates one prompt, passing `prefix` as static prompt when the prompt starts with it.
+        """
+        tokens = self.tokenizer.convert_ids_to_tokens(input_ids)
+        options = self._options(cfg)
+        if prefix:
+            # The last token may merge with the text after the prefix, leave it out
+            prefix_ids = self.tokenizer(prefix).input_ids[:-1]
+            if prefix_ids and len(input_ids) > len(prefix_ids) and input_ids[:len(prefix_ids)] == prefix_ids:
+                options["static_prompt"], tokens = tokens[:len(prefix_ids)], tokens[len(prefix_ids):]
+
+        timer = GenerationTimer("single")
+        if not on_token:
+            result = self.generator.generate_batch([tokens], include_prompt_in_result=False, callback=lambda step: timer(), **options)[0]
+            timer.finish(len(result.sequences_ids[0]))
+            return self.tokenizer.decode(result.sequences_ids[0], skip_special_tokens=True)
+
+        streamer = CallbackStreamer(self.tokenizer, on_token)
+        # The streamer skips the first tokens it gets as the prompt
+        streamer.put(torch.tensor([input_ids]))
+        generated = []
+        for step in self.generator.generate_tokens(tokens, **options):
+            timer()
+            generated.append(step.token_id)
+            streamer.put(torch.tensor([step.token_id]))
+            if stop_event is not None and stop_event.is_set():
+                # Closing the iterator stops decoding
+                break
+        streamer.end()
+        timer.finish(len(generated))
+        return self.tokenizer.decode(generated, skip_special_tokens=True)
+
+def create_backend() -> GenerationBackend:
+    """ Generation backend chosen with `LLM_BACKEND` """
+    if settings.llm_backend == BACKEND_CTRANSLATE2:
+        if settings.llm_draft_model:
+            logger.warning("LLM_DRAFT_MODEL is ignored, speculative decoding needs the transformers backend")
+        return CTranslate2Backend(
+            compute_type=settings.llm_ct2_compute_type,
+            device=settings.llm_ct2_device,
+            threads=settings.llm_ct2_threads,
+            cache_dir=settings.llm_ct2_cache_dir
+        )
+    if settings.llm_backend != BACKEND_TRANSFORMERS:
+        raise ValueError(f"Unknown LLM_BACKEND {settings.llm_backend}, use {BACKEND_TRANSFORMERS} or {BACKEND_CTRANSLATE2}")
+    return TransformersBackend(
+        prefix_cache_mb=settings.llm_prefix_cache_mb,
+        draft_model_id=settings.llm_draft_model,
+        draft_lookahead=settings.llm_draft_lookahead,
+        draft_schedule=settings.llm_draft_schedule
+    )
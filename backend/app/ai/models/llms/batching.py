@@ -0,0 +1,145 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from app.ai.executor import InferenceExecutor
+from app.exceptions.inference_exceptions import InferenceQueueFullError
+from app.utils.logging import AppLogger
+
+logger = AppLogger().get_logger()
+
+@dataclass
+class BatchRequest:
+    """
+    input_ids (List[int]): Prompt tokens
+    future (asyncio.Future): Resolved with the generated text
+    prefix (Optional[str]): Static beginning of the prompt, check `PrefixCache`
+    """
+    input_ids: List[int]
+    future: asyncio.Future
+    prefix: Optional[str] = None
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of an LLM.
+
+    Concurrent requests with the same generation configuration are collected for up to `max_wait_ms`
+    (longer while the model is still busy with the previous batch), or until the batch reaches
+    `max_batch_size` requests or `max_batch_tokens` padded tokens, and then run as one `generate_batch` call.
+
+    Attributes:
+        generate_batch (Callable): Blocking function taking a list of prompt token lists, a generation config and the list of prompt prefixes, returning one text per prompt.
+        executor (InferenceExecutor): Executor the batches run on.
+        max_wait_ms (int): How long the first request of a batch waits for others.
+        max_batch_size (int): Maximum number of requests in a batch.
+        max_batch_tokens (int): Maximum of batch size * (longest prompt + max_new_tokens).
+
+    Methods:
+        submit(input_ids, cfg, prefix): Awaitable returning the generated text of one request.
+    """
+
+    def __init__(self, generate_batch: Callable, executor: InferenceExecutor, max_wait_ms: int = 20, max_batch_size: int = 8, max_batch_tokens: int = 32768):
+        self.generate_batch = generate_batch
+        self.executor = executor
+        self.max_wait_ms = max_wait_ms
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        # Waiting requests are bounded like the executor queue, counted in requests instead of batches
+        self.max_pending = max_batch_size * (executor.max_workers + executor.max_queue_size)
+
+        self._batches: Dict[str, List[BatchRequest]] = {}
+        self._configs: Dict[str, dict] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._running = set()
+
+    @property
+    def pending(self) -> int:
+        """ Number of requests waiting to be batched """
+        return sum(len(batch) for batch in self._batches.values())
+
+    async def submit(self, input_ids: List[int], cfg: dict, prefix: Optional[str] = None) -> str:
+        """
+        Queues one generation and waits for its batch to finish.
+
+        Parameters:
+            input_ids (List[int]): Prompt tokens
+            cfg (dict): Generation configuration, only requests with equal configuration share a batch
+            prefix (Optional[str]): Static beginning of the prompt, passed on to `generate_batch`
+
+        Returns:
+            str: Generated text, without the prompt
+
+        Raises:
+            InferenceQueueFullError: If too many requests are waiting already.
+        """
+        if self.pending >= self.max_pending:
+            raise InferenceQueueFullError(self.executor.name, self.executor.retry_after)
+
+        key = json.dumps(cfg, sort_keys=True, default=str)
+        loop = asyncio.get_running_loop()
+        request = BatchRequest(input_ids=input_ids, future=loop.create_future(), prefix=prefix)
+
+        batch = self._batches.get(key)
+        if batch and self._batch_tokens(batch + [request], cfg) > self.max_batch_tokens:
+            self._flush(key)
+            batch = None
+
+        if not batch:
+            batch = self._batches[key] = []
+            self._configs[key] = cfg
+            self._timers[key] = loop.call_later(self.max_wait_ms / 1000, self._on_timer, key)
+        batch.append(request)
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+
+        return await request.future
+
+    def _batch_tokens(self, batch: List[BatchRequest], cfg: dict) -> int:
+        longest = max(len(request.input_ids) for request in batch)
+        return len(batch) * (longest + cfg.get("max_new_tokens", 0))
+
+    def _on_timer(self, key: str):
+        if key not in self._batches:
+            return
+
+        if self.executor.is_busy:
+            # The model can't start this batch yet anyway, keep collecting until it can
+            self._timers[key] = asyncio.get_running_loop().call_later(self.max_wait_ms / 1000, self._on_timer, key)
+            return
+
+        self._flush(key)
+
+    def _flush(self, key: str):
+        batch = self._batches.pop(key, None)
+        cfg = self._configs.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._run(batch, cfg))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[BatchRequest], cfg: dict):
+        logger.debug(f"Running batch of {len(batch)} generations")
+        try:
+            outputs = await self.executor.run(
+                self.generate_batch,
+                [request.input_ids for request in batch],
+                cfg,
+                [request.prefix for request in batch]
+            )
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        for request, output in zip(batch, outputs):
+            # The caller may have gone away meanwhile
+            if not request.future.done():
+                request.future.set_result(output)
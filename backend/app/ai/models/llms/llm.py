@@ -1,7 +1,6 @@
 from typing import List, Optional
 
-import torch
-import transformers
+from app.ai.models.llms.backends import GenerationBackend, TransformersBackend
 from app.utils.logging import AppLogger
 from pydantic import BaseModel
 
@@ -16,20 +15,22 @@ class LLMMessage(BaseModel):
 
 class LLM:
     """
-    A class representing a Language Model (LLM) for text generation tasks,
-    utilizing transformer pipelines for advanced natural language processing.
+    A class representing a Language Model (LLM) for text generation tasks.
+    Generation runs on a pluggable backend, a transformers pipeline by default, check `GenerationBackend`.
 
     Attributes:
         model_id (str): Identifier for the pre-trained model to be used. Default is "meta-llama/Meta-Llama-3-8B-Instruct".
         access_token (str): Access token required for authenticating with the model hosting service.
-        pipeline (transformers.Pipeline): The loaded transformer pipeline for text generation.
+        backend (GenerationBackend): Loads the model and runs the generation, e.g. `TransformersBackend` or `CTranslate2Backend`.
+        tokenizer (transformers.PreTrainedTokenizer): Tokenizer of the model, kept when the model is unloaded.
 
     Methods:
-        load_pipeline(): Configures and loads the transformer pipeline with the specified model.
-        invoke(messages, cfg): Generates text based on the input messages using the pre-loaded pipeline with an optional configuration.
+        load_pipeline(): Loads the model with the backend.
+        unload_pipeline(): Frees the model weights.
+        invoke(messages, cfg): Generates text based on the input messages using the loaded model with an optional configuration.
 
     Example:
-        >>> llm = LLM(access_token="your_access_token_here")
+        >>> llm = LLM(access_token="your_access_token_here", backend=CTranslate2Backend(compute_type="int8"))
         >>> llm.load_pipeline()
         >>> response = await llm.invoke([LLMMessage(prompt="Tell me a story about a wizard")])
         >>> print(response)
@@ -37,35 +38,38 @@ class LLM:
 
     model_id: str = ""
     access_token: str = ""
-    pipeline = None
+    tokenizer = None
 
-    def __init__(self, model_id: Optional[str] = None, access_token: str = ""):
+    def __init__(self, model_id: Optional[str] = None, access_token: str = "", backend: Optional[GenerationBackend] = None):
         """
         Initializes the LLM instance with the given model ID and access token.
 
         Parameters:
             model_id (str): Identifier for the pre-trained model to be used for text generation. Default is "meta-llama/Meta-Llama-3-8B-Instruct".
             access_token (str): Access token for using the model hosting service. Must be provided by the user.
+            backend (Optional[GenerationBackend]): Generation backend. Default is a `TransformersBackend`.
         """
         self.access_token = access_token
-        if not model_id:
+        if model_id:
             self.model_id = model_id
+        self.backend = backend or TransformersBackend()
 
     def load_pipeline(self):
         """
-        Configures and initiates loading of the text generation pipeline, which includes the model and tokenizer, with specified device allocation.
+        Loads the model and the tokenizer with the backend, e.g. a transformers pipeline with specified device allocation.
         """
-        self.pipeline = transformers.pipeline(
-            "text-generation",
-            model=self.model_id,
-            token=self.access_token,
-            model_kwargs={"torch_dtype": torch.bfloat16, "low_cpu_mem_usage": True},
-            device_map="auto"
-        )
+        self.backend.load(self.model_id, self.access_token)
+        self.tokenizer = self.backend.tokenizer
+
+    def unload_pipeline(self):
+        """
+        Frees the model weights, the tokenizer is kept. Call `load_pipeline` to load them again.
+        """
+        self.backend.unload()
 
     async def invoke(self, messages: List[LLMMessage], cfg=None):
         """
-        Generates responses from the language model based on the input messages using the configured pipeline, with an optional configuration.
+        Generates responses from the language model based on the input messages using the configured backend, with an optional configuration.
 
         Parameters:
             messages (List[LLMMessage]): A list of LLMMessage objects containing the prompts for the model.
@@ -75,7 +79,7 @@ class LLM:
             str: The generated text that follows the input prompt(s).
         """
 
-        if not self.pipeline:
+        if not self.tokenizer:
             logger.error("Piepeline is not loaded yet")
 
         if cfg is None:
@@ -88,23 +92,17 @@ class LLM:
         }
         final_cfg = {**default_cfg, **cfg}
 
-        prompt = self.pipeline.tokenizer.apply_chat_template(
+        prompt = self.tokenizer.apply_chat_template(
                 [{ "role": message.role, "content": message.content } for message in messages],
                 tokenize=False,
                 add_generation_prompt=True
         )
 
         terminators = [
-            self.pipeline.tokenizer.eos_token_id,
-            self.pipeline.tokenizer.convert_tokens_to_ids("<|eot_id|>")
+            self.tokenizer.eos_token_id,
+            self.tokenizer.convert_tokens_to_ids("<|eot_id|>")
         ]
 
-        outputs = self.pipeline(
-            prompt,
-            eos_token_id=terminators,
-            do_sample=True,
-            pad_token_id=self.pipeline.tokenizer.eos_token_id,
-            **final_cfg
-        )
-
-        return outputs[0]["generated_text"][len(prompt):]
+        # The chat template already starts with the begin of text token
+        input_ids = self.tokenizer(prompt, add_special_tokens=False).input_ids
+        return self.backend.generate_one(input_ids, {**final_cfg, "eos_token_id": terminators})
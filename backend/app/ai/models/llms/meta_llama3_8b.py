@@ -1,12 +1,12 @@
 import app.constants as constants
+from app.ai.model_registry import model_registry
+from app.ai.models.llms.llm import LLM
 from app.config import settings
-from app.utils.logging import AppLogger
-from backend.backend.app.ai.models.llms.llm import LLM
-
-logger = AppLogger().get_logger()
 
 model = LLM(access_token=settings.hugging_face_access_token, model_id=constants.META_LLAMA3_MODEL)
-
-logger.info("Meta llama3 model loading...")
-model.load_pipeline()
-logger.info("Meta llama3 model loaded...")
+model_registry.register(
+    constants.META_LLAMA3_MODEL_NAME,
+    load=model.load_pipeline,
+    unload=model.unload_pipeline,
+    memory_mb=settings.llm_memory_mb
+)
@@ -1,46 +1,67 @@
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, List
+
 import app.constants as constants
+from app.ai.executor import llm_executor
+from app.ai.model_registry import model_registry
+from app.ai.models.llms.backends import create_backend
+from app.ai.models.llms.batching import BatchScheduler
 from app.ai.models.llms.llm import LLM
+from app.config import settings
 from app.utils.logging import AppLogger
 from langfuse.decorators import langfuse_context
 from langfuse.decorators import observe
 
 logger = AppLogger().get_logger()
 
+# Deterministic generation, the same prompt always gives the same text
+GREEDY_CONFIG = {"do_sample": False, "temperature": None, "top_p": None}
+
+DEFAULT_CONFIG = {
+    "temperature": 0.6,
+    "max_new_tokens": 1000,
+    "top_p": 0.9
+}
+
 class NorskLlama38b(LLM):
 
     def __init__(self):
-        self.model_id = constants.NORSK_LLAMA3_MODEL
-        pass
+        # The backend is picked with LLM_BACKEND, invoke works the same on every backend
+        super().__init__(model_id=constants.NORSK_LLAMA3_MODEL, backend=create_backend())
+        self.name = constants.NORSK_LLAMA3_MODEL_NAME
+        self.scheduler = BatchScheduler(
+            self.generate_batch,
+            llm_executor,
+            max_wait_ms=settings.llm_batch_wait_ms,
+            max_batch_size=settings.llm_max_batch_size,
+            max_batch_tokens=settings.llm_max_batch_tokens
+        )
 
     @observe(as_type="generation", capture_input=False, capture_output=False)
-    async def invoke(self, prompt: str, cfg=None, langfuse_args: dict | None = None):
+    async def invoke(self, prompt: str, cfg=None, langfuse_args: dict | None = None, prefix: str | None = None, on_token: Callable[[str], None] | None = None, stop_event: threading.Event | None = None):
         """
         Parameters:
             prompt (str): prompt
-            cfg (optional[dict]): A dictionary containing configuration settings for text generation. The default configuration includes temperature, max_new_tokens, and top_p parameters. If None, default configuration is used.
+            cfg (optional[dict]): A dictionary containing configuration settings for text generation. The default configuration includes temperature, max_new_tokens, and top_p parameters. If None, default configuration is used. Sampling is on unless cfg sets "do_sample" to False, check `GREEDY_CONFIG`.
             langfuse_args(optional[dict]): A dictionary containing configuration settings for langfuse. For available properties, check langfuse_context.update_current_observation(). "model", "model_parameters", "input", "output" will be ignored.
+            prefix (optional[str]): Static beginning of the prompt (e.g. `Prompt.prefix`). Its key/values are cached and only the rest of the prompt is prefilled.
+            on_token (optional[Callable[[str], None]]): Called from the generation thread with each piece of generated text. Streamed requests are not batched.
+            stop_event (optional[threading.Event]): Stops a streamed generation early when set.
         """
-        if not self.pipeline:
-            logger.error("Piepeline is not loaded yet")
+        # Loads the model off the event loop if it is not loaded yet or was unloaded while idle
+        await model_registry.load_async(self.name)
 
         if not cfg:
             cfg = {}
-        default_cfg = {
-            "temperature": 0.6,
-            "max_new_tokens": 1000,
-            "top_p": 0.9
-        }
-        final_cfg = {**default_cfg, **cfg}
-
-        input_ids = self.pipeline.tokenizer(prompt, return_tensors="pt").input_ids.to(self.pipeline.model.device)
-
-        outputs = self.pipeline.model.generate(
-            input_ids,
-            eos_token_id=self.pipeline.tokenizer.eos_token_id,
-            do_sample=True,
-            **final_cfg
-        )
-        response = self.pipeline.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        final_cfg = {**DEFAULT_CONFIG, **cfg}
+
+        input_ids = self.tokenizer(prompt).input_ids
+        if on_token:
+            response = await llm_executor.run(self.generate_stream, input_ids, final_cfg, on_token, stop_event, prefix)
+        else:
+            # Concurrent requests are batched into one generate call on the llm worker
+            response = await self.scheduler.submit(input_ids, final_cfg, prefix=prefix)
 
         # langfuse integration
 
@@ -50,14 +71,130 @@ class NorskLlama38b(LLM):
         langfuse_args["model"] = constants.NORSK_LLAMA3_MODEL
         langfuse_args["model_parameters"] = final_cfg
         langfuse_args["input"] = prompt
-        langfuse_args["output"] = response[len(prompt):]
+        langfuse_args["output"] = response
 
         langfuse_context.update_current_observation(**langfuse_args)
-        return response[len(prompt):]
+        return response
 
-logger.info("Norsk model loading...")
+    async def stream(self, prompt: str, cfg=None, langfuse_args: dict | None = None, prefix: str | None = None) -> AsyncIterator[str]:
+        """
+        Generates text like `invoke`, yielding each piece of text as soon as it is generated.
+        The full output is still reported to langfuse when generation ends.
+        Generation stops early when the consumer stops iterating.
 
-model = NorskLlama38b()
-model.load_pipeline()
+        Parameters:
+            prompt (str): prompt
+            cfg (optional[dict]): Generation configuration, check `invoke`.
+            langfuse_args(optional[dict]): Langfuse configuration, check `invoke`.
+            prefix (optional[str]): Static beginning of the prompt, check `invoke`.
+        """
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+        stop_event = threading.Event()
+
+        task = asyncio.ensure_future(self.invoke(
+            prompt=prompt,
+            cfg=cfg,
+            langfuse_args=langfuse_args,
+            prefix=prefix,
+            on_token=lambda token: loop.call_soon_threadsafe(tokens.put_nowait, token),
+            stop_event=stop_event
+        ))
+        # Tokens are queued with call_soon_threadsafe before generation returns, so None always comes last
+        task.add_done_callback(lambda _: tokens.put_nowait(None))
+
+        finished = False
+        try:
+            while (token := await tokens.get()) is not None:
+                yield token
+            finished = True
+            # Raises generation errors, e.g. InferenceQueueFullError
+            await task
+        finally:
+            stop_event.set()
+            if not finished:
+                # The consumer went away, queued work is dropped and running work stops at its next token
+                task.cancel()
+                task.add_done_callback(_log_abandoned_error)
+
+    async def count_tokens(self, texts: List[str]) -> List[int]:
+        """
+        Counts the tokens of each text, without special tokens.
+
+        Parameters:
+            texts (List[str]): Texts to count
+
+        Returns:
+            List[int]: Number of tokens of each text
+        """
+        # Only the tokenizer is needed, but it comes with the model
+        await model_registry.load_async(self.name)
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False).input_ids]
+
+    def generate_batch(self, input_ids: List[List[int]], cfg: dict, prefixes: List[str | None] | None = None) -> List[str]:
+        """
+        Blocking generation of a batch of prompts in one backend call.
+        A batch of one prompt is generated with `generate_one`, so it can reuse the state of its prefix.
 
-logger.info("Norsk model loaded...")
+        Parameters:
+            input_ids (List[List[int]]): Prompt tokens of each request
+            cfg (dict): Generation configuration passed to the backend
+            prefixes (Optional[List[Optional[str]]]): Static prompt prefix of each request
+
+        Returns:
+            List[str]: Generated text of each request, without the prompt
+        """
+        if len(input_ids) == 1:
+            return [self.generate_one(input_ids[0], cfg, prefix=prefixes[0] if prefixes else None)]
+
+        with model_registry.use(self.name):
+            return self.backend.generate_batch(input_ids, cfg)
+
+    def generate_one(self, input_ids: List[int], cfg: dict, prefix: str | None = None) -> str:
+        """
+        Blocking generation of a single prompt, reusing the model state of `prefix` when the backend can,
+        e.g. the cached key/values of `TransformersBackend`.
+
+        Parameters:
+            input_ids (List[int]): Prompt tokens
+            cfg (dict): Generation configuration passed to the backend
+            prefix (Optional[str]): Static beginning of the prompt
+
+        Returns:
+            str: Generated text, without the prompt
+        """
+        with model_registry.use(self.name):
+            return self.backend.generate_one(input_ids, cfg, prefix=prefix)
+
+    def generate_stream(self, input_ids: List[int], cfg: dict, on_token: Callable[[str], None], stop_event: threading.Event | None = None, prefix: str | None = None) -> str:
+        """
+        Blocking generation of a single prompt, passing generated text to `on_token` as it is decoded.
+
+        Parameters:
+            input_ids (List[int]): Prompt tokens
+            cfg (dict): Generation configuration passed to the backend
+            on_token (Callable[[str], None]): Called with each piece of generated text
+            stop_event (Optional[threading.Event]): Stops generation when set
+            prefix (Optional[str]): Static beginning of the prompt
+
+        Returns:
+            str: Generated text, without the prompt
+        """
+        with model_registry.use(self.name):
+            return self.backend.generate_one(input_ids, cfg, prefix=prefix, on_token=on_token, stop_event=stop_event)
+
+
+def _log_abandoned_error(task: asyncio.Task):
+    """ Retrieves the error of a generation whose consumer went away, so it is logged instead of "never retrieved" """
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Streamed generation failed after its consumer stopped: {task.exception()}")
+
+model = NorskLlama38b()
+model_registry.register(
+    model.name,
+    load=model.load_pipeline,
+    unload=model.unload_pipeline,
+    memory_mb=settings.llm_memory_mb + (settings.llm_draft_memory_mb if settings.llm_draft_model and settings.llm_backend == "transformers" else 0)
+)
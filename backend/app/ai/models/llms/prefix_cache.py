@@ -0,0 +1,105 @@
+import copy
+from dataclasses import dataclass
+from typing import Any, List
+
+import torch
+from app.utils.logging import AppLogger
+from app.utils.lru_cache import LRUCache
+
+logger = AppLogger().get_logger()
+
+@dataclass
+class PrefixCacheEntry:
+    """
+    input_ids (List[int]): Tokens of the cached prefix
+    past_key_values: Key/value cache of the prefix, never handed out directly as generate mutates it
+    nbytes (int): Size of the key/value cache
+    """
+    input_ids: List[int]
+    past_key_values: Any
+    nbytes: int
+
+class PrefixCache:
+    """
+    Key/value caches of static prompt prefixes, e.g. the instructions of a prompt template before the transcript.
+
+    The prefix is prefilled once, and later prompts starting with it only prefill the tokens after it.
+    Entries are keyed by the prefix text, so a new template or version gets its own entry, and evicted
+    least-recently-used first to stay within `max_bytes`.
+
+    Attributes:
+        max_bytes (int): Memory budget of the cached key/value tensors.
+        min_tokens (int): Shorter prefixes are not worth caching.
+
+    Methods:
+        get(model, tokenizer, prefix, input_ids): Returns a copy of the cache of `prefix` usable for `input_ids`, or None.
+        clear(): Drops all entries, e.g. when the model is unloaded.
+    """
+
+    def __init__(self, max_bytes: int, min_tokens: int = 16):
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self._entries = LRUCache(max_bytes)
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the cached key/values """
+        return self._entries.nbytes
+
+    def get(self, model, tokenizer, prefix: str | None, input_ids: List[int]):
+        """
+        Returns a copy of the key/value cache of `prefix`, building it on first use.
+
+        Parameters:
+            model: Causal LM the cache is built with
+            tokenizer: Tokenizer of the model
+            prefix (Optional[str]): Static beginning of the prompt
+            input_ids (List[int]): Tokens of the full prompt
+
+        Returns:
+            Key/value cache to pass as `past_key_values`, or None if the prompt can't use a cached prefix.
+        """
+        if not prefix:
+            return None
+
+        entry = self._entries.get(prefix)
+        if entry is None:
+            entry = self._build(model, tokenizer, prefix)
+            if entry is None:
+                return None
+            self._entries.put(prefix, entry, entry.nbytes)
+
+        prefix_length = len(entry.input_ids)
+        # At least one token has to be left for generate to prefill
+        if len(input_ids) <= prefix_length or input_ids[:prefix_length] != entry.input_ids:
+            return None
+
+        return copy.deepcopy(entry.past_key_values)
+
+    def clear(self):
+        """ Drops all cached key/values """
+        self._entries.clear()
+
+    @torch.no_grad()
+    def _build(self, model, tokenizer, prefix: str) -> PrefixCacheEntry | None:
+        # The last token may merge with the text after the prefix, leave it out
+        input_ids = tokenizer(prefix).input_ids[:-1]
+        if len(input_ids) < self.min_tokens:
+            return None
+
+        outputs = model(torch.tensor([input_ids], device=model.device), use_cache=True)
+        nbytes = kv_cache_nbytes(model.config, len(input_ids), model.dtype)
+        logger.info(f"Cached key/values of a {len(input_ids)} token prompt prefix ({nbytes / 2 ** 20:.1f} MiB)")
+
+        return PrefixCacheEntry(input_ids=input_ids, past_key_values=outputs.past_key_values, nbytes=nbytes)
+
+def kv_cache_nbytes(config, length: int, dtype: torch.dtype) -> int:
+    """
+    Size of the key/value cache of `length` tokens for a decoder-only transformer config.
+    """
+    num_attention_heads = config.num_attention_heads
+    num_key_value_heads = getattr(config, "num_key_value_heads", None) or num_attention_heads
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // num_attention_heads
+    itemsize = torch.tensor([], dtype=dtype).element_size()
+
+    return 2 * config.num_hidden_layers * num_key_value_heads * head_dim * length * itemsize
@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import Callable
+
+from app.utils.metrics import llm_decode_seconds, llm_draft_accepted_tokens, llm_draft_tokens, llm_generated_tokens, llm_prefill_seconds
+from transformers import StoppingCriteria, TextStreamer
+
+
+class CallbackStreamer(TextStreamer):
+    """
+    Streamer passing each decoded piece of text to a callback as soon as it is generated.
+    The callback is called from the generation thread.
+    """
+
+    def __init__(self, tokenizer, on_token: Callable[[str], None]):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.on_token = on_token
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.on_token(text)
+
+class StopOnEvent(StoppingCriteria):
+    """
+    Stops generation once `event` is set, e.g. when the client of a stream went away.
+    """
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
+class GenerationTimer(StoppingCriteria):
+    """
+    Times the prefill and the decoding of a `generate` call, never stops it.
+    Stopping criteria run after each decoding step, the first call marks the end of the prefill. Other backends
+    call it from their own step callback.
+    With a draft model a step is one verification of the drafted tokens, check `TransformersBackend.load_draft_model`.
+
+    Attributes:
+        steps (int): Decoding steps so far.
+
+    Methods:
+        finish(tokens, drafted): Observes the prefill and decode time and the generated tokens in the LLM metrics.
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.steps = 0
+
+    def __call__(self, *args, **kwargs) -> bool:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.steps += 1
+        return False
+
+    def finish(self, tokens: int, drafted: int | None = None):
+        """
+        Parameters:
+            tokens (int): Generated tokens
+            drafted (Optional[int]): Tokens proposed by the draft model, None without one
+        """
+        end = time.perf_counter()
+        first_token = self.first_token or end
+        llm_prefill_seconds.labels(self.mode).observe(first_token - self.start)
+        llm_decode_seconds.labels(self.mode).observe(end - first_token)
+        llm_generated_tokens.labels(self.mode).inc(tokens)
+        if drafted is not None:
+            # Every verification step adds one token of the model itself after the accepted draft tokens
+            llm_draft_tokens.inc(drafted)
+            llm_draft_accepted_tokens.inc(max(tokens - self.steps, 0))
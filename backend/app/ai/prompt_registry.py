@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from app.utils.logging import AppLogger
+from app.utils.lru_cache import LRUCache
+
+logger = AppLogger().get_logger()
+
+PromptKey = Tuple[str, Optional[int]]
+
+@dataclass
+class PromptCacheEntry:
+    """
+    prompt: langfuse prompt client, None if it could not be fetched yet
+    fetched_at (float): monotonic time of the last successful fetch
+    next_refresh_at (float): monotonic time after which the entry is refreshed again
+    """
+    prompt: Any
+    fetched_at: float
+    next_refresh_at: float
+
+class PromptRegistry:
+    """
+    In-process cache of langfuse prompts keyed by (name, version), with stale-while-revalidate semantics.
+
+    `get` never waits for the network: it returns the cached prompt (even when stale) and schedules a
+    background refresh when the entry is older than `ttl_seconds`. Unknown prompts return None right away
+    and are fetched in the background, so callers fall back to their default prompt for that request.
+    `wait_for` waits a little for the first fetch instead, for prompts a client asked for explicitly.
+
+    Names and versions come from clients, so at most `max_entries` prompts are kept, the least recently used
+    are evicted.
+
+    Attributes:
+        fetch (Callable[[str, Optional[int]], Any]): Blocking function fetching a prompt by name and version.
+        ttl_seconds (float): Age after which an entry is refreshed.
+        retry_seconds (float): Delay before retrying a failed fetch.
+        max_entries (int): Prompts kept at most, failed fetches included.
+
+    Methods:
+        get(name, version): Returns the cached prompt or None, never blocks.
+        wait_for(name, version, timeout): Awaitable returning the prompt, waiting up to `timeout` for its first fetch.
+        warmup(keys): Fetches the given prompts in the background.
+        refresh(name, version): Fetches a prompt synchronously and stores it.
+
+    Example:
+        >>> registry = PromptRegistry(lambda name, version: client.get_prompt(name=name, version=version))
+        >>> registry.warmup([("norsk-summarization-prompt", None)])
+        >>> prompt = registry.get("norsk-summarization-prompt")
+    """
+
+    def __init__(self, fetch: Callable[[str, Optional[int]], Any], ttl_seconds: float = 60, retry_seconds: float = 10, max_entries: int = 256):
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.max_entries = max_entries
+        # Every entry counts as one byte, the cache is bounded by its number of entries
+        self._entries = LRUCache(max_bytes=max_entries, max_items=max_entries)
+        self._refreshing: Dict[PromptKey, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prompt-refresh")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: Optional[str], version: Optional[int] = None):
+        """
+        Returns the cached prompt, scheduling a background refresh when it is missing or stale.
+
+        Parameters:
+            name (Optional[str]): Prompt name
+            version (Optional[int]): Prompt version, None for the production label
+
+        Returns:
+            The langfuse prompt client, or None if it has not been fetched yet.
+        """
+        if not name:
+            return None
+
+        key = (name, version)
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() >= entry.next_refresh_at:
+            self._schedule_refresh(key)
+
+        if entry is None or entry.prompt is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry.prompt
+
+    async def wait_for(self, name: Optional[str], version: Optional[int] = None, timeout: float = 2):
+        """
+        Like `get`, but waits up to `timeout` seconds for the first fetch of a prompt that is not cached.
+        A prompt whose fetch failed before is not waited for again, its retry runs in the background.
+
+        Returns:
+            The langfuse prompt client, or None if it could not be fetched in time.
+        """
+        if name and self._entries.get((name, version)) is None:
+            future = self._schedule_refresh((name, version))
+            try:
+                # Shielded, the fetch goes on in the background after a timeout
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Prompt {name} (version {version}) was not fetched within {timeout} s")
+        return self.get(name, version)
+
+    def warmup(self, keys: Iterable[PromptKey]):
+        """
+        Fetches the given prompts in the background, e.g. at startup.
+
+        Parameters:
+            keys (Iterable[Tuple[str, Optional[int]]]): (name, version) pairs
+        """
+        for key in keys:
+            self._schedule_refresh(key)
+
+    def refresh(self, name: str, version: Optional[int] = None):
+        """
+        Fetches a prompt synchronously and stores it. On failure the stale entry is kept and retried after `retry_seconds`.
+
+        Returns:
+            The fetched prompt client, or None if the fetch failed.
+        """
+        key = (name, version)
+        try:
+            prompt = self.fetch(name, version)
+        except Exception as e:
+            logger.error(f"Error while fetching prompt {name} (version {version}): {e}")
+            with self._lock:
+                entry = self._entries.get(key)
+                now = time.monotonic()
+                if entry is None:
+                    self._entries.put(key, PromptCacheEntry(prompt=None, fetched_at=0, next_refresh_at=now + self.retry_seconds), 1)
+                else:
+                    entry.next_refresh_at = now + self.retry_seconds
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            self._entries.put(key, PromptCacheEntry(prompt=prompt, fetched_at=now, next_refresh_at=now + self.ttl_seconds), 1)
+        return prompt
+
+    def _schedule_refresh(self, key: PromptKey) -> Future:
+        with self._lock:
+            future = self._refreshing.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(self.refresh, *key)
+            self._refreshing[key] = future
+
+        future.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        return future
+
+    def shutdown(self):
+        """ Stops the refresh threads """
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,5 +1,8 @@
 from typing import Optional, Any
 
+import app.constants as constants
+from app.ai.prompt_registry import PromptRegistry
+from app.config import settings
 from app.utils.langfuse_client import LangFuseClient
 from app.utils.logging import AppLogger
 from pydantic import BaseModel
@@ -12,37 +15,99 @@ class Prompt(BaseModel):
     """
     prompt (str): final full prompt in str
     langfuse_client : langfuse prompt_client object if it is fetched from langfuse
+    prefix (str): static part of the prompt before the content, the LLM caches its key/values
+    name (str): langfuse prompt name, None for the default prompt
+    version (int): langfuse prompt version, None for the default prompt
     """
     prompt: str
     langfuse_client: Any = None
+    prefix: Optional[str] = None
+    name: Optional[str] = None
+    version: Optional[int] = None
+
+default_prompt = """Du er en erfaren medisinsk sekretær. Oppsummer samtalen mellom lege og pasient nedenfor som et kort og strukturert journalnotat på norsk. Ta bare med opplysninger som kommer fram i samtalen.
+
+Samtale:
+{content}
+
+Oppsummering:
+"""
+
+# Summarizes one part of a long conversation, the partial summaries are then summarized with the summarization prompt
+default_chunk_prompt = """Du er en erfaren medisinsk sekretær. Teksten nedenfor er én del av en lengre samtale mellom lege og pasient. Skriv ned alle medisinske opplysninger fra denne delen kort og presist på norsk. Ta bare med opplysninger som kommer fram i teksten.
+
+Del av samtale:
+{content}
+
+Opplysninger:
+"""
+
+def fetch_prompt(name: str, version: Optional[int] = None):
+    """
+    Fetches a prompt from langfuse, bypassing the langfuse client cache as prompt_registry does the caching.
+    """
+    return langfuse_client.client.get_prompt(
+        name=name,
+        version=version,
+        cache_ttl_seconds=0
+    )
+
+# Compiled in place of the content to find where the static prefix of a template ends
+CONTENT_MARKER = "\x00content\x00"
+
+prompt_registry = PromptRegistry(fetch_prompt, ttl_seconds=settings.prompt_cache_ttl_seconds, max_entries=settings.prompt_cache_max_entries)
 
 # def get_summarization_messages
-def get_summarization_prompt(content: str, prompt_name: Optional[str] = None, prompt_version: Optional[int] = None) -> Prompt:
+def get_summarization_prompt(content: str, prompt_name: Optional[str] = None, prompt_version: Optional[int] = None, default: str = default_prompt) -> Prompt:
     """
-    Return prompt for summarization using norsk model
+    Return prompt for summarization using norsk model.
+    Prompts come from the in-process prompt registry, so this never waits for langfuse.
 
     Parameters:
         content (str): Content to be summarized. It must be in Norweign
-        prompt_name (optional[str]): Prompt name to be used for summarization. If not provided or can't fetch provided prompt name, it will use default prompt.
+        prompt_name (optional[str]): Prompt name to be used for summarization. If not provided or provided prompt is not fetched yet, it will use default prompt.
+        default (str): Template with a {content} placeholder used when the langfuse prompt is not available. Default is `default_prompt`.
 
     Return:
         Prompt object
     """
 
-    try:
-        prompt = langfuse_client.client.get_prompt(
-            name=prompt_name,
-            version=prompt_version
-        )
-        
-        return Prompt(
-            prompt=prompt.compile(content=content),
-            langfuse_client=prompt
-        )
-    except Exception as e:
-        logger.error(f"Error while getting prompt: {e}")
+    prompt = prompt_registry.get(name=prompt_name, version=prompt_version)
+    if prompt is not None:
+        try:
+            return Prompt(
+                prompt=prompt.compile(content=content),
+                langfuse_client=prompt,
+                prefix=prompt.compile(content=CONTENT_MARKER).split(CONTENT_MARKER)[0],
+                name=prompt.name,
+                version=prompt.version
+            )
+        except Exception as e:
+            logger.error(f"Error while compiling prompt: {e}")
 
+    if prompt_name:
+        # The caller asked for this prompt, the note is generated with another one
+        logger.warning(f"Prompt {prompt_name} (version {prompt_version}) is not available, using the default prompt")
+    else:
         logger.info("Use default prompt for summarization")
-        return Prompt(
-            prompt=default_prompt.format(content=content)
-        )
+    return Prompt(
+        prompt=default.format(content=content),
+        prefix=default.split("{content}")[0]
+    )
+
+def get_chunk_summarization_prompt(content: str) -> Prompt:
+    """
+    Return prompt for summarizing one part of a transcription that is too long for a single prompt.
+    It can be overridden in langfuse as `constants.LANGFUSE_PROMPT_NORSK_CHUNK_SUMMARIZATION`.
+
+    Parameters:
+        content (str): Part of the transcription, or partial summaries to combine
+
+    Return:
+        Prompt object
+    """
+    return get_summarization_prompt(
+        content=content,
+        prompt_name=constants.LANGFUSE_PROMPT_NORSK_CHUNK_SUMMARIZATION,
+        default=default_chunk_prompt
+    )
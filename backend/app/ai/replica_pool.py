@@ -0,0 +1,54 @@
+import threading
+from contextlib import contextmanager
+from typing import Generic, List, TypeVar
+
+T = TypeVar("T")
+
+class ReplicaPool(Generic[T]):
+    """
+    Least-loaded dispatch over replicas of a model, e.g. one `WhisperModel` per GPU or per group of CPU cores.
+
+    Each call takes the replica with the fewest calls in flight, ties go to the replica that has been
+    dispatched the least, so load spreads evenly even when calls are sequential.
+
+    Attributes:
+        replicas (List[T]): Model replicas.
+
+    Methods:
+        acquire(): Context manager yielding the least loaded replica.
+        in_flight(): Number of calls running on each replica.
+
+    Example:
+        >>> pool = ReplicaPool([WhisperModel("small", device="cpu") for _ in range(2)])
+        >>> with pool.acquire() as model:
+        >>>     segments, info = model.transcribe(audio)
+    """
+
+    def __init__(self, replicas: List[T]):
+        if not replicas:
+            raise ValueError("ReplicaPool needs at least one replica")
+        self.replicas = replicas
+        self._in_flight = [0] * len(replicas)
+        self._dispatched = [0] * len(replicas)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.replicas)
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            index = min(range(len(self.replicas)), key=lambda i: (self._in_flight[i], self._dispatched[i]))
+            self._in_flight[index] += 1
+            self._dispatched[index] += 1
+
+        try:
+            yield self.replicas[index]
+        finally:
+            with self._lock:
+                self._in_flight[index] -= 1
+
+    def in_flight(self) -> List[int]:
+        """ Number of calls running on each replica """
+        with self._lock:
+            return list(self._in_flight)
@@ -8,9 +8,70 @@ load_dotenv()
 
 class Settings(BaseSettings):
     asyncpg_url: PostgresDsn = os.getenv("SQL_URL")
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", 5))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", 5))
+    persistence_enabled: bool = os.getenv("PERSISTENCE_ENABLED", "false").lower() in ("1", "true")
+    persistence_batch_size: int = int(os.getenv("PERSISTENCE_BATCH_SIZE", 5000))
+    persistence_flush_interval_ms: int = int(os.getenv("PERSISTENCE_FLUSH_INTERVAL_MS", 1000))
+    persistence_max_buffered_rows: int = int(os.getenv("PERSISTENCE_MAX_BUFFERED_ROWS", 200000))
     hugging_face_access_token: str = os.getenv("HUGGINGFACE_ACCESS_TOKEN")
     langfuse_secret_key: str = os.getenv("LANGFUSE_SECRET_KEY")
     langfuse_public_key: str = os.getenv("LANGFUSE_PUBLIC_KEY")
     langfuse_host: str = os.getenv("LANGFUSE_HOST")
+    prompt_cache_ttl_seconds: int = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", 60))
+    prompt_cache_max_entries: int = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", 256))
+    prompt_fetch_timeout_seconds: float = float(os.getenv("PROMPT_FETCH_TIMEOUT_SECONDS", 2))
+    streaming_buffer_seconds: int = int(os.getenv("STREAMING_BUFFER_SECONDS", 120))
+    streaming_max_window_seconds: int = int(os.getenv("STREAMING_MAX_WINDOW_SECONDS", 20))
+    language_id_min_seconds: float = float(os.getenv("LANGUAGE_ID_MIN_SECONDS", 1.5))
+    language_id_max_seconds: float = float(os.getenv("LANGUAGE_ID_MAX_SECONDS", 10))
+    whisper_queue_size: int = int(os.getenv("WHISPER_QUEUE_SIZE", 16))
+    llm_queue_size: int = int(os.getenv("LLM_QUEUE_SIZE", 4))
+    llm_batch_wait_ms: int = int(os.getenv("LLM_BATCH_WAIT_MS", 20))
+    llm_max_batch_size: int = int(os.getenv("LLM_MAX_BATCH_SIZE", 8))
+    llm_max_batch_tokens: int = int(os.getenv("LLM_MAX_BATCH_TOKENS", 32768))
+    llm_prefix_cache_mb: int = int(os.getenv("LLM_PREFIX_CACHE_MB", 1024))
+    llm_draft_model: str = os.getenv("LLM_DRAFT_MODEL", "")
+    llm_draft_lookahead: int = int(os.getenv("LLM_DRAFT_LOOKAHEAD", 5))
+    llm_draft_schedule: str = os.getenv("LLM_DRAFT_SCHEDULE", "heuristic")
+    llm_draft_memory_mb: int = int(os.getenv("LLM_DRAFT_MEMORY_MB", 2048))
+    llm_backend: str = os.getenv("LLM_BACKEND", "transformers")
+    llm_ct2_compute_type: str = os.getenv("LLM_CT2_COMPUTE_TYPE", "int8")
+    llm_ct2_device: str = os.getenv("LLM_CT2_DEVICE", "cpu")
+    llm_ct2_threads: int = int(os.getenv("LLM_CT2_THREADS", 0))
+    llm_ct2_cache_dir: str = os.getenv("LLM_CT2_CACHE_DIR", "")
+    inference_retry_after_seconds: int = int(os.getenv("INFERENCE_RETRY_AFTER_SECONDS", 5))
+    model_memory_budget_mb: int = int(os.getenv("MODEL_MEMORY_BUDGET_MB", 0))
+    model_warmup: str = os.getenv("MODEL_WARMUP", "whisper,norsk-llama3-8b")
+    whisper_memory_mb: int = int(os.getenv("WHISPER_MEMORY_MB", 4096))
+    whisper_model_size: str = os.getenv("WHISPER_MODEL_SIZE", "large-v3")
+    whisper_device: str = os.getenv("WHISPER_DEVICE", "cuda")
+    whisper_device_index: str = os.getenv("WHISPER_DEVICE_INDEX", "0")
+    whisper_compute_type: str = os.getenv("WHISPER_COMPUTE_TYPE", "float16")
+    whisper_cpu_threads: int = int(os.getenv("WHISPER_CPU_THREADS", 0))
+    whisper_num_workers: int = int(os.getenv("WHISPER_NUM_WORKERS", 1))
+    whisper_replicas: int = int(os.getenv("WHISPER_REPLICAS", 1))
+    whisper_batch_size: int = int(os.getenv("WHISPER_BATCH_SIZE", 16))
+    whisper_long_form_seconds: int = int(os.getenv("WHISPER_LONG_FORM_SECONDS", 60))
+    transcription_cache_mb: int = int(os.getenv("TRANSCRIPTION_CACHE_MB", 256))
+    transcription_cache_dir: str = os.getenv("TRANSCRIPTION_CACHE_DIR", "")
+    transcription_cache_disk_mb: int = int(os.getenv("TRANSCRIPTION_CACHE_DISK_MB", 2048))
+    transcription_jobs_dir: str = os.getenv("TRANSCRIPTION_JOBS_DIR", "")
+    transcription_job_ttl_seconds: int = int(os.getenv("TRANSCRIPTION_JOB_TTL_SECONDS", 3600))
+    transcription_job_max_upload_mb: int = int(os.getenv("TRANSCRIPTION_JOB_MAX_UPLOAD_MB", 2048))
+    transcription_max_jobs: int = int(os.getenv("TRANSCRIPTION_MAX_JOBS", 64))
+    transcription_job_cleanup_seconds: int = int(os.getenv("TRANSCRIPTION_JOB_CLEANUP_SECONDS", 60))
+    summary_cache_mb: int = int(os.getenv("SUMMARY_CACHE_MB", 64))
+    llm_context_tokens: int = int(os.getenv("LLM_CONTEXT_TOKENS", 8192))
+    summary_chunk_tokens: int = int(os.getenv("SUMMARY_CHUNK_TOKENS", 3072))
+    summary_chunk_max_new_tokens: int = int(os.getenv("SUMMARY_CHUNK_MAX_NEW_TOKENS", 384))
+    websocket_send_queue_size: int = int(os.getenv("WEBSOCKET_SEND_QUEUE_SIZE", 256))
+    websocket_slow_consumer_policy: str = os.getenv("WEBSOCKET_SLOW_CONSUMER_POLICY", "drop")
+    websocket_send_timeout_seconds: int = int(os.getenv("WEBSOCKET_SEND_TIMEOUT_SECONDS", 10))
+    model_server_socket: str = os.getenv("MODEL_SERVER_SOCKET", "")
+    llm_memory_mb: int = int(os.getenv("LLM_MEMORY_MB", 17408))
+    sentry_dsn: str = os.getenv("SENTRY_DSN", "https://9ad379461856a0bcbb781338621c4251@o4507148297371648.ingest.de.sentry.io/4507169618002000")
+    sentry_traces_sample_rate: float = float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", 0.05))
+    sentry_profiles_sample_rate: float = float(os.getenv("SENTRY_PROFILES_SAMPLE_RATE", 0.0))
 
 settings = Settings()
@@ -5,4 +5,9 @@ LLM_MESSAGE_ROLE_ASSISTANT = "assistant"
 NORSK_LLAMA3_MODEL = "bineric/NorskGPT-Llama3-8b"
 META_LLAMA3_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
 
-LANGFUSE_PROMPT_NORSK_SUMMARIZATION_DEFAULT = "norsk-summarization-prompt"
\ No newline at end of file
+WHISPER_MODEL_NAME = "whisper"
+NORSK_LLAMA3_MODEL_NAME = "norsk-llama3-8b"
+META_LLAMA3_MODEL_NAME = "meta-llama3-8b"
+
+LANGFUSE_PROMPT_NORSK_SUMMARIZATION_DEFAULT = "norsk-summarization-prompt"
+LANGFUSE_PROMPT_NORSK_CHUNK_SUMMARIZATION = "norsk-chunk-summarization-prompt"
\ No newline at end of file
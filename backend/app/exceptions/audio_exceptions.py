@@ -0,0 +1,5 @@
+class InvalidAudioFrameError(Exception):
+    """Binary audio frame can't be parsed or decoded"""
+    def __init__(self, reason: str):
+        self.message = f"Invalid audio frame: {reason}"
+        super().__init__(self.message)
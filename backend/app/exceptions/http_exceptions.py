@@ -50,11 +50,20 @@ class ConflictHTTPException(HTTPException):
         )
 
 
-class ServiceNotAvailableHTTPException(HTTPException):
+class PayloadTooLargeHTTPException(HTTPException):
     def __init__(self, msg: str):
+        super().__init__(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail=msg or "Request body is too large",
+        )
+
+
+class ServiceNotAvailableHTTPException(HTTPException):
+    def __init__(self, msg: str, retry_after: int | None = None):
         super().__init__(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=msg or "Service not available",
+            headers={"Retry-After": str(retry_after)} if retry_after is not None else None,
         )
 
 class InternalServerErrorHTTPException(HTTPException):
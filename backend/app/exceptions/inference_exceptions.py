@@ -0,0 +1,13 @@
+class InferenceQueueFullError(Exception):
+    """Inference queue of a model is full"""
+    def __init__(self, name: str, retry_after: int):
+        self.name = name
+        self.retry_after = retry_after
+        self.message = f"{name} inference queue is full, retry in {retry_after} seconds."
+        super().__init__(self.message)
+
+class ModelServerError(Exception):
+    """Model server can't be reached or failed to run a request"""
+    def __init__(self, reason: str):
+        self.message = f"Model server error: {reason}"
+        super().__init__(self.message)
@@ -0,0 +1,20 @@
+class UploadTooLargeError(Exception):
+    """Uploaded recording is larger than the limit"""
+    def __init__(self, max_mb: int):
+        self.max_mb = max_mb
+        self.message = f"Upload is larger than {max_mb} MB."
+        super().__init__(self.message)
+
+class InvalidUploadError(Exception):
+    """Upload is empty or its settings can't be parsed"""
+    def __init__(self, reason: str):
+        self.message = f"Invalid upload: {reason}"
+        super().__init__(self.message)
+
+class TranscriptionJobNotFinishedError(Exception):
+    """Result of a transcription job is asked for before the job completed"""
+    def __init__(self, job_id: str, status: str, error: str | None = None):
+        self.job_id = job_id
+        self.status = status
+        self.message = f"Transcription job {job_id} is {status}" + (f": {error}" if error else ".")
+        super().__init__(self.message)
@@ -1,22 +1,62 @@
+from contextlib import asynccontextmanager
+
+import app.constants as constants
 import sentry_sdk
-from app.routers import soap_router, summarize_router, transcription_router
+from app.ai.model_registry import model_registry
+from app.ai.model_server.client import model_server_client
+from app.ai.prompts import prompt_registry
+from app.config import settings
+from app.exceptions.inference_exceptions import ModelServerError
+from app.routers import health_router, metrics_router, soap_router, summarize_router, transcription_router
+from app.services.persistence_service import persistence_service
+from app.services.transcription_job_service import transcription_job_service
 from app.utils.logging import AppLogger
 from app.websockets.transcription import transcription_websocket
 from fastapi import FastAPI, WebSocket
 
-sentry_sdk.init(
-    dsn="https://9ad379461856a0bcbb781338621c4251@o4507148297371648.ingest.de.sentry.io/4507169618002000",
-    traces_sample_rate=1.0,
-    profiles_sample_rate=1.0,
-)
-
-app = FastAPI()
+# Tracing and profiling every request is too expensive in production, per-stage latencies are in /metrics
+if settings.sentry_dsn:
+    sentry_sdk.init(
+        dsn=settings.sentry_dsn,
+        traces_sample_rate=settings.sentry_traces_sample_rate,
+        profiles_sample_rate=settings.sentry_profiles_sample_rate,
+    )
 
 logger = AppLogger().get_logger()
-app = FastAPI(title="Ara AI", description="This is backend for Ara AI", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fetch prompts in the background so the first requests don't wait for langfuse
+    prompt_registry.warmup([
+        (constants.LANGFUSE_PROMPT_NORSK_SUMMARIZATION_DEFAULT, None),
+        (constants.LANGFUSE_PROMPT_NORSK_CHUNK_SUMMARIZATION, None)
+    ])
+    if model_server_client:
+        # The models run in the model server, workers only connect to it
+        try:
+            await model_server_client.connect()
+        except ModelServerError as e:
+            logger.warning(f"{e.message}, connecting again on the first request")
+    else:
+        # Models load in the background after startup, /health/ready reports when they are done
+        model_registry.warmup(name.strip() for name in settings.model_warmup.split(","))
+    # Expired transcription jobs are deleted in the background
+    transcription_job_service.start_cleanup()
+    # Sessions, transcripts and notes are written to the database in batches, when persistence is enabled
+    persistence_service.start()
+    yield
+    transcription_job_service.stop_cleanup()
+    await persistence_service.stop()
+    prompt_registry.shutdown()
+    if model_server_client:
+        await model_server_client.close()
+
+app = FastAPI(title="Ara AI", description="This is backend for Ara AI", version="0.1.0", lifespan=lifespan)
 
 v1_prefix = "/api/v1"
 
+app.include_router(health_router.router, tags=['Health'])
+app.include_router(metrics_router.router, tags=['Metrics'])
 app.include_router(soap_router.router, tags=['Journal notes'], prefix=v1_prefix)
 app.include_router(summarize_router.router, tags=['Summarization'], prefix=v1_prefix)
 app.include_router(transcription_router.router, tags=['Transcription'], prefix=v1_prefix)
@@ -0,0 +1,55 @@
+from app.models.base import Base, TimeStampMixin
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String, Text, Uuid
+
+
+class TranscriptionSession(TimeStampMixin, Base):
+    """
+    A transcription: a websocket connection, a POST /transcription request or a transcription job.
+    Rows are written by `PersistenceService`, `closed_at` is set once the session ended.
+    """
+    __tablename__ = "transcription_session"
+
+    id = Column(Uuid, primary_key=True)
+    # websocket, rest or job
+    source = Column(String(16), nullable=False)
+    language = Column(String(16))
+    # Words transcribed in the session, words dropped by a full write buffer included
+    words = Column(Integer, nullable=False, default=0)
+    closed_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_transcription_session_created_at", "created_at"),
+    )
+
+class TranscriptionWord(Base):
+    """
+    A transcribed word, `seq` is its position in the session. Timestamps are in ms from the start of the recording.
+    The primary key is the only index, it serves reading a session in order and every other index would slow down the bulk inserts.
+    """
+    __tablename__ = "transcription_word"
+
+    session_id = Column(Uuid, ForeignKey("transcription_session.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    word = Column(Text, nullable=False)
+    start_ms = Column(Integer, nullable=False)
+    end_ms = Column(Integer, nullable=False)
+    probability = Column(Float)
+
+class GeneratedNote(TimeStampMixin, Base):
+    """
+    A generated summary or journal note, linked to the transcription session it was generated in when there is one.
+    """
+    __tablename__ = "generated_note"
+
+    id = Column(Uuid, primary_key=True)
+    session_id = Column(Uuid, ForeignKey("transcription_session.id", ondelete="CASCADE"))
+    # summary or soap_subjective
+    kind = Column(String(32), nullable=False)
+    prompt_name = Column(String(128))
+    prompt_version = Column(Integer)
+    content = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index("ix_generated_note_session_id", "session_id", postgresql_where=session_id.isnot(None)),
+        Index("ix_generated_note_created_at", "created_at"),
+    )
@@ -0,0 +1,108 @@
+from typing import List
+
+from app.ai.model_registry import model_registry
+from app.ai.model_server import protocol
+from app.ai.model_server.client import model_server_client
+from app.exceptions.http_exceptions import NotFoundHTTPException, ServiceNotAvailableHTTPException
+from app.exceptions.inference_exceptions import ModelServerError
+from app.websockets.transcription import manager as transcription_manager
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+router = APIRouter(prefix="/health")
+
+class WarmupRequestSchema(BaseModel):
+    models: List[str]
+
+@router.get("/live")
+async def live():
+    """
+    Liveness probe, the process is up and serving requests. Models are not checked.
+
+    Response:
+
+        {
+            status (str): "ok"
+        }
+    """
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def ready():
+    """
+    Readiness probe, 200 once the warmup models have been loaded, 503 before that or if one failed to load.
+    Models unloaded later to stay within the memory budget are loaded again on use and don't affect readiness.
+    With a model server, its models are reported, and 503 is returned while it can't be reached.
+
+    Response:
+
+        {
+            ready (bool): Whether the models are ready
+            models (dict): State of each model, e.g. {"whisper": {"state": "loaded", "memory_mb": 4096, ...}}
+        }
+    """
+    if model_server_client:
+        try:
+            content = await model_server_client.request(protocol.METHOD_STATUS)
+        except ModelServerError as e:
+            content = {"ready": False, "models": {}, "error": e.message}
+    else:
+        content = {"ready": model_registry.is_ready(), "models": model_registry.status()}
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if content["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=content
+    )
+
+@router.post("/warmup", status_code=status.HTTP_202_ACCEPTED)
+async def warmup(model: WarmupRequestSchema):
+    """
+    Loads models in the background, readiness waits for them.
+
+    Request:
+
+        {
+            models (List[str]): Model names, e.g. ["whisper", "norsk-llama3-8b"]
+        }
+
+    Response:
+
+        {
+            models (dict): State of each model
+        }
+    """
+    unknown = [name for name in model.models if name not in model_registry]
+    if unknown:
+        raise NotFoundHTTPException(msg=f"Unknown models: {', '.join(unknown)}")
+
+    if model_server_client:
+        try:
+            return {"models": await model_server_client.request(protocol.METHOD_WARMUP, {"models": model.models})}
+        except ModelServerError as e:
+            raise ServiceNotAvailableHTTPException(msg=e.message)
+
+    model_registry.warmup(model.models)
+    return {"models": model_registry.status()}
+
+@router.get("/connections")
+async def connections():
+    """
+    Send metrics of the open transcription websockets, aggregated over all of them. Nothing is reported by
+    session, so this endpoint reveals no session ids.
+
+    Response:
+
+        {
+            connections (int): Number of open websockets
+            queued (int): Messages waiting to be sent, over all websockets
+            max_queue_depth (int): Longest send queue of an open websocket
+            sent (int): Messages sent over open websockets
+            dropped (int): Partial messages dropped for slow clients, over open websockets
+            closing (int): Websockets being closed
+            send_latency_ms (dict): {"p50", "p95", "max"} over websockets of their moving average send time
+            max_send_latency_ms (float): Longest send of an open websocket
+            queue_latency_ms (dict): {"p50", "p95", "max"} over websockets of their moving average queueing time
+        }
+    """
+    return transcription_manager.metrics()
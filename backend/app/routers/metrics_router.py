@@ -0,0 +1,31 @@
+from app.ai.model_server import protocol
+from app.ai.model_server.client import model_server_client
+from app.exceptions.inference_exceptions import ModelServerError
+from app.utils.logging import AppLogger
+from app.utils.metrics import metrics_registry
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+logger = AppLogger().get_logger()
+
+router = APIRouter()
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Metrics of this process in Prometheus text format: per-stage latency histograms (base64 and audio decoding,
+    audio concatenation, VAD, Whisper decoding, LLM prefill and decode, inference queue wait), counters of
+    transcribed audio, emitted words and generated tokens, and gauges of pending inference calls and open websockets.
+    With a model server, its metrics are included with the label process="model_server".
+    """
+    extra = []
+    if model_server_client:
+        try:
+            extra = await model_server_client.request(protocol.METHOD_METRICS)
+        except ModelServerError as e:
+            logger.warning(f"Model server metrics are missing: {e.message}")
+
+    return PlainTextResponse(metrics_registry.render(extra), media_type=CONTENT_TYPE)
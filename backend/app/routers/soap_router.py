@@ -1,8 +1,13 @@
-import app.ai.prompts as prompts
-from app.ai.models.llms.norsk_llama3_8b import model as norsk_llama3_8b
-from app.exceptions.http_exceptions import InternalServerErrorHTTPException
+from typing import Optional
+
+import app.constants as constants
+from app.exceptions.http_exceptions import InternalServerErrorHTTPException, ServiceNotAvailableHTTPException
+from app.exceptions.inference_exceptions import InferenceQueueFullError, ModelServerError
 from app.exceptions.langfuse_exceptions import LangFusePromptError
+from app.services.persistence_service import NOTE_SOAP_SUBJECTIVE, persistence_service
+from app.services.summarization_service import summarization_service
 from app.utils.logging import AppLogger
+from app.utils.sse import token_event_response
 from fastapi import APIRouter
 from pydantic import BaseModel
 
@@ -12,6 +17,10 @@ router = APIRouter(prefix="/soap")
 
 class SoapRequestSchema(BaseModel):
     transcription: str
+    langfuse_prompt_name: str = constants.LANGFUSE_PROMPT_NORSK_SUMMARIZATION_DEFAULT
+    langfuse_prompt_version: Optional[int] = None
+    # Greedy decoding, identical requests get the cached note
+    deterministic: bool = False
 
 class SoapResponseSchema(BaseModel):
     note: str
@@ -23,16 +32,43 @@ async def subjective(model: SoapRequestSchema):
     TODO
     """
     try:
-        prompt = prompts.get_summarization_prompt(
-            content=model.transcription,
-            prompt_name=model.langfuse_prompt_name,
-            prompt_version=model.langfuse_prompt_version
-        )
-        result = await norsk_llama3_8b.invoke(prompt=prompt.prompt, langfuse_args={"name": "summarization", "prompt": prompt.langfuse_client})
+        result = await summarization_service.summarize(transcription=model.transcription,
+                                                       prompt_name=model.langfuse_prompt_name,
+                                                       prompt_version=model.langfuse_prompt_version,
+                                                       langfuse_args={"name": "summarization"},
+                                                       deterministic=model.deterministic)
 
     except LangFusePromptError as e:
         raise InternalServerErrorHTTPException(msg=e.message)
+    except InferenceQueueFullError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message, retry_after=e.retry_after)
+    except ModelServerError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message)
     finally:
         pass
 
+    persistence_service.add_note(NOTE_SOAP_SUBJECTIVE, result, prompt_name=model.langfuse_prompt_name, prompt_version=model.langfuse_prompt_version)
     return SoapResponseSchema(note=result)
+
+@router.post("/subjective/stream")
+async def subjective_stream(model: SoapRequestSchema):
+    """
+    Streams the subjective note as Server-Sent Events while it is generated.
+    Events are `token` ({"token": str}) for each piece of text and `done` ({"note": str}) at the end.
+    """
+    try:
+        tokens = summarization_service.stream_summary(transcription=model.transcription,
+                                                      prompt_name=model.langfuse_prompt_name,
+                                                      prompt_version=model.langfuse_prompt_version,
+                                                      langfuse_args={"name": "summarization"},
+                                                      deterministic=model.deterministic)
+        return await token_event_response(tokens, result_key="note",
+                                          on_done=lambda note: persistence_service.add_note(NOTE_SOAP_SUBJECTIVE, note, prompt_name=model.langfuse_prompt_name,
+                                                                                            prompt_version=model.langfuse_prompt_version))
+
+    except LangFusePromptError as e:
+        raise InternalServerErrorHTTPException(msg=e.message)
+    except InferenceQueueFullError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message, retry_after=e.retry_after)
+    except ModelServerError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message)
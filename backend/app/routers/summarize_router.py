@@ -1,8 +1,10 @@
-import app.ai.prompts as prompts
-from app.ai.models.llms.norsk_llama3_8b import model as norsk_llama3_8b
-from app.exceptions.http_exceptions import InternalServerErrorHTTPException
+from app.exceptions.http_exceptions import InternalServerErrorHTTPException, ServiceNotAvailableHTTPException
+from app.exceptions.inference_exceptions import InferenceQueueFullError, ModelServerError
 from app.exceptions.langfuse_exceptions import LangFusePromptError
+from app.services.persistence_service import NOTE_SUMMARY, persistence_service
+from app.services.summarization_service import summarization_service
 from app.utils.logging import AppLogger
+from app.utils.sse import token_event_response
 from fastapi import APIRouter
 from pydantic import BaseModel
 
@@ -12,6 +14,8 @@ router = APIRouter(prefix="/summarize")
 
 class SummarizeRequestSchema(BaseModel):
     transcription: str
+    # Greedy decoding, identical requests get the cached summary
+    deterministic: bool = False
 
 class SummarizeResponseSchema(BaseModel):
     summary: str
@@ -24,6 +28,7 @@ async def summarize(model: SummarizeRequestSchema):
 
         {
             transcription (str): Transcription that needs to be summarized
+            deterministic (Optional[bool]): Decode greedily, so the same transcription always gives the same summary and retries are answered from the cache. Default is false.
         }
 
     Response:
@@ -33,16 +38,58 @@ async def summarize(model: SummarizeRequestSchema):
         }
     """
     try:
-        prompt = prompts.get_summarization_prompt(
-            content=model.transcription,
-            prompt_name="norsk-summarization-prompt"
-        )
-        result = await norsk_llama3_8b.invoke(prompt=prompt.prompt,
-                                              langfuse_args={"name": "summarization", "prompt": prompt.langfuse_client})
+        # Transcriptions longer than the model context are summarized in chunks first
+        result = await summarization_service.summarize(transcription=model.transcription,
+                                                       prompt_name="norsk-summarization-prompt",
+                                                       langfuse_args={"name": "summarization"},
+                                                       deterministic=model.deterministic)
 
     except LangFusePromptError as e:
         raise InternalServerErrorHTTPException(msg=e.message)
+    except InferenceQueueFullError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message, retry_after=e.retry_after)
+    except ModelServerError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message)
     finally:
         pass
 
+    persistence_service.add_note(NOTE_SUMMARY, result, prompt_name="norsk-summarization-prompt")
     return SummarizeResponseSchema(summary=result)
+
+@router.post("/stream")
+async def summarize_stream(model: SummarizeRequestSchema):
+    """
+    Streams the summary as Server-Sent Events while it is generated.
+    A cached deterministic summary is sent as a single token.
+
+    Request:
+
+        {
+            transcription (str): Transcription that needs to be summarized
+            deterministic (Optional[bool]): Decode greedily and use the cache, check `summarize`. Default is false.
+        }
+
+    Response (text/event-stream):
+
+        event: token
+        data: {"token": str}
+
+        ...
+
+        event: done
+        data: {"summary": str}
+    """
+    try:
+        tokens = summarization_service.stream_summary(transcription=model.transcription,
+                                                      prompt_name="norsk-summarization-prompt",
+                                                      langfuse_args={"name": "summarization"},
+                                                      deterministic=model.deterministic)
+        return await token_event_response(tokens, result_key="summary",
+                                          on_done=lambda summary: persistence_service.add_note(NOTE_SUMMARY, summary, prompt_name="norsk-summarization-prompt"))
+
+    except LangFusePromptError as e:
+        raise InternalServerErrorHTTPException(msg=e.message)
+    except InferenceQueueFullError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message, retry_after=e.retry_after)
+    except ModelServerError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message)
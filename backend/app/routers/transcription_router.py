@@ -1,20 +1,50 @@
-from typing import List
-from app.ai.models.faster_whisper import faster_whisper_model
-from app.schemas.transcription_schemas import TranscriptionRequestSchema, TranscriptionWordSchema
+from typing import List, Union
+
+import orjson
+from app.exceptions.http_exceptions import BadRequestHTTPException, ConflictHTTPException, NotFoundHTTPException, PayloadTooLargeHTTPException, ServiceNotAvailableHTTPException
+from app.exceptions.inference_exceptions import InferenceQueueFullError, ModelServerError
+from app.exceptions.transcription_job_exceptions import InvalidUploadError, TranscriptionJobNotFinishedError, UploadTooLargeError
+from app.schemas.transcription_schemas import CompactTranscriptionSchema, TranscriptionConfigSchema, TranscriptionJobSchema, TranscriptionRequestSchema, TranscriptionSegmentSchema, TranscriptionWordSchema
+from app.services.persistence_service import SOURCE_REST, persistence_service
+from app.services.transcription_job_service import job_words, transcription_job_service
+from app.services.transcription_service import compact_words, transcription_service
 from app.utils.logging import AppLogger
-from fastapi import APIRouter
+from app.utils.metrics import transcription_words
+from app.utils.multipart_upload import MultipartUpload
+from app.utils.sse import format_event
+from fastapi import APIRouter, Request, status
+from fastapi.responses import Response, StreamingResponse
+from pydantic import ValidationError
 
 logger = AppLogger().get_logger()
 
 router = APIRouter(prefix="/transcription")
 
-@router.post("", response_model=List[TranscriptionWordSchema])
+@router.post("", response_model=Union[List[TranscriptionWordSchema], CompactTranscriptionSchema])
 async def transcription(model: TranscriptionRequestSchema):
     # pass
     """
     Generate Transcription using Faster-Whisper Large-V3 model
     """
-    segments, info = faster_whisper_model.transcribe_from_blob(blob=model.blob, cfg=model.config)
+    try:
+        # Resends of the same recording are answered from the cache
+        segments, info = await transcription_service.transcribe_blobs([model.blob], cfg=model.config.model_dump())
+    except InferenceQueueFullError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message, retry_after=e.retry_after)
+    except ModelServerError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message)
+
+    if persistence_service.enabled:
+        session_id = persistence_service.start_session(SOURCE_REST, language=info.language)
+        persistence_service.add_words(session_id, compact_words(segments, probabilities=True))
+        persistence_service.close_session(session_id)
+
+    if model.config.response_format == "compact":
+        result = compact_words(segments, probabilities=model.config.probabilities)
+        transcription_words.labels("rest").inc(len(result["words"]))
+        # Plain lists, serialized with orjson without validating them again
+        return Response(content=orjson.dumps(result), media_type="application/json")
+
     result = []
     for segment in segments:
         for word in segment.words:
@@ -22,4 +52,101 @@ async def transcription(model: TranscriptionRequestSchema):
                 word=word.word,
                 timestamp=[ int(word.start * 1000), int(word.end * 1000) ]
             ))
-    return result
\ No newline at end of file
+    transcription_words.labels("rest").inc(len(result))
+    return result
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED, response_model=TranscriptionJobSchema)
+async def create_transcription_job(request: Request):
+    """
+    Starts a transcription job and answers right away with its status, the recording is transcribed in the background.
+
+    The recording is either the "file" field of a multipart form, with the settings as JSON in an optional "config" field,
+    or the raw request body (e.g. a chunked upload), with the settings as query parameters (e.g. `?language=no&batch_size=8`).
+    The settings are those of `config` in `POST /transcription`. Uploads are written to disk as they arrive.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > transcription_job_service.max_upload_bytes:
+        raise PayloadTooLargeHTTPException(msg=UploadTooLargeError(transcription_job_service.max_upload_bytes // 2 ** 20).message)
+
+    try:
+        config = dict(request.query_params)
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            # Parsed as it arrives, the file goes straight to the job and the size limit applies while uploading
+            upload = MultipartUpload(content_type, request.stream(), max_file_bytes=transcription_job_service.max_upload_bytes)
+
+            def job_config() -> dict:
+                # The "config" field may come after the file, it is read once the upload is spooled
+                if "config" in upload.fields:
+                    config.update(orjson.loads(upload.fields["config"]))
+                return TranscriptionConfigSchema.model_validate(config).model_dump()
+
+            return await transcription_job_service.create(upload.file_chunks(), job_config)
+
+        cfg = TranscriptionConfigSchema.model_validate(config).model_dump()
+        return await transcription_job_service.create(request.stream(), cfg)
+    except InvalidUploadError as e:
+        raise BadRequestHTTPException(msg=e.message)
+    except (ValidationError, orjson.JSONDecodeError) as e:
+        raise BadRequestHTTPException(msg=f"Invalid config: {e}")
+    except UploadTooLargeError as e:
+        raise PayloadTooLargeHTTPException(msg=e.message)
+    except InferenceQueueFullError as e:
+        raise ServiceNotAvailableHTTPException(msg=e.message, retry_after=e.retry_after)
+
+@router.get("/jobs/{job_id}", response_model=TranscriptionJobSchema)
+async def get_transcription_job(job_id: str):
+    """
+    Status of a transcription job. Jobs are deleted `TRANSCRIPTION_JOB_TTL_SECONDS` after they finished.
+    """
+    job = await transcription_job_service.get(job_id)
+    if job is None:
+        raise NotFoundHTTPException(msg=f"Transcription job {job_id} not found")
+    return job
+
+@router.get("/jobs/{job_id}/segments", response_model=List[TranscriptionSegmentSchema])
+async def get_transcription_job_segments(job_id: str, start: int = 0):
+    """
+    Segments decoded so far, from index `start` on, so polling clients only fetch new segments. Timestamps are in ms.
+    """
+    segments = await transcription_job_service.segments(job_id, start)
+    if segments is None:
+        raise NotFoundHTTPException(msg=f"Transcription job {job_id} not found")
+    return segments
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_transcription_job(job_id: str):
+    """
+    Streams the segments of a transcription job as Server-Sent Events while they are decoded.
+    Sends a `segment` event for each segment, the already decoded ones first, then a `done` event with the job status.
+    """
+    if await transcription_job_service.get(job_id) is None:
+        raise NotFoundHTTPException(msg=f"Transcription job {job_id} not found")
+
+    async def events():
+        async for event, data in transcription_job_service.stream(job_id):
+            yield format_event(event, TranscriptionJobSchema(**data).model_dump() if event == "done" else data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Tell nginx not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/jobs/{job_id}/result", response_model=Union[List[TranscriptionWordSchema], CompactTranscriptionSchema])
+async def get_transcription_job_result(job_id: str):
+    """
+    Words of a completed transcription job, in the `response_format` of its settings, as `POST /transcription` answers.
+    """
+    try:
+        result = await transcription_job_service.result(job_id)
+    except TranscriptionJobNotFinishedError as e:
+        raise ConflictHTTPException(msg=e.message)
+    if result is None:
+        raise NotFoundHTTPException(msg=f"Transcription job {job_id} not found")
+
+    segments, config = result
+    words = job_words(segments, config["response_format"], config["probabilities"])
+    transcription_words.labels("job").inc(len(words["words"]) if isinstance(words, dict) else len(words))
+    return Response(content=orjson.dumps(words), media_type="application/json")
@@ -1,9 +1,15 @@
-from typing import Tuple
+from typing import List, Literal, Optional, Tuple
 
 from pydantic import BaseModel, model_validator
 
 class TranscriptionConfigSchema(BaseModel):
     language: str = "en"
+    # Windows decoded together, 1 for sequential decoding, None to batch long recordings only
+    batch_size: Optional[int] = None
+    # "compact" answers with parallel arrays instead of one object per word, check `CompactTranscriptionSchema`
+    response_format: Literal["words", "compact"] = "words"
+    # Probability of each word, compact format only
+    probabilities: bool = False
 
 class TranscriptionRequestSchema(BaseModel):
     blob: str
@@ -11,4 +17,39 @@ class TranscriptionRequestSchema(BaseModel):
 
 class TranscriptionWordSchema(BaseModel):
     word: str
-    timestamp: Tuple[int, int]
\ No newline at end of file
+    timestamp: Tuple[int, int]
+
+class CompactTranscriptionSchema(BaseModel):
+    """
+    Words of a transcription as parallel arrays, the i-th word is spoken from start[i] to end[i] (ms)
+    """
+    words: List[str]
+    start: List[int]
+    end: List[int]
+    probability: Optional[List[float]] = None
+
+class TranscriptionJobSchema(BaseModel):
+    id: str
+    status: Literal["queued", "running", "completed", "failed"]
+    created_at: float
+    updated_at: float
+    # Bytes uploaded
+    size: int
+    # Seconds of audio, known once the recording is decoded
+    duration: Optional[float] = None
+    language: Optional[str] = None
+    # Segments decoded so far
+    segments: int
+    error: Optional[str] = None
+
+class TranscriptionSegmentWordSchema(BaseModel):
+    word: str
+    start: int
+    end: int
+    probability: float
+
+class TranscriptionSegmentSchema(BaseModel):
+    start: int
+    end: int
+    text: str
+    words: List[TranscriptionSegmentWordSchema]
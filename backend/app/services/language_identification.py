@@ -0,0 +1,107 @@
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Floor of a language probability, so one detection can't rule a language out for good
+MIN_PROBABILITY = 1e-6
+
+class LanguageIdentifier:
+    """
+    Language of a websocket session in "auto" mode, settled from detections on its first seconds of speech
+    (check `FasterWhisperModel.detect_language`) instead of from transcriptions.
+
+    Each detection runs on audio the previous ones did not see, and their evidence is accumulated: the log
+    probabilities of each language are summed, so detections that agree reinforce each other and a single
+    unsure one does not decide. The language is settled once its combined probability reaches the threshold,
+    or with the most probable language once `max_seconds` of speech were seen. It never changes after that.
+
+    Attributes:
+        max_seconds (float): Seconds of speech after which the most probable language is taken.
+        language (Optional[str]): Settled language, None until then.
+        speech_seconds (float): Seconds of speech seen so far.
+        position (int): Absolute sample index of the streaming session audio up to which detection ran.
+        last_chunk_no (Optional[int]): Number of the last chunk of non-streaming audio messages kept for detection.
+        pending (List[np.ndarray]): Chunks of non-streaming audio messages no detection ran on yet.
+
+    Methods:
+        add(probabilities, speech_seconds, threshold): Adds a detection, returns the language once it is settled.
+        add_chunks(chunks, chunk_start_no): Keeps the chunks of an audio message that were not received before.
+        pending_samples(): Samples of the pending chunks.
+        best(): Most probable language so far, None before any speech.
+        probability(language): Combined probability of a language.
+    """
+
+    def __init__(self, max_seconds: float = 10):
+        self.max_seconds = max_seconds
+        self.language = None
+        self.speech_seconds = 0.0
+        self.position = 0
+        self.last_chunk_no = None
+        self.pending: List[np.ndarray] = []
+        self._log_probabilities: Dict[str, float] = {}
+        self._detections = 0
+
+    def add(self, probabilities: Dict[str, float], speech_seconds: float, threshold: float) -> Optional[str]:
+        """
+        Parameters:
+            probabilities (Dict[str, float]): Probability of each language in the new audio, empty without speech
+            speech_seconds (float): Seconds of speech in the new audio
+            threshold (float): Combined probability needed to settle the language, e.g. `language_probability_threshold`
+
+        Returns:
+            Optional[str]: The settled language, None while it is not settled
+        """
+        if self.language is not None or not probabilities:
+            return self.language
+
+        floor = math.log(MIN_PROBABILITY)
+        for language in probabilities.keys() | self._log_probabilities.keys():
+            probability = max(probabilities.get(language, 0.0), MIN_PROBABILITY)
+            # A language first seen now had the floor probability in the detections before
+            self._log_probabilities[language] = self._log_probabilities.get(language, floor * self._detections) + math.log(probability)
+        self._detections += 1
+        self.speech_seconds += speech_seconds
+
+        best = self.best()
+        if self.probability(best) >= threshold or self.speech_seconds >= self.max_seconds:
+            self.language = best
+        return self.language
+
+    def add_chunks(self, chunks: List[np.ndarray], chunk_start_no: int) -> int:
+        """
+        Keeps the decoded chunks of an audio message for the next detection.
+        Clients may resend overlapping windows of chunks, the known ones are skipped so no audio counts twice.
+
+        Parameters:
+            chunks (List[np.ndarray]): Decoded audio of each blob of the message
+            chunk_start_no (int): Chunk number of the first blob
+
+        Returns:
+            int: Number of pending samples
+        """
+        for index, chunk in enumerate(chunks):
+            chunk_no = chunk_start_no + index
+            if self.last_chunk_no is not None and chunk_no <= self.last_chunk_no:
+                continue
+            self.pending.append(chunk)
+            self.last_chunk_no = chunk_no
+        return self.pending_samples()
+
+    def pending_samples(self) -> int:
+        return sum(len(chunk) for chunk in self.pending)
+
+    def best(self) -> Optional[str]:
+        if self.language is not None:
+            return self.language
+        if not self._log_probabilities:
+            return None
+        return max(self._log_probabilities, key=self._log_probabilities.get)
+
+    def probability(self, language: Optional[str]) -> float:
+        """ Combined probability of `language`, the summed log probabilities normalized over all languages """
+        if language not in self._log_probabilities:
+            return 0.0
+        top = max(self._log_probabilities.values())
+        total = sum(math.exp(value - top) for value in self._log_probabilities.values())
+        return math.exp(self._log_probabilities[language] - top) / total
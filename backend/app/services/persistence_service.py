@@ -0,0 +1,336 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config import settings
+from app.models.database import Database, database
+from app.models.transcription import GeneratedNote, TranscriptionSession, TranscriptionWord
+from app.utils.logging import AppLogger
+from app.utils.metrics import persistence_buffered_rows, persistence_dropped_rows, persistence_flush_seconds, persistence_rows
+from sqlalchemy import bindparam, func, insert, update
+
+logger = AppLogger().get_logger()
+
+SOURCE_WEBSOCKET = "websocket"
+SOURCE_REST = "rest"
+SOURCE_JOB = "job"
+
+NOTE_SUMMARY = "summary"
+NOTE_SOAP_SUBJECTIVE = "soap_subjective"
+
+# Attempts at writing a batch before its rows are dropped
+MAX_ATTEMPTS = 3
+# Longest wait for the last flush on shutdown
+STOP_TIMEOUT_SECONDS = 10
+# Ids of sessions whose row was dropped kept, notes generated in them later are written without the session
+DROPPED_SESSIONS_KEPT = 10000
+
+SESSIONS = TranscriptionSession.__table__
+WORDS = TranscriptionWord.__table__
+NOTES = GeneratedNote.__table__
+
+# Sets what is known when a session closes, the language only when it was detected
+CLOSE_SESSION = update(SESSIONS).where(SESSIONS.c.id == bindparam("b_id")).values(
+    closed_at=bindparam("b_closed_at"),
+    updated_at=bindparam("b_closed_at"),
+    words=bindparam("b_words"),
+    language=func.coalesce(bindparam("b_language"), SESSIONS.c.language),
+)
+
+class PersistenceService:
+    """
+    Writes transcription sessions, their words and generated notes to the database in the background.
+
+    Callers only append rows to in-memory buffers, so transcription never waits for the database. A background
+    task writes the buffers every `flush_interval_ms`, as soon as `batch_size` words are buffered, and when
+    a session is closed. Each batch is one transaction of bulk inserts, instead of a commit per row as
+    `Base.save` does. A batch that fails is tried again `MAX_ATTEMPTS` times before its rows are dropped.
+    At most `max_buffered_rows` rows are buffered, words beyond are dropped and counted in
+    `persistence_dropped_rows`, their positions (`seq`) are skipped. When the row of a session is dropped, its
+    words and close are dropped as well, they could never be written without it, and its notes are written
+    without the session.
+
+    The add methods are thread-safe, e.g. words of a transcription job are added from a whisper worker thread.
+    Everything is a no-op when persistence is disabled.
+
+    Attributes:
+        database (Database): Database written to.
+        enabled (bool): Whether anything is written.
+        batch_size (int): Words written per transaction at most.
+        flush_interval_ms (int): Longest time rows wait in the buffer.
+        max_buffered_rows (int): Rows buffered at most.
+
+    Methods:
+        start_session(source, session_id, language): Buffers a new session and returns its id, None when disabled.
+        add_words(session_id, words): Buffers words of an open session.
+        close_session(session_id, language): Marks a session closed and flushes soon.
+        add_note(kind, content, session_id, prompt_name, prompt_version): Buffers a generated note.
+        flush(): Awaitable writing the buffered rows.
+        start(), stop(): Starts the background writer, stops it after writing what is left.
+    """
+
+    def __init__(self, database: Database, enabled: bool = False, batch_size: int = 5000, flush_interval_ms: int = 1000, max_buffered_rows: int = 200000):
+        self.database = database
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self.max_buffered_rows = max_buffered_rows
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._words = []
+        self._notes = []
+        self._closed = []
+        # Open sessions and the number of words added so far, the next `seq`
+        self._word_counts = {}
+        # Batch that failed, written again before anything else so rows keep their order
+        self._retry = None
+        self._dropped_sessions = OrderedDict()
+        self._buffered = 0
+        self._task = None
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        persistence_buffered_rows.set_function(lambda: self._buffered)
+
+    def start_session(self, source: str, session_id: Optional[str] = None, language: Optional[str] = None) -> Optional[str]:
+        """
+        Parameters:
+            source (str): SOURCE_WEBSOCKET, SOURCE_REST or SOURCE_JOB
+            session_id (Optional[str]): Id of the session, e.g. the job id, a new one by default
+            language (Optional[str]): Language, when it is known already
+
+        Returns:
+            Optional[str]: Id of the session, None when persistence is disabled
+        """
+        if not self.enabled:
+            return None
+
+        session_id = uuid.UUID(session_id) if session_id else uuid.uuid4()
+        now = _now()
+        with self._lock:
+            self._sessions.append({"id": session_id, "source": source, "language": language, "words": 0, "created_at": now, "updated_at": now})
+            self._word_counts[session_id] = 0
+            self._buffered += 1
+        return str(session_id)
+
+    def add_words(self, session_id: Optional[str], words: dict):
+        """
+        Parameters:
+            session_id (Optional[str]): Id returned by `start_session`, nothing is done for None
+            words (dict): Parallel arrays "words", "start", "end" (ms) and optionally "probability", check `compact_words`
+        """
+        if not self.enabled or session_id is None or not words["words"]:
+            return
+
+        session_id = uuid.UUID(session_id)
+        count = len(words["words"])
+        probabilities = words.get("probability") or [None] * count
+        with self._lock:
+            seq = self._word_counts.get(session_id)
+            if seq is None:
+                return
+            self._word_counts[session_id] = seq + count
+            if self._buffered + count > self.max_buffered_rows:
+                persistence_dropped_rows.labels(WORDS.name).inc(count)
+                return
+            self._words.extend(
+                {"session_id": session_id, "seq": seq + i, "word": word, "start_ms": start, "end_ms": end, "probability": probability}
+                for i, (word, start, end, probability) in enumerate(zip(words["words"], words["start"], words["end"], probabilities))
+            )
+            self._buffered += count
+            full = len(self._words) >= self.batch_size
+        if full:
+            self._wake()
+
+    def close_session(self, session_id: Optional[str], language: Optional[str] = None):
+        if not self.enabled or session_id is None:
+            return
+
+        session_id = uuid.UUID(session_id)
+        with self._lock:
+            count = self._word_counts.pop(session_id, None)
+            if count is None:
+                return
+            self._closed.append({"b_id": session_id, "b_closed_at": _now(), "b_words": count, "b_language": language})
+            self._buffered += 1
+        self._wake()
+
+    def add_note(self, kind: str, content: str, session_id: Optional[str] = None, prompt_name: Optional[str] = None, prompt_version: Optional[int] = None):
+        """
+        Parameters:
+            kind (str): NOTE_SUMMARY or NOTE_SOAP_SUBJECTIVE
+            content (str): Generated text
+            session_id (Optional[str]): Session the note was generated in
+            prompt_name (Optional[str]): Langfuse prompt it was generated with
+            prompt_version (Optional[int]): Version of the prompt
+        """
+        if not self.enabled:
+            return
+
+        now = _now()
+        session_id = uuid.UUID(session_id) if session_id else None
+        with self._lock:
+            if self._buffered + 1 > self.max_buffered_rows:
+                persistence_dropped_rows.labels(NOTES.name).inc()
+                return
+            if session_id in self._dropped_sessions:
+                session_id = None
+            self._notes.append({
+                "id": uuid.uuid4(),
+                "session_id": session_id,
+                "kind": kind,
+                "prompt_name": prompt_name,
+                "prompt_version": prompt_version,
+                "content": content,
+                "created_at": now,
+                "updated_at": now,
+            })
+            self._buffered += 1
+
+    async def flush(self) -> bool:
+        """
+        Writes the buffered rows, `batch_size` words per transaction at most.
+
+        Returns:
+            bool: Whether everything was written, False when a batch failed
+        """
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return True
+            if not await self._write(batch):
+                return False
+
+    def _take_batch(self) -> dict | None:
+        if self._retry is not None:
+            return self._retry
+
+        with self._lock:
+            if not (self._sessions or self._words or self._notes or self._closed):
+                return None
+            # Sessions are inserted before their words and notes, and closed after
+            batch = {
+                SESSIONS.name: self._sessions,
+                WORDS.name: self._words[:self.batch_size],
+                NOTES.name: self._notes,
+                "closed": self._closed,
+                "attempts": 0,
+            }
+            self._sessions, self._notes, self._closed = [], [], []
+            self._words = self._words[self.batch_size:]
+        return batch
+
+    async def _write(self, batch: dict) -> bool:
+        rows = len(batch[SESSIONS.name]) + len(batch[WORDS.name]) + len(batch[NOTES.name]) + len(batch["closed"])
+        start = time.perf_counter()
+        try:
+            async with self.database.engine.begin() as connection:
+                for table in (SESSIONS, WORDS, NOTES):
+                    if batch[table.name]:
+                        # One executemany, sent as multi-row inserts
+                        await connection.execute(insert(table), batch[table.name])
+                if batch["closed"]:
+                    await connection.execute(CLOSE_SESSION, batch["closed"])
+        except Exception as e:
+            batch["attempts"] += 1
+            if batch["attempts"] < MAX_ATTEMPTS:
+                logger.warning(f"Writing {rows} rows to the database failed, trying again: {e}")
+                self._retry = batch
+                return False
+
+            logger.error(f"Writing {rows} rows to the database failed {MAX_ATTEMPTS} times, dropping them: {e}")
+            self._retry = None
+            self._drop(batch, rows)
+            return False
+        finally:
+            persistence_flush_seconds.observe(time.perf_counter() - start)
+
+        self._retry = None
+        for table in (SESSIONS, WORDS, NOTES):
+            persistence_rows.labels(table.name).inc(len(batch[table.name]))
+        with self._lock:
+            self._buffered -= rows
+        return True
+
+    def _drop(self, batch: dict, rows: int):
+        for table in (SESSIONS, WORDS, NOTES):
+            persistence_dropped_rows.labels(table.name).inc(len(batch[table.name]))
+        session_ids = {row["id"] for row in batch[SESSIONS.name]}
+
+        with self._lock:
+            self._buffered -= rows
+            if not session_ids:
+                return
+            # Rows of the dropped sessions would violate the foreign keys, and make every later batch fail too
+            for session_id in session_ids:
+                self._word_counts.pop(session_id, None)
+                self._dropped_sessions[session_id] = None
+            while len(self._dropped_sessions) > DROPPED_SESSIONS_KEPT:
+                self._dropped_sessions.popitem(last=False)
+            words = [row for row in self._words if row["session_id"] not in session_ids]
+            closed = [row for row in self._closed if row["b_id"] not in session_ids]
+            for note in self._notes:
+                if note["session_id"] in session_ids:
+                    note["session_id"] = None
+            dropped_words = len(self._words) - len(words)
+            self._buffered -= dropped_words + len(self._closed) - len(closed)
+            self._words, self._closed = words, closed
+        persistence_dropped_rows.labels(WORDS.name).inc(dropped_words)
+
+    def start(self):
+        """ Starts the background writer, in the event loop of the app """
+        if not self.enabled or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """ Writes what is left, rows of sessions still open included, and closes the database connections """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake()
+        try:
+            await asyncio.wait_for(self._task, STOP_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.error(f"Stopped before writing {self._buffered} buffered rows to the database")
+        self._task = None
+        await self.database.dispose()
+
+    async def _run(self):
+        attempts = 0
+        while not self._stopping:
+            try:
+                # Failed writes back off, one interval more per attempt
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval_ms * (attempts + 1) / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            attempts = 0 if await self.flush() else attempts + 1
+
+        for _ in range(MAX_ATTEMPTS):
+            if await self.flush():
+                break
+
+    def _wake(self):
+        if self._loop is not None:
+            # Called from whisper worker threads too
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+def _now() -> datetime:
+    # Timestamps without a time zone, in UTC like func.now() of the database container
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+persistence_service = PersistenceService(
+    database,
+    enabled=settings.persistence_enabled,
+    batch_size=settings.persistence_batch_size,
+    flush_interval_ms=settings.persistence_flush_interval_ms,
+    max_buffered_rows=settings.persistence_max_buffered_rows
+)
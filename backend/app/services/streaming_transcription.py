@@ -0,0 +1,270 @@
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from app.ai.audio import SAMPLE_RATE, decode_base64_audio
+from app.config import settings
+from app.utils.metrics import audio_concat_seconds
+from app.utils.ring_buffer import PCMRingBuffer
+
+# Characters of committed text passed to Whisper as initial_prompt
+PROMPT_MAX_CHARS = 200
+
+@dataclass
+class TimedWord:
+    """
+    start (float): seconds since the first sample of the session
+    end (float): seconds since the first sample of the session
+    text (str): word, with its leading space
+    """
+    start: float
+    end: float
+    text: str
+
+class HypothesisBuffer:
+    """
+    LocalAgreement-2 commitment of streaming hypotheses.
+
+    A word is committed once two consecutive hypotheses agree on it, i.e. it is in the longest common
+    prefix of the uncommitted words of the previous and the current hypothesis. Committed words are
+    never changed afterwards.
+
+    Attributes:
+        committed_in_window (List[TimedWord]): Committed words whose audio is still in the decode window.
+        tentative (List[TimedWord]): Uncommitted words of the last hypothesis.
+        last_committed_end (float): End of the last committed word.
+
+    Methods:
+        insert(words): Sets the current hypothesis, without the words that are already committed.
+        flush(): Commits the words both hypotheses agree on.
+        flush_all(): Commits the whole current hypothesis.
+        pop_committed(time): Forgets committed words whose audio ends before `time`.
+    """
+
+    def __init__(self):
+        self.committed_in_window: List[TimedWord] = []
+        self.tentative: List[TimedWord] = []
+        self.last_committed_end = 0.0
+        self._current: List[TimedWord] = []
+
+    def insert(self, words: List[TimedWord]):
+        # Words in the committed audio still in the window are transcribed again, drop them
+        words = [word for word in words if word.start > self.last_committed_end - 0.1]
+
+        if words and abs(words[0].start - self.last_committed_end) < 1:
+            # A word straddling the last committed end may come back, drop up to 5 repeated words
+            for n in range(min(len(self.committed_in_window), len(words), 5), 0, -1):
+                tail = [word.text.strip() for word in self.committed_in_window[-n:]]
+                head = [word.text.strip() for word in words[:n]]
+                if tail == head:
+                    words = words[n:]
+                    break
+
+        self._current = words
+
+    def flush(self) -> List[TimedWord]:
+        committed = []
+        for new, previous in zip(self._current, self.tentative):
+            if new.text.strip() != previous.text.strip():
+                break
+            committed.append(new)
+        self.tentative = self._current[len(committed):]
+        return self._commit(committed)
+
+    def flush_all(self) -> List[TimedWord]:
+        committed = self._current
+        self.tentative = []
+        return self._commit(committed)
+
+    def _commit(self, committed: List[TimedWord]) -> List[TimedWord]:
+        self._current = []
+        if committed:
+            self.last_committed_end = committed[-1].end
+            self.committed_in_window.extend(committed)
+        return committed
+
+    def pop_committed(self, time: float) -> List[TimedWord]:
+        popped = [word for word in self.committed_in_window if word.end <= time]
+        self.committed_in_window = self.committed_in_window[len(popped):]
+        return popped
+
+class StreamingTranscriptionSession:
+    """
+    Incremental transcription state of a single websocket connection.
+
+    Decoded audio is kept as float32 PCM in a bounded ring buffer. Every audio message only appends
+    the chunks that were not received before, and Whisper only decodes the window after the last
+    committed segment, with the committed text before it as `initial_prompt`. Words are committed with
+    LocalAgreement-2 (check `HypothesisBuffer`), and their audio is trimmed out of the window at segment
+    ends, so the cost of a message does not depend on how long the session has been running.
+
+    Attributes:
+        model (FasterWhisperModel): Model used for decoding.
+        configuration (dict): Transcription configuration of the connection. It is shared with the caller, so updates apply immediately.
+        buffer (PCMRingBuffer): Decoded audio of the session.
+        hypothesis (HypothesisBuffer): Committed and tentative words of the window.
+        committed_sample (int): Absolute sample index where the decode window starts.
+        last_chunk_no (int): Number of the last chunk appended to the buffer.
+        prompt (str): End of the committed text before the window.
+
+    Methods:
+        add_audio(blobs, chunk_start_no, timestamp): Decodes and appends the chunks that are new to the session.
+        new_blobs(blobs, chunk_start_no): Chunks of a message that are new to the session, still encoded.
+        add_samples(samples, chunk_no, timestamp): Appends a decoded chunk, e.g. of a binary audio frame.
+        decode(): Transcribes the window.
+        commit(segments): Commits stable words and returns the new committed words and the changed tentative words.
+    """
+
+    def __init__(self, model, configuration: dict, buffer_seconds: int | None = None, max_window_seconds: int | None = None):
+        """
+        Parameters:
+            model (FasterWhisperModel): Model used for decoding.
+            configuration (dict): Transcription configuration of the connection.
+            buffer_seconds (Optional[int]): Seconds of audio kept in memory. Default is `settings.streaming_buffer_seconds`.
+            max_window_seconds (Optional[int]): Longest window before it is force committed. Default is `settings.streaming_max_window_seconds`.
+        """
+        buffer_seconds = buffer_seconds or settings.streaming_buffer_seconds
+        max_window_seconds = max_window_seconds or settings.streaming_max_window_seconds
+
+        self.model = model
+        self.configuration = configuration
+        self.buffer = PCMRingBuffer(buffer_seconds * SAMPLE_RATE)
+        self.max_window_samples = min(max_window_seconds, buffer_seconds) * SAMPLE_RATE
+        self.hypothesis = HypothesisBuffer()
+        self.committed_sample = 0
+        self.window_start = 0
+        self.window_end = 0
+        self.last_chunk_no = None
+        self.origin_timestamp = 0
+        self.origin_chunk_no = 0
+        self.prompt = ""
+        self._sent_tentative: List[TimedWord] = []
+
+    def add_audio(self, blobs: List[str], chunk_start_no: int, timestamp: int) -> int:
+        """
+        Decodes and appends the chunks that were not received before.
+        Clients may resend overlapping windows of chunks, chunk numbers are used to skip the known ones.
+        Decoding blocks, on the event loop decode the blobs of `new_blobs` in a thread and append them with `add_samples`.
+
+        Parameters:
+            blobs (List[str]): Base64 encoded audio chunks (WAV, Opus/WebM...)
+            chunk_start_no (int): Chunk number of the first blob
+            timestamp (int): Client timestamp of the first blob in milliseconds
+
+        Returns:
+            int: Number of samples appended
+        """
+        appended = 0
+        for chunk_no, blob in self.new_blobs(blobs, chunk_start_no):
+            appended += self.add_samples(decode_base64_audio(blob), chunk_no, timestamp)
+
+        return appended
+
+    def new_blobs(self, blobs: List[str], chunk_start_no: int) -> List[tuple[int, str]]:
+        """
+        Parameters:
+            blobs (List[str]): Base64 encoded audio chunks
+            chunk_start_no (int): Chunk number of the first blob
+
+        Returns:
+            List[tuple[int, str]]: Chunk number and blob of the chunks that were not received before
+        """
+        return [
+            (chunk_start_no + index, blob)
+            for index, blob in enumerate(blobs)
+            if self.last_chunk_no is None or chunk_start_no + index > self.last_chunk_no
+        ]
+
+    def add_samples(self, samples: np.ndarray, chunk_no: int, timestamp: int) -> int:
+        """
+        Appends one already decoded chunk, unless it was received before.
+
+        Parameters:
+            samples (np.ndarray): Mono float32 samples at 16 kHz
+            chunk_no (int): Chunk or frame number
+            timestamp (int): Client timestamp in milliseconds, only used for the first chunk of the session
+
+        Returns:
+            int: Number of samples appended
+        """
+        if self.last_chunk_no is None:
+            self.origin_timestamp = timestamp
+            self.origin_chunk_no = chunk_no
+        elif chunk_no <= self.last_chunk_no:
+            return 0
+
+        self.buffer.append(samples)
+        self.last_chunk_no = chunk_no
+        return len(samples)
+
+    @property
+    def pending_samples(self) -> int:
+        """ Samples received since the last decode """
+        return self.buffer.end - self.window_end
+
+    def decode(self):
+        """
+        Transcribes the audio after the last trimmed segment, prompted with the committed text before it.
+
+        Returns:
+            tuple: Segments and transcription info, check `FasterWhisperModel.transcribe_from_file`. Segment timestamps are relative to the decoded window.
+        """
+        self.window_start = max(self.committed_sample, self.buffer.start)
+        self.window_end = self.buffer.end
+        with audio_concat_seconds.time():
+            window = self.buffer.read(self.window_start)
+        cfg = {**self.configuration, "initial_prompt": self.prompt or None, "batch_size": 1}
+        return self.model.transcribe_from_array(window, cfg=cfg)
+
+    def commit(self, segments) -> tuple[List[dict], List[dict] | None]:
+        """
+        Commits the words the last two hypotheses agree on, and trims the window after the last fully committed segment.
+        When the window grows past `max_window_samples` the whole hypothesis is committed so the window stays bounded.
+
+        Parameters:
+            segments (List[Segment]): Segments returned by `decode`
+
+        Returns:
+            tuple: Newly committed words, and the tentative words if they changed since the last call (None otherwise), in websocket payload format
+        """
+        offset = self.window_start / SAMPLE_RATE
+        is_full = self.window_end - self.window_start >= self.max_window_samples
+
+        self.hypothesis.insert([
+            TimedWord(start=offset + word.start, end=offset + word.end, text=word.word)
+            for segment in segments for word in segment.words or []
+        ])
+        committed = self.hypothesis.flush_all() if is_full else self.hypothesis.flush()
+
+        trim_time = None
+        for segment in segments:
+            if segment.words and offset + segment.words[-1].end <= self.hypothesis.last_committed_end:
+                trim_time = offset + segment.words[-1].end
+        if is_full and trim_time is None:
+            # No committed speech in a full window, keep the last second in case speech starts there
+            trim_time = max(offset, (self.window_end - SAMPLE_RATE) / SAMPLE_RATE)
+
+        if trim_time is not None:
+            self.committed_sample = min(max(int(trim_time * SAMPLE_RATE), self.window_start), self.buffer.end)
+            self.buffer.discard_until(self.committed_sample)
+            trimmed = "".join(word.text for word in self.hypothesis.pop_committed(trim_time))
+            self.prompt = (self.prompt + trimmed)[-PROMPT_MAX_CHARS:]
+
+        tentative = self.hypothesis.tentative
+        changed = tentative != self._sent_tentative
+        self._sent_tentative = list(tentative)
+
+        return self._words(committed, is_good=True), self._words(tentative, is_good=False) if changed else None
+
+    def _words(self, words: List[TimedWord], is_good: bool) -> List[dict]:
+        chunk_length_ms = self.configuration["chunk_length_ms"]
+
+        return [
+            {
+                "word": word.text,
+                "timestamp": [ int(word.start * 1000 + self.origin_timestamp), int(word.end * 1000 + self.origin_timestamp) ],
+                "is_good": is_good,
+                "chunk_num": self.origin_chunk_no + int(word.end * 1000 // chunk_length_ms),
+            }
+            for word in words
+        ]
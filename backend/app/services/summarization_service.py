@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import math
+from typing import AsyncIterator, List, Optional
+
+import app.ai.prompts as prompts
+from app.ai.model_server.client import RemoteLLM, model_server_client
+from app.ai.models.llms.norsk_llama3_8b import DEFAULT_CONFIG, GREEDY_CONFIG, NorskLlama38b
+from app.ai.models.llms.norsk_llama3_8b import model as norsk_llama3_8b
+from app.ai.prompts import Prompt
+from app.config import settings
+from app.utils.logging import AppLogger
+from app.utils.result_cache import ResultCache
+from app.utils.single_flight import SingleFlight
+from app.utils.text_chunking import pack_chunks, split_segments, split_sentences, split_words
+
+logger = AppLogger().get_logger()
+
+class SummarizationService:
+    """
+    LLM generation of summaries and notes, with a result cache for deterministic requests.
+
+    Deterministic requests decode greedily, so the same prompt always gives the same text. Their results
+    are cached by a hash of the full prompt, the prompt name and version and the generation config, and
+    identical concurrent requests share one generation. Retries and double submits don't reach the model.
+    Sampled requests always run the model.
+
+    Transcriptions too long for the model context are summarized map-reduce style: the transcription is
+    split on segment boundaries into token-budgeted chunks, the chunks are summarized as one batch, and the
+    summarization prompt is run over the partial summaries. Chunks grow so that one batch covers the whole
+    transcription, up to what fits the context and the token budget of a batch (`llm_max_batch_tokens`, the
+    scheduler splits larger batches). The latency is about two generations while the transcription fits one
+    batch of such chunks, longer transcriptions take one more batch per `llm_max_batch_size` chunks.
+
+    Attributes:
+        model (NorskLlama38b | RemoteLLM): Model generating the text, remote when the models run in a model server.
+        cache (ResultCache): Generated texts by request key.
+
+    Methods:
+        generate(prompt, langfuse_args, cfg, deterministic): Awaitable returning the generated text.
+        stream(prompt, langfuse_args, cfg, deterministic): Yields the generated text as it is generated.
+        summarize(transcription, prompt_name, prompt_version, langfuse_args, deterministic): Awaitable returning the summary of a transcription of any length.
+        stream_summary(transcription, prompt_name, prompt_version, langfuse_args, deterministic): Streaming variant of `summarize`.
+        summarization_prompt(transcription, prompt_name, prompt_version, deterministic): Awaitable returning the prompt of the final summary.
+    """
+
+    def __init__(self, model: NorskLlama38b | RemoteLLM, cache: ResultCache):
+        self.model = model
+        self.cache = cache
+        self._single_flight = SingleFlight()
+
+    async def generate(self, prompt: Prompt, langfuse_args: dict | None = None, cfg: dict | None = None, deterministic: bool = False) -> str:
+        """
+        Parameters:
+            prompt (Prompt): Prompt to complete
+            langfuse_args (Optional[dict]): Langfuse configuration, check `NorskLlama38b.invoke`
+            cfg (Optional[dict]): Generation configuration, check `NorskLlama38b.invoke`
+            deterministic (bool): Decode greedily and use the cache. Default is False.
+
+        Returns:
+            str: Generated text
+
+        Raises:
+            InferenceQueueFullError: If the LLM queue is full on a cache miss.
+        """
+        if not deterministic:
+            return await self.model.invoke(prompt=prompt.prompt, cfg=cfg, langfuse_args=langfuse_args, prefix=prompt.prefix)
+
+        cfg = {**(cfg or {}), **GREEDY_CONFIG}
+        key = self._key(prompt, cfg)
+        result = self.cache.get(key)
+        if result is not None:
+            logger.debug(f"Summary cache hit for prompt {prompt.name} (version {prompt.version})")
+            return result
+
+        return await self._single_flight.do(key, lambda: self._generate(key, prompt, langfuse_args, cfg))
+
+    async def _generate(self, key: str, prompt: Prompt, langfuse_args: dict | None, cfg: dict) -> str:
+        result = await self.model.invoke(prompt=prompt.prompt, cfg=cfg, langfuse_args=langfuse_args, prefix=prompt.prefix)
+        self.cache.put(key, result)
+        return result
+
+    async def stream(self, prompt: Prompt, langfuse_args: dict | None = None, cfg: dict | None = None, deterministic: bool = False) -> AsyncIterator[str]:
+        """
+        Streaming variant of `generate`. A cached deterministic result is yielded as one piece,
+        and a deterministic stream that runs to the end is cached. Streams are not coalesced.
+        """
+        if deterministic:
+            cfg = {**(cfg or {}), **GREEDY_CONFIG}
+            key = self._key(prompt, cfg)
+            result = self.cache.get(key)
+            if result is not None:
+                yield result
+                return
+
+        tokens = []
+        async for token in self.model.stream(prompt=prompt.prompt, cfg=cfg, langfuse_args=langfuse_args, prefix=prompt.prefix):
+            tokens.append(token)
+            yield token
+
+        if deterministic:
+            self.cache.put(key, "".join(tokens))
+
+    async def summarize(self, transcription: str, prompt_name: Optional[str] = None, prompt_version: Optional[int] = None, langfuse_args: dict | None = None, deterministic: bool = False) -> str:
+        """
+        Parameters:
+            transcription (str): Transcription to summarize, one segment per line
+            prompt_name (Optional[str]): Langfuse prompt of the summary, check `prompts.get_summarization_prompt`
+            prompt_version (Optional[int]): Langfuse prompt version
+            langfuse_args (Optional[dict]): Langfuse configuration of the final summary, check `NorskLlama38b.invoke`
+            deterministic (bool): Decode greedily and use the cache. Default is False.
+
+        Returns:
+            str: Summary
+
+        Raises:
+            InferenceQueueFullError: If the LLM queue is full.
+        """
+        prompt = await self.summarization_prompt(transcription, prompt_name, prompt_version, deterministic)
+        return await self.generate(prompt, langfuse_args={**(langfuse_args or {}), "prompt": prompt.langfuse_client}, deterministic=deterministic)
+
+    async def stream_summary(self, transcription: str, prompt_name: Optional[str] = None, prompt_version: Optional[int] = None, langfuse_args: dict | None = None, deterministic: bool = False) -> AsyncIterator[str]:
+        """
+        Streaming variant of `summarize`. Chunks of a long transcription are summarized before the first piece is yielded.
+        """
+        prompt = await self.summarization_prompt(transcription, prompt_name, prompt_version, deterministic)
+        async for token in self.stream(prompt, langfuse_args={**(langfuse_args or {}), "prompt": prompt.langfuse_client}, deterministic=deterministic):
+            yield token
+
+    async def summarization_prompt(self, transcription: str, prompt_name: Optional[str] = None, prompt_version: Optional[int] = None, deterministic: bool = False) -> Prompt:
+        """
+        Returns the summarization prompt of a transcription. When the transcription does not fit the
+        model context, it is summarized in chunks first and the prompt contains the partial summaries.
+
+        Raises:
+            InferenceQueueFullError: If the LLM queue is full while chunks are summarized.
+        """
+        # A prompt asked for by name is fetched on its first use, instead of silently falling back to the default one
+        await prompts.prompt_registry.wait_for(prompt_name, prompt_version, timeout=settings.prompt_fetch_timeout_seconds)
+        prompt = prompts.get_summarization_prompt(content=transcription, prompt_name=prompt_name, prompt_version=prompt_version)
+        prompt_tokens, content_tokens = await self.model.count_tokens([prompt.prompt, transcription])
+        budget = settings.llm_context_tokens - DEFAULT_CONFIG["max_new_tokens"] - (prompt_tokens - content_tokens)
+        if content_tokens <= budget:
+            return prompt
+
+        chunk_prompt_tokens = (await self.model.count_tokens([prompts.get_chunk_summarization_prompt("").prompt]))[0]
+        # A full batch of chunks has to fit `llm_max_batch_tokens` too, otherwise the scheduler runs it as several batches
+        batch_chunk_budget = settings.llm_max_batch_tokens // settings.llm_max_batch_size - settings.summary_chunk_max_new_tokens - chunk_prompt_tokens
+        chunk_budget = max(1, min(settings.llm_context_tokens - settings.summary_chunk_max_new_tokens - chunk_prompt_tokens, batch_chunk_budget))
+        units, tokens = await self._segments(transcription, chunk_budget)
+
+        level = 0
+        while True:
+            level += 1
+            # Chunks grow up to the budget so one batch covers the whole text
+            chunk_tokens = min(chunk_budget, max(settings.summary_chunk_tokens, math.ceil(sum(tokens) / settings.llm_max_batch_size)))
+            chunks = pack_chunks(units, tokens, chunk_tokens)
+            logger.info(f"Summarizing {sum(tokens)} tokens in {len(chunks)} chunks (level {level})")
+            summaries = await self._summarize_chunks(chunks, deterministic)
+
+            previous_units = len(units)
+            units = [f"Del {number}:\n{summary.strip()}" for number, summary in enumerate(summaries, start=1)]
+            tokens = await self.model.count_tokens(units)
+            content = "\n\n".join(units)
+            if sum(tokens) + 2 * len(units) <= budget:
+                break
+            if len(units) >= previous_units:
+                logger.warning(f"Partial summaries do not get shorter, summarizing {sum(tokens)} tokens in one prompt")
+                break
+
+        return prompts.get_summarization_prompt(content=content, prompt_name=prompt_name, prompt_version=prompt_version)
+
+    async def _segments(self, transcription: str, max_tokens: int):
+        # Segments longer than a chunk are split into sentences, and sentences into words as a last resort
+        segments = split_segments(transcription)
+        segment_tokens = await self.model.count_tokens(segments)
+
+        units, tokens = [], []
+        for segment, count in zip(segments, segment_tokens):
+            if count <= max_tokens:
+                units.append(segment)
+                tokens.append(count)
+                continue
+            sentences = split_sentences(segment)
+            for sentence, sentence_count in zip(sentences, await self.model.count_tokens(sentences)):
+                pieces = [sentence] if sentence_count <= max_tokens else split_words(sentence, sentence_count, max_tokens)
+                units.extend(pieces)
+                tokens.extend(await self.model.count_tokens(pieces) if len(pieces) > 1 else [sentence_count])
+        return units, tokens
+
+    async def _summarize_chunks(self, chunks: List[str], deterministic: bool) -> List[str]:
+        # Submitted one batch at a time, so a long transcription does not fill the LLM queue
+        cfg = {"max_new_tokens": settings.summary_chunk_max_new_tokens}
+        summaries = []
+        for start in range(0, len(chunks), settings.llm_max_batch_size):
+            batch = [prompts.get_chunk_summarization_prompt(chunk) for chunk in chunks[start:start + settings.llm_max_batch_size]]
+            summaries.extend(await asyncio.gather(*(
+                self.generate(prompt, langfuse_args={"name": "summarization-chunk", "prompt": prompt.langfuse_client}, cfg=cfg, deterministic=deterministic)
+                for prompt in batch
+            )))
+        return summaries
+
+    def _key(self, prompt: Prompt, cfg: dict) -> str:
+        # The full prompt covers the transcript and the template text, even when a label moves to a new version
+        return hashlib.sha256(json.dumps({
+            "model": self.model.model_id,
+            "prompt": prompt.prompt,
+            "name": prompt.name,
+            "version": prompt.version,
+            "cfg": cfg,
+        }, sort_keys=True).encode()).hexdigest()
+
+summarization_service = SummarizationService(
+    RemoteLLM(model_server_client) if model_server_client else norsk_llama3_8b,
+    ResultCache(max_bytes=settings.summary_cache_mb * 2 ** 20)
+)
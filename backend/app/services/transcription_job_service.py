@@ -0,0 +1,407 @@
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Callable, List, Tuple
+
+import numpy as np
+import orjson
+from app.ai.audio import SAMPLE_RATE, decode_audio_file
+from app.ai.executor import whisper_executor
+from app.config import settings
+from app.exceptions.inference_exceptions import InferenceQueueFullError
+from app.exceptions.transcription_job_exceptions import InvalidUploadError, TranscriptionJobNotFinishedError, UploadTooLargeError
+from app.services.persistence_service import SOURCE_JOB, persistence_service
+from app.services.transcription_service import whisper_model
+from app.utils.logging import AppLogger
+from app.utils.metrics import transcription_jobs
+
+logger = AppLogger().get_logger()
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+# Files in the directory of a job
+AUDIO_FILE = "audio"
+STATUS_FILE = "job.json"
+SEGMENTS_FILE = "segments.jsonl"
+
+# How often streams look for new segments, they are written by the worker running the job
+POLL_SECONDS = 0.25
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class TranscriptionJobService:
+    """
+    Transcription jobs of uploaded recordings. Jobs are kept on disk, so any API worker can answer for a job,
+    not only the one that accepted the upload.
+
+    Each job is a directory `<directory>/<job id>` with:
+        audio: the uploaded recording, written chunk by chunk and deleted once decoded
+        job.json: status of the job, replaced atomically on every change
+        segments.jsonl: one JSON line per segment, appended as segments are decoded
+
+    A job runs on `whisper_executor` in the process that accepted it, at most `max_running` at a time, so
+    at most that many decoded recordings are in memory. Finished jobs are deleted `ttl_seconds` after they
+    finished. Jobs left unfinished by a worker that stopped are marked failed.
+
+    Attributes:
+        model (FasterWhisperModel | RemoteWhisperModel): Model the jobs run on.
+        directory (str): Directory of the jobs, on a local disk shared by the workers of the host.
+        ttl_seconds (int): Seconds finished jobs are kept.
+        max_upload_bytes (int): Largest accepted upload.
+        max_jobs (int): Jobs of this process waiting or running, new uploads are rejected beyond.
+
+    Methods:
+        create(chunks, cfg): Awaitable spooling an upload to disk and starting its job, returns the job status.
+        get(job_id): Awaitable returning the status of a job, or None.
+        segments(job_id, start): Awaitable returning the decoded segments from index `start` on, or None.
+        stream(job_id): Yields ("segment", segment) events as segments are decoded, then ("done", status).
+        result(job_id): Awaitable returning the segments and settings of a completed job, or None.
+        cleanup(): Deletes expired jobs, fails jobs of stopped workers.
+        start_cleanup(), stop_cleanup(): Starts and stops the periodic cleanup.
+    """
+
+    def __init__(self, model, directory: str, ttl_seconds: int = 3600, max_upload_bytes: int = 2 ** 31, max_jobs: int = 64, max_running: int = 1, cleanup_seconds: int = 60):
+        self.model = model
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_upload_bytes = max_upload_bytes
+        self.max_jobs = max_jobs
+        self.cleanup_seconds = cleanup_seconds
+        self._slots = asyncio.Semaphore(max_running)
+        self._tasks = set()
+        self._cleanup_task = None
+        # Status changes of this process are read-modify-write
+        self._lock = threading.Lock()
+        transcription_jobs.set_function(lambda: len(self._tasks))
+
+        os.makedirs(directory, exist_ok=True)
+
+    async def create(self, chunks: AsyncIterator[bytes], cfg: dict | Callable[[], dict]) -> dict:
+        """
+        Parameters:
+            chunks (AsyncIterator[bytes]): Content of the recording, e.g. `Request.stream()`
+            cfg (dict | Callable[[], dict]): Transcription settings, check `FasterWhisperModel.transcribe_from_file`,
+                or a function returning them once the upload is spooled, e.g. when they follow the file in a form
+
+        Returns:
+            dict: Status of the queued job
+
+        Raises:
+            InferenceQueueFullError: If this process has `max_jobs` jobs already.
+            UploadTooLargeError: If the upload is larger than `max_upload_bytes`.
+            InvalidUploadError: If the upload is empty.
+        """
+        if len(self._tasks) >= self.max_jobs:
+            raise InferenceQueueFullError("transcription jobs", settings.inference_retry_after_seconds)
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._path(job_id))
+        try:
+            size = await self._spool(chunks, self._path(job_id, AUDIO_FILE))
+            if callable(cfg):
+                cfg = cfg()
+            now = time.time()
+            job = {
+                "id": job_id,
+                "status": JOB_QUEUED,
+                "created_at": now,
+                "updated_at": now,
+                "size": size,
+                "duration": None,
+                "language": None,
+                "error": None,
+                "config": cfg,
+                # Lets other workers tell when the job was left by a worker that stopped, the start time tells
+                # the worker from a later process reusing its pid
+                "pid": os.getpid(),
+                "process_start": _process_start(os.getpid()),
+            }
+            await asyncio.to_thread(self._write_status, job_id, job)
+        except BaseException:
+            shutil.rmtree(self._path(job_id), ignore_errors=True)
+            raise
+
+        task = asyncio.create_task(self._run(job_id, cfg))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return {**job, "segments": 0}
+
+    async def _spool(self, chunks: AsyncIterator[bytes], path: str) -> int:
+        size = 0
+        with open(path, "wb") as file:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_upload_bytes:
+                    raise UploadTooLargeError(self.max_upload_bytes // 2 ** 20)
+                await asyncio.to_thread(file.write, chunk)
+        if size == 0:
+            raise InvalidUploadError("the recording is empty")
+        return size
+
+    async def _run(self, job_id: str, cfg: dict):
+        async with self._slots:
+            await asyncio.to_thread(self._update, job_id, status=JOB_RUNNING)
+            # The job id is the id of its persisted session
+            persistence_service.start_session(SOURCE_JOB, session_id=job_id)
+            try:
+                # Decoded once a slot is free, so only running jobs hold samples in memory
+                audio = await asyncio.to_thread(self._decode, job_id)
+                while True:
+                    try:
+                        segments, info = await whisper_executor.run(self._transcribe, job_id, audio, cfg)
+                        break
+                    except InferenceQueueFullError as e:
+                        # An accepted job waits for the queue instead of failing
+                        await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logger.error(f"Transcription job {job_id} failed: {e}")
+                await asyncio.to_thread(self._update, job_id, status=JOB_FAILED, error=str(e))
+                persistence_service.close_session(job_id)
+                return
+
+            await asyncio.to_thread(self._update, job_id, status=JOB_COMPLETED, language=info.language)
+            persistence_service.close_session(job_id, language=info.language)
+
+    def _decode(self, job_id: str) -> np.ndarray:
+        path = self._path(job_id, AUDIO_FILE)
+        try:
+            audio = decode_audio_file(path)
+        except Exception as e:
+            logger.warning(f"Can't decode the recording of transcription job {job_id}: {e}")
+            raise InvalidUploadError("the recording can't be decoded")
+        os.remove(path)
+        self._update(job_id, duration=len(audio) / SAMPLE_RATE)
+        return audio
+
+    def _transcribe(self, job_id: str, audio: np.ndarray, cfg: dict):
+        with open(self._path(job_id, SEGMENTS_FILE), "wb") as file:
+            def on_segment(segment):
+                record = segment_record(segment)
+                file.write(orjson.dumps(record) + b"\n")
+                # Whole lines are flushed, so streams never read half a segment
+                file.flush()
+                persistence_service.add_words(job_id, job_words([record], response_format="compact", probabilities=True))
+
+            return self.model.transcribe_from_array(audio, cfg=cfg, on_segment=on_segment)
+
+    async def get(self, job_id: str) -> dict | None:
+        return await asyncio.to_thread(self._get, job_id)
+
+    def _get(self, job_id: str) -> dict | None:
+        job = self._read_status(job_id)
+        if job is None:
+            return None
+        try:
+            with open(self._path(job_id, SEGMENTS_FILE), "rb") as file:
+                segments = file.read().count(b"\n")
+        except OSError:
+            segments = 0
+        return {**job, "segments": segments}
+
+    async def segments(self, job_id: str, start: int = 0) -> List[dict] | None:
+        if await asyncio.to_thread(self._read_status, job_id) is None:
+            return None
+        records, _ = await asyncio.to_thread(self._read_segments, job_id, 0)
+        return records[start:]
+
+    async def stream(self, job_id: str) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Yields ("segment", segment) for each segment, the decoded ones first and the next ones as they are
+        decoded, then ("done", status) once the job finished. Nothing is yielded for an unknown job.
+        """
+        offset = 0
+        while True:
+            # The status is read before the segments, so segments written before the job finished are never missed
+            job = await self.get(job_id)
+            if job is None:
+                return
+            records, offset = await asyncio.to_thread(self._read_segments, job_id, offset)
+            for record in records:
+                yield "segment", record
+            if job["status"] in FINISHED_STATUSES:
+                yield "done", job
+                return
+            await asyncio.sleep(POLL_SECONDS)
+
+    async def result(self, job_id: str) -> Tuple[List[dict], dict] | None:
+        """
+        Returns:
+            tuple: Segments of the job and its transcription settings, None for an unknown job
+
+        Raises:
+            TranscriptionJobNotFinishedError: If the job is not completed.
+        """
+        job = await asyncio.to_thread(self._read_status, job_id)
+        if job is None:
+            return None
+        if job["status"] != JOB_COMPLETED:
+            raise TranscriptionJobNotFinishedError(job_id, job["status"], job["error"])
+        records, _ = await asyncio.to_thread(self._read_segments, job_id, 0)
+        return records, job["config"]
+
+    def _read_segments(self, job_id: str, offset: int) -> Tuple[List[dict], int]:
+        """ Segments written after byte `offset`, and the offset after the last whole line """
+        try:
+            with open(self._path(job_id, SEGMENTS_FILE), "rb") as file:
+                file.seek(offset)
+                data = file.read()
+        except OSError:
+            return [], offset
+        end = data.rfind(b"\n") + 1
+        return [orjson.loads(line) for line in data[:end].splitlines()], offset + end
+
+    def cleanup(self) -> int:
+        """
+        Deletes jobs finished more than `ttl_seconds` ago and uploads abandoned as long ago.
+        Unfinished jobs of a worker that is not running anymore are marked failed, and deleted later.
+
+        Returns:
+            int: Number of deleted jobs
+        """
+        now = time.time()
+        deleted = 0
+        for job_id in os.listdir(self.directory):
+            if not JOB_ID_PATTERN.match(job_id):
+                continue
+            job = self._read_status(job_id)
+            if job is None:
+                # Upload still spooling, or interrupted
+                path = self._path(job_id, AUDIO_FILE)
+                last_write = os.path.getmtime(path) if os.path.exists(path) else os.path.getmtime(self._path(job_id))
+                expired = now - last_write > self.ttl_seconds
+            elif job["status"] in FINISHED_STATUSES:
+                expired = now - job["updated_at"] > self.ttl_seconds
+            else:
+                expired = False
+                if not _is_running(job["pid"], job.get("process_start")):
+                    self._update(job_id, status=JOB_FAILED, error="The worker running the job stopped")
+
+            if expired:
+                shutil.rmtree(self._path(job_id), ignore_errors=True)
+                deleted += 1
+        return deleted
+
+    def start_cleanup(self):
+        """ Runs `cleanup` every `cleanup_seconds` in the background """
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    def stop_cleanup(self):
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                deleted = await asyncio.to_thread(self.cleanup)
+                if deleted:
+                    logger.info(f"Deleted {deleted} expired transcription jobs")
+            except Exception as e:
+                logger.error(f"Transcription job cleanup failed: {e}")
+            await asyncio.sleep(self.cleanup_seconds)
+
+    def _update(self, job_id: str, **changes):
+        with self._lock:
+            job = self._read_status(job_id)
+            if job is None:
+                # Deleted meanwhile
+                return
+            job.update(changes, updated_at=time.time())
+            try:
+                self._write_status(job_id, job)
+            except OSError as e:
+                logger.warning(f"Can't update transcription job {job_id}: {e}")
+
+    def _read_status(self, job_id: str) -> dict | None:
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id, STATUS_FILE), "rb") as file:
+                return orjson.loads(file.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+
+    def _write_status(self, job_id: str, job: dict):
+        # Written to a temporary file first, so readers never see a partial status
+        fd, temporary_path = tempfile.mkstemp(dir=self._path(job_id))
+        with os.fdopen(fd, "wb") as file:
+            file.write(orjson.dumps(job))
+        os.replace(temporary_path, self._path(job_id, STATUS_FILE))
+
+    def _path(self, job_id: str, name: str = "") -> str:
+        return os.path.join(self.directory, job_id, name)
+
+def segment_record(segment) -> dict:
+    """ Segment as stored and streamed, timestamps in ms """
+    return {
+        "start": int(segment.start * 1000),
+        "end": int(segment.end * 1000),
+        "text": segment.text,
+        "words": [
+            {"word": word.word, "start": int(word.start * 1000), "end": int(word.end * 1000), "probability": round(word.probability, 4)}
+            for word in segment.words or []
+        ],
+    }
+
+def job_words(segments: List[dict], response_format: str = "words", probabilities: bool = False):
+    """
+    Words of the segments of a job, in the format of `POST /transcription`.
+
+    Returns:
+        List[dict] | dict: [{"word", "timestamp"}] words, or parallel arrays with the "compact" format, check `compact_words`
+    """
+    words = [word for segment in segments for word in segment["words"]]
+    if response_format != "compact":
+        return [{"word": word["word"], "timestamp": [word["start"], word["end"]]} for word in words]
+
+    result = {
+        "words": [word["word"] for word in words],
+        "start": [word["start"] for word in words],
+        "end": [word["end"] for word in words],
+    }
+    if probabilities:
+        result["probability"] = [word["probability"] for word in words]
+    return result
+
+def _process_start(pid: int) -> str | None:
+    """ Start time of a process in clock ticks since boot, None without /proc (e.g. macOS) or when it is not running """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as file:
+            stat = file.read()
+    except OSError:
+        return None
+    # The command name may contain spaces and parentheses, fields are counted after its closing parenthesis
+    return stat[stat.rfind(b")") + 2:].split()[19].decode()
+
+def _is_running(pid: int, process_start: str | None = None) -> bool:
+    if process_start is not None:
+        # A pid reused by another process has another start time
+        return _process_start(pid) == process_start
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+transcription_job_service = TranscriptionJobService(
+    whisper_model,
+    directory=settings.transcription_jobs_dir or os.path.join(tempfile.gettempdir(), "transcription-jobs"),
+    ttl_seconds=settings.transcription_job_ttl_seconds,
+    max_upload_bytes=settings.transcription_job_max_upload_mb * 2 ** 20,
+    max_jobs=settings.transcription_max_jobs,
+    # One job per call the whisper workers can run at the same time
+    max_running=whisper_executor.max_workers,
+    cleanup_seconds=settings.transcription_job_cleanup_seconds
+)
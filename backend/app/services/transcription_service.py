@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import json
+from typing import List
+
+import numpy as np
+from app.ai.audio import decode_base64_audio
+from app.ai.executor import whisper_executor
+from app.ai.model_server.client import RemoteWhisperModel, model_server_client
+from app.ai.models.faster_whisper import FasterWhisperModel, faster_whisper_model
+from app.config import settings
+from app.utils.logging import AppLogger
+from app.utils.lru_cache import LRUCache
+from app.utils.metrics import audio_concat_seconds
+from app.utils.result_cache import ResultCache
+from app.utils.single_flight import SingleFlight
+
+logger = AppLogger().get_logger()
+
+def compact_words(segments, offset_ms: int = 0, probabilities: bool = False) -> dict:
+    """
+    Words of `segments` as parallel arrays (check `CompactTranscriptionSchema`), built without an object per word.
+
+    Parameters:
+        segments (List[Segment]): Segments with word timestamps
+        offset_ms (int): Added to every timestamp, e.g. the start of a websocket chunk
+        probabilities (bool): Adds the probability of each word
+
+    Returns:
+        dict: {"words": List[str], "start": List[int], "end": List[int]}, and "probability": List[float] with `probabilities`
+    """
+    words = [word for segment in segments for word in segment.words or []]
+    result = {
+        "words": [word.word for word in words],
+        "start": [int(word.start * 1000 + offset_ms) for word in words],
+        "end": [int(word.end * 1000 + offset_ms) for word in words],
+    }
+    if probabilities:
+        result["probability"] = np.round([word.probability for word in words], 4).tolist()
+    return result
+
+class TranscriptionService:
+    """
+    Transcription of complete recordings with a content-addressed result cache.
+
+    Results are cached by a hash of the decoded audio and of the effective transcription settings, so a
+    recording sent again, even re-encoded, is not transcribed again. The hash of the raw blobs is remembered
+    too, so an identical resend is not even decoded. Identical concurrent requests share one decode and one
+    transcription.
+
+    Attributes:
+        model (FasterWhisperModel | RemoteWhisperModel): Model used on cache misses, remote when the models run in a model server.
+        cache (ResultCache): (segments, info) results by audio key.
+
+    Methods:
+        transcribe_blobs(blobs, cfg): Awaitable returning the segments and info of the concatenated blobs.
+        transcribe_audio(audio, cfg): Same for audio that is already decoded.
+    """
+
+    def __init__(self, model: FasterWhisperModel | RemoteWhisperModel, cache: ResultCache):
+        self.model = model
+        self.cache = cache
+        # Raw blob key -> audio key, small entries so identical resends skip decoding
+        self._aliases = LRUCache(max_bytes=16 * 2 ** 20)
+        self._single_flight = SingleFlight()
+
+    async def transcribe_blobs(self, blobs: List[str] | None, cfg: dict | None = None):
+        """
+        Transcribes base64 encoded audio blobs as one recording, check `FasterWhisperModel.transcribe_from_blobs`.
+
+        Raises:
+            InferenceQueueFullError: If the whisper queue is full on a cache miss.
+        """
+        blobs = blobs or []
+        config_key = self._config_key(cfg)
+        blob_key = await asyncio.to_thread(lambda: self._hash(config_key.encode(), *(blob.encode() for blob in blobs)))
+        return await self._single_flight.do(blob_key, lambda: self._transcribe_blobs(blobs, cfg, config_key, blob_key))
+
+    async def transcribe_audio(self, audio: np.ndarray, cfg: dict | None = None):
+        """
+        Transcribes already decoded audio, cached like `transcribe_blobs`.
+
+        Raises:
+            InferenceQueueFullError: If the whisper queue is full on a cache miss.
+        """
+        config_key = self._config_key(cfg)
+        audio_key = await asyncio.to_thread(lambda: self._hash(config_key.encode(), audio.tobytes()))
+        return await self._single_flight.do(audio_key, lambda: self._transcribe_audio(audio, cfg, audio_key))
+
+    async def _transcribe_blobs(self, blobs: List[str], cfg: dict | None, config_key: str, blob_key: str):
+        audio_key = self._aliases.get(blob_key)
+        if audio_key is not None:
+            result = await asyncio.to_thread(self.cache.get, audio_key)
+            if result is not None:
+                return result
+
+        audio, audio_key = await asyncio.to_thread(self._decode, blobs, config_key)
+        self._aliases.put(blob_key, audio_key, len(audio_key))
+        return await self._single_flight.do(audio_key, lambda: self._transcribe_audio(audio, cfg, audio_key))
+
+    async def _transcribe_audio(self, audio: np.ndarray, cfg: dict | None, audio_key: str):
+        result = await asyncio.to_thread(self.cache.get, audio_key)
+        if result is not None:
+            return result
+
+        result = await whisper_executor.run(self.model.transcribe_from_array, audio, cfg=cfg)
+        await asyncio.to_thread(self.cache.put, audio_key, result)
+        return result
+
+    def _decode(self, blobs: List[str], config_key: str):
+        audio = [decode_base64_audio(blob) for blob in blobs]
+        with audio_concat_seconds.time():
+            audio = np.concatenate(audio) if audio else np.zeros(0, dtype=np.float32)
+        return audio, self._hash(config_key.encode(), audio.tobytes())
+
+    def _config_key(self, cfg: dict | None) -> str:
+        # The model identity is part of the key, the disk tier outlives a model change
+        return json.dumps({
+            "model": [self.model.model_size, self.model.compute_type],
+            **self.model.effective_config(cfg)
+        }, sort_keys=True)
+
+    @staticmethod
+    def _hash(*parts: bytes) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(len(part).to_bytes(8, "little"))
+            digest.update(part)
+        return digest.hexdigest()
+
+# With a model server, the whisper model of this process is never loaded
+whisper_model = RemoteWhisperModel(model_server_client, settings.whisper_model_size, settings.whisper_compute_type) if model_server_client else faster_whisper_model
+
+transcription_service = TranscriptionService(
+    whisper_model,
+    ResultCache(
+        max_bytes=settings.transcription_cache_mb * 2 ** 20,
+        disk_dir=settings.transcription_cache_dir or None,
+        disk_max_bytes=settings.transcription_cache_disk_mb * 2 ** 20
+    )
+)
@@ -1,19 +1,304 @@
-from typing import List
+import asyncio
+import math
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Literal, Optional
 
-from fastapi import WebSocket
+import orjson
+from app.utils.logging import AppLogger
+from fastapi import WebSocket, status
 
+logger = AppLogger().get_logger()
+
+SlowConsumerPolicy = Literal["drop", "disconnect"]
+
+@dataclass
+class ConnectionStats:
+    """
+    sent (int): messages sent
+    dropped (int): droppable messages dropped because the send queue was full
+    max_queue_depth (int): longest the send queue has been
+    send_latency_ms (float): moving average of the time a send takes
+    max_send_latency_ms (float): longest send
+    queue_latency_ms (float): moving average of the time a message waits in the queue
+    """
+    sent: int = 0
+    dropped: int = 0
+    max_queue_depth: int = 0
+    send_latency_ms: float = 0.0
+    max_send_latency_ms: float = 0.0
+    queue_latency_ms: float = 0.0
+    connected_at: float = field(default_factory=time.monotonic)
+
+class Connection:
+    """
+    One websocket with a bounded send queue drained by its own writer task, so a slow client only delays itself.
+
+    Sending only queues the message. When the queue is full, the oldest droppable message (a partial result
+    that a later message supersedes) is dropped with the "drop" policy. With the "disconnect" policy, or when
+    nothing can be dropped, the connection is closed with code 1013 (try again later). A send taking longer
+    than `send_timeout_seconds` closes the connection too.
+
+    Attributes:
+        session_id (str): Key of the connection in the manager.
+        websocket (WebSocket): Accepted websocket.
+        stats (ConnectionStats): Send metrics.
+        closed (bool): Whether the connection is closed, messages sent after that are discarded.
+
+    Methods:
+        send_json(data, droppable): Queues a JSON message.
+        send_text(data, droppable): Queues a text message.
+        send_bytes(data, droppable): Queues a binary message.
+        stop(): Discards the queued messages and stops the writer.
+        close(code, reason): Stops the connection and closes the websocket.
+        metrics(): Returns the send metrics as a dict.
+    """
+
+    # Weight of the latest sample in the moving averages
+    LATENCY_SMOOTHING = 0.1
+
+    def __init__(self, websocket: WebSocket, session_id: str, max_queue_size: int = 256, slow_consumer_policy: SlowConsumerPolicy = "drop", send_timeout_seconds: float = 10):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.max_queue_size = max_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout_seconds = send_timeout_seconds
+        self.stats = ConnectionStats()
+        self.closed = False
+        # (kind, payload, droppable, queued at)
+        self._queue: Deque[tuple[str, Any, bool, float]] = deque()
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write())
+
+    async def send_json(self, data: Any, droppable: bool = False) -> bool:
+        """
+        Queues a JSON message, same as `WebSocket.send_json` but without waiting for the client.
+        The message is serialized with orjson when it is sent, dropped messages are never serialized.
+
+        Parameters:
+            data (Any): JSON serializable message
+            droppable (bool): The message may be dropped when the client falls behind. Default is False.
+
+        Returns:
+            bool: True if the message was queued
+        """
+        return self._enqueue("json", data, droppable)
+
+    async def send_text(self, data: str, droppable: bool = False) -> bool:
+        return self._enqueue("text", data, droppable)
+
+    async def send_bytes(self, data: bytes, droppable: bool = False) -> bool:
+        return self._enqueue("bytes", data, droppable)
+
+    def _enqueue(self, kind: str, payload: Any, droppable: bool) -> bool:
+        if self.closed:
+            return False
+
+        if len(self._queue) >= self.max_queue_size:
+            if self.slow_consumer_policy != "drop" or not self._drop_oldest():
+                logger.warning(f"Closing slow websocket {self.session_id} with {len(self._queue)} queued messages")
+                self._close_slow_consumer()
+                return False
+
+        self._queue.append((kind, payload, droppable, time.monotonic()))
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self._queue))
+        self._ready.set()
+        return True
+
+    def _drop_oldest(self) -> bool:
+        for index, (_, _, droppable, _) in enumerate(self._queue):
+            if droppable:
+                del self._queue[index]
+                self.stats.dropped += 1
+                return True
+        return False
+
+    async def _write(self):
+        while True:
+            while not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+
+            kind, payload, _, queued_at = self._queue.popleft()
+            started_at = time.monotonic()
+            try:
+                if kind == "json":
+                    send = self.websocket.send_text(orjson.dumps(payload).decode())
+                elif kind == "text":
+                    send = self.websocket.send_text(payload)
+                else:
+                    send = self.websocket.send_bytes(payload)
+                await asyncio.wait_for(send, timeout=self.send_timeout_seconds)
+            except asyncio.TimeoutError:
+                logger.warning(f"Closing websocket {self.session_id}, a send took longer than {self.send_timeout_seconds}s")
+                self._close_slow_consumer()
+                return
+            except Exception as e:
+                # The client is gone, the reader gets the disconnect
+                logger.debug(f"Send to websocket {self.session_id} failed: {e}")
+                self.stop()
+                return
+
+            finished_at = time.monotonic()
+            send_latency_ms = (finished_at - started_at) * 1000
+            self.stats.sent += 1
+            self.stats.send_latency_ms += self.LATENCY_SMOOTHING * (send_latency_ms - self.stats.send_latency_ms)
+            self.stats.max_send_latency_ms = max(self.stats.max_send_latency_ms, send_latency_ms)
+            self.stats.queue_latency_ms += self.LATENCY_SMOOTHING * ((started_at - queued_at) * 1000 - self.stats.queue_latency_ms)
+
+    def stop(self):
+        """
+        Discards the queued messages and stops the writer, without closing the websocket.
+        """
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self.closed = True
+        self._queue.clear()
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE, reason: str = ""):
+        """
+        Stops the connection and closes the websocket. Closing twice does nothing.
+        """
+        was_closed = self.closed
+        self.stop()
+        if not was_closed:
+            await self._close_websocket(code, reason)
+
+    def _close_slow_consumer(self):
+        # Stops right away so nothing more is queued, the close frame is sent from a task
+        self.stop()
+        asyncio.ensure_future(self._close_websocket(status.WS_1013_TRY_AGAIN_LATER, "Slow consumer"))
+
+    async def _close_websocket(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.stats.max_queue_depth,
+            "sent": self.stats.sent,
+            "dropped": self.stats.dropped,
+            "send_latency_ms": round(self.stats.send_latency_ms, 3),
+            "max_send_latency_ms": round(self.stats.max_send_latency_ms, 3),
+            "queue_latency_ms": round(self.stats.queue_latency_ms, 3),
+            "connected_seconds": round(time.monotonic() - self.stats.connected_at, 1),
+            "closed": self.closed,
+        }
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    """
+    Registry of websocket connections keyed by session id.
+
+    Every connection gets a bounded send queue and a writer task, check `Connection`. Broadcasts only queue
+    the message on each connection, so they don't wait for any client and all clients receive concurrently.
+
+    Attributes:
+        connections (Dict[str, Connection]): Open connections by session id.
+        max_queue_size (int): Messages queued per connection before the slow consumer policy applies.
+        slow_consumer_policy (str): "drop" drops the oldest droppable message, "disconnect" closes the connection.
+        send_timeout_seconds (float): Longest a single send may take before the connection is closed.
+
+    Methods:
+        connect(websocket, session_id): Accepts a websocket and registers it.
+        disconnect(connection): Unregisters a connection and stops its writer.
+        get(session_id): Returns the connection of a session, or None.
+        broadcast(message, droppable): Queues a text message on every connection.
+        metrics(): Returns the send metrics over all connections.
 
-    async def connect(self, websocket: WebSocket):
+    Example:
+        >>> manager = ConnectionManager(max_queue_size=256, slow_consumer_policy="drop")
+        >>> connection = await manager.connect(websocket)
+        >>> await connection.send_json({"type": "summary_token", "data": token}, droppable=True)
+        >>> manager.disconnect(connection)
+    """
+
+    def __init__(self, max_queue_size: int = 256, slow_consumer_policy: SlowConsumerPolicy = "drop", send_timeout_seconds: float = 10):
+        self.connections: Dict[str, Connection] = {}
+        self.max_queue_size = max_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout_seconds = send_timeout_seconds
+
+    def __len__(self):
+        return len(self.connections)
+
+    async def connect(self, websocket: WebSocket, session_id: Optional[str] = None) -> Connection:
+        """
+        Parameters:
+            websocket (WebSocket): Websocket to accept
+            session_id (Optional[str]): Key of the connection, a random id if None. An open connection with the same id is replaced.
+
+        Returns:
+            Connection: Accepted connection with a running writer
+        """
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = Connection(
+            websocket,
+            session_id or uuid.uuid4().hex,
+            max_queue_size=self.max_queue_size,
+            slow_consumer_policy=self.slow_consumer_policy,
+            send_timeout_seconds=self.send_timeout_seconds
+        )
+        connection.start()
+
+        previous = self.connections.get(connection.session_id)
+        if previous is not None:
+            await previous.close(status.WS_1008_POLICY_VIOLATION, "Replaced by a new connection")
+        self.connections[connection.session_id] = connection
+        return connection
+
+    def disconnect(self, connection: Connection):
+        # Only unregisters the connection when it has not been replaced meanwhile
+        if self.connections.get(connection.session_id) is connection:
+            del self.connections[connection.session_id]
+        connection.stop()
+
+    def get(self, session_id: str) -> Optional[Connection]:
+        return self.connections.get(session_id)
+
+    async def broadcast(self, message: str, droppable: bool = False):
+        for connection in list(self.connections.values()):
+            await connection.send_text(message, droppable=droppable)
+
+    def metrics(self) -> dict:
+        """
+        Send metrics over all open connections. Nothing is reported by session, a session id is all a client
+        needs to reach the messages of its session.
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        Returns:
+            dict: Counts, queue depths and latency percentiles, e.g. {"connections": 3, "send_latency_ms": {"p50": 0.2, "p95": 1.3, "max": 1.3}, ...}
+        """
+        connections = [connection.metrics() for connection in self.connections.values()]
+        return {
+            "connections": len(connections),
+            "queued": sum(metrics["queue_depth"] for metrics in connections),
+            "max_queue_depth": max((metrics["max_queue_depth"] for metrics in connections), default=0),
+            "sent": sum(metrics["sent"] for metrics in connections),
+            "dropped": sum(metrics["dropped"] for metrics in connections),
+            "closing": sum(metrics["closed"] for metrics in connections),
+            "send_latency_ms": _percentiles([metrics["send_latency_ms"] for metrics in connections]),
+            "max_send_latency_ms": max((metrics["max_send_latency_ms"] for metrics in connections), default=0.0),
+            "queue_latency_ms": _percentiles([metrics["queue_latency_ms"] for metrics in connections]),
+        }
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+def _percentiles(values: List[float]) -> dict:
+    """ Median, 95th percentile (nearest rank) and maximum, 0 without values """
+    values = sorted(values)
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {
+        "p50": values[math.ceil(0.5 * len(values)) - 1],
+        "p95": values[math.ceil(0.95 * len(values)) - 1],
+        "max": values[-1],
+    }
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by the total size of its values.
+
+    Attributes:
+        max_bytes (int): Maximum total size of the cached values.
+        max_items (Optional[int]): Maximum number of cached values, None for no limit.
+        nbytes (int): Current total size of the cached values.
+
+    Methods:
+        get(key, default): Returns the cached value and marks it as recently used.
+        put(key, value, nbytes): Stores a value, evicting the least recently used values to stay within bounds.
+        pop(key): Removes a value.
+    """
+
+    def __init__(self, max_bytes: int, max_items: int | None = None):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key: Hashable):
+        return key in self._items
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> bool:
+        """
+        Stores a value. Values larger than `max_bytes` are not stored.
+
+        Returns:
+            bool: True if the value was stored
+        """
+        if nbytes > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes or (self.max_items is not None and len(self._items) > self.max_items):
+                _, (_, evicted_nbytes) = self._items.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+        return True
+
+    def pop(self, key: Hashable, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            self.nbytes -= item[1]
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
@@ -0,0 +1,262 @@
+"""
+Prometheus metrics of the process: counters, gauges and histograms, and their text exposition format.
+
+It is not `prometheus_client`, because of the model server. Its metrics are collected in the model server
+process, sent over the model server socket as plain tuples (`MetricsRegistry.collect`) and rendered with the
+metrics of the API process, under a `process` label. `prometheus_client` only merges processes in its
+multiprocess mode, through a directory of mmap files shared by the processes that has to be wiped before
+every start, and there gauges can't use `set_function` (e.g. open websockets, pending inference calls).
+The app only needs these three metric types and the text format, so they are kept here without a dependency.
+"""
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from app.utils.logging import ElapsedTimer
+
+# Default histogram buckets in seconds, from 1 ms to 1 minute
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class MetricsRegistry:
+    """
+    Metrics of the process, rendered in the Prometheus text exposition format.
+
+    Methods:
+        register(metric): Adds a metric, names must be unique.
+        collect(labels): Returns the samples of all metrics, e.g. to send them to another process.
+        render(extra): Returns the samples of all metrics, and of collected `extra` metrics, as Prometheus text.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, "Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric"):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def collect(self, labels: dict | None = None) -> List[tuple]:
+        """
+        Parameters:
+            labels (Optional[dict]): Labels added to every sample, e.g. {"process": "model_server"}
+
+        Returns:
+            List[tuple]: (name, type, documentation, samples) of each metric, samples are (name suffix, labels, value)
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [
+            (metric.name, metric.type, metric.documentation, [(suffix, {**sample_labels, **(labels or {})}, value) for suffix, sample_labels, value in metric.samples()])
+            for metric in metrics
+        ]
+
+    def render(self, extra: List[tuple] = ()) -> str:
+        families = {}
+        for name, metric_type, documentation, samples in [*self.collect(), *extra]:
+            # Samples of the same metric from another process are rendered in one family
+            families.setdefault(name, (metric_type, documentation, []))[2].extend(samples)
+
+        lines = []
+        for name, (metric_type, documentation, samples) in families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+metrics_registry = MetricsRegistry()
+
+class Metric(ABC):
+    """
+    Base of the metric types, a metric with label names has one child per combination of label values.
+
+    Attributes:
+        name (str): Metric name, e.g. "whisper_decode_seconds".
+        documentation (str): Help text.
+        labelnames (Tuple[str]): Label names, empty for a metric without labels.
+
+    Methods:
+        labels(*values): Returns the child of the label values, created on first use.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: MetricsRegistry | None = metrics_registry):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # A metric without labels is used like its only child, e.g. counter.inc()
+            child = self._children[()] = self._child()
+            for method in ("inc", "dec", "set", "set_function", "observe", "time"):
+                if hasattr(child, method):
+                    setattr(self, method, getattr(child, method))
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} has labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def samples(self):
+        """ Yields (name suffix, labels, value) of every sample """
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            for suffix, extra_labels, value in child.samples():
+                yield suffix, {**labels, **extra_labels}, value
+
+    @abstractmethod
+    def _child(self):
+        """ New child of one combination of label values """
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield "_total", {}, self.value
+
+class Counter(Metric):
+    """
+    Value that only goes up, e.g. generated tokens. Rendered with the "_total" suffix.
+
+    Example:
+        >>> tokens = Counter("llm_generated_tokens", "Tokens generated by the LLM")
+        >>> tokens.inc(42)
+    """
+    type = "counter"
+
+    def _child(self):
+        return _CounterChild()
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function: Callable[[], float] | None = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """ Reads the value from `function` when the metrics are rendered, instead of keeping it """
+        self.function = function
+
+    def samples(self):
+        yield "", {}, self.function() if self.function else self.value
+
+class Gauge(Metric):
+    """
+    Value that goes up and down, e.g. open websockets.
+
+    Example:
+        >>> sessions = Gauge("websocket_sessions", "Open websocket sessions")
+        >>> sessions.set_function(lambda: len(manager.connections))
+    """
+    type = "gauge"
+
+    def _child(self):
+        return _GaugeChild()
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> ElapsedTimer:
+        """ Context manager observing the seconds spent in its block """
+        return ElapsedTimer(histogram=self)
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield "_bucket", {"le": _format_value(bound)}, cumulative
+        yield "_sum", {}, total
+        yield "_count", {}, cumulative
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, e.g. durations, counted in cumulative buckets.
+
+    Example:
+        >>> decode_seconds = Histogram("whisper_decode_seconds", "Whisper decoding time")
+        >>> with decode_seconds.time():
+        ...     segments = list(segments)
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS, registry: MetricsRegistry | None = metrics_registry):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames=labelnames, registry=registry)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+# Metrics of the app, check docs/API-Docs.md
+
+audio_base64_decode_seconds = Histogram("audio_base64_decode_seconds", "Time spent decoding base64 audio blobs")
+audio_decode_seconds = Histogram("audio_decode_seconds", "Time spent decoding audio files into samples", ["format"])
+audio_concat_seconds = Histogram("audio_concat_seconds", "Time spent joining decoded chunks into one recording or stream window")
+whisper_vad_seconds = Histogram("whisper_vad_seconds", "Time spent in voice activity detection before language detection")
+whisper_decode_seconds = Histogram("whisper_decode_seconds", "Time spent transcribing with Whisper, voice activity detection included", ["mode"])
+whisper_language_detection_seconds = Histogram("whisper_language_detection_seconds", "Time spent detecting the language of audio, voice activity detection excluded")
+whisper_audio_seconds = Counter("whisper_audio_seconds", "Seconds of audio transcribed")
+transcription_words = Counter("transcription_words", "Words sent to clients", ["source"])
+llm_prefill_seconds = Histogram("llm_prefill_seconds", "Time from the start of a generate call to its first token", ["mode"])
+llm_decode_seconds = Histogram("llm_decode_seconds", "Time from the first to the last token of a generate call", ["mode"], buckets=DEFAULT_BUCKETS + (120, 300))
+llm_generated_tokens = Counter("llm_generated_tokens", "Tokens generated by the LLM", ["mode"])
+llm_draft_tokens = Counter("llm_draft_tokens", "Tokens proposed by the draft model")
+llm_draft_accepted_tokens = Counter("llm_draft_accepted_tokens", "Tokens proposed by the draft model and accepted by the LLM")
+inference_queue_wait_seconds = Histogram("inference_queue_wait_seconds", "Time calls wait for an inference worker", ["executor"])
+inference_pending = Gauge("inference_pending", "Running and queued inference calls", ["executor"])
+transcription_jobs = Gauge("transcription_jobs", "Transcription jobs of the process waiting or running")
+websocket_sessions = Gauge("websocket_sessions", "Open transcription websockets")
+persistence_rows = Counter("persistence_rows", "Rows written to the database", ["table"])
+persistence_dropped_rows = Counter("persistence_dropped_rows", "Rows not written to the database, because the buffer was full or the writes kept failing", ["table"])
+persistence_flush_seconds = Histogram("persistence_flush_seconds", "Time spent writing one batch to the database")
+persistence_buffered_rows = Gauge("persistence_buffered_rows", "Rows waiting to be written to the database")
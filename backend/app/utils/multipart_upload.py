@@ -0,0 +1,125 @@
+from typing import AsyncIterator, Dict, List
+
+from app.exceptions.transcription_job_exceptions import InvalidUploadError, UploadTooLargeError
+from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+
+# Largest text field, e.g. the JSON settings of an upload
+MAX_FIELD_BYTES = 64 * 2 ** 10
+
+class MultipartUpload:
+    """
+    Incremental parser of a multipart/form-data upload with a single file field.
+
+    Unlike `Request.form()`, which spools the whole file to a temporary file before the caller sees it, the
+    request body is parsed as it arrives and the content of the file field is yielded right away, so it is
+    written to disk once and its size is checked while it is uploaded. Text fields are kept in `fields`,
+    they are complete once `file_chunks` is exhausted, also when they come after the file.
+
+    Attributes:
+        file_field (str): Name of the file field.
+        max_file_bytes (int): Largest accepted file.
+        fields (Dict[str, str]): Text fields of the form.
+
+    Methods:
+        file_chunks(): Yields the content of the file field as it is uploaded.
+    """
+
+    def __init__(self, content_type: str, stream: AsyncIterator[bytes], file_field: str = "file", max_file_bytes: int = 2 ** 31):
+        """
+        Parameters:
+            content_type (str): Content-Type header of the request, with its boundary
+            stream (AsyncIterator[bytes]): Request body, e.g. `Request.stream()`
+
+        Raises:
+            InvalidUploadError: If the content type has no boundary.
+        """
+        _, options = parse_options_header(content_type)
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise InvalidUploadError("the multipart boundary is missing")
+
+        self.file_field = file_field
+        self.max_file_bytes = max_file_bytes
+        self.fields: Dict[str, str] = {}
+        self._stream = stream
+        self._file_bytes = 0
+        self._has_file = False
+        # State of the part being parsed
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._name = None
+        self._is_file = False
+        self._value = bytearray()
+        self._file_data: List[bytes] = []
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+
+    async def file_chunks(self) -> AsyncIterator[bytes]:
+        """
+        Raises:
+            InvalidUploadError: If the body is not a valid form, or has no file field.
+            UploadTooLargeError: If the file is larger than `max_file_bytes`.
+        """
+        async for chunk in self._stream:
+            try:
+                self._parser.write(chunk)
+            except MultipartParseError as e:
+                raise InvalidUploadError(f"the multipart body can't be parsed: {e}")
+            data, self._file_data = self._file_data, []
+            for part in data:
+                yield part
+        try:
+            self._parser.finalize()
+        except MultipartParseError as e:
+            raise InvalidUploadError(f"the multipart body can't be parsed: {e}")
+        if not self._has_file:
+            raise InvalidUploadError(f'the "{self.file_field}" field is missing')
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._name = None
+        self._is_file = False
+        self._value = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("latin-1")
+        self._is_file = b"filename" in options
+        if self._is_file:
+            if self._name != self.file_field or self._has_file:
+                raise InvalidUploadError(f'only one file, in the "{self.file_field}" field, is accepted')
+            self._has_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._is_file:
+            self._file_bytes += end - start
+            if self._file_bytes > self.max_file_bytes:
+                raise UploadTooLargeError(self.max_file_bytes // 2 ** 20)
+            self._file_data.append(data[start:end])
+            return
+        if len(self._value) + end - start > MAX_FIELD_BYTES:
+            raise InvalidUploadError(f'the "{self._name}" field is larger than {MAX_FIELD_BYTES // 2 ** 10} KB')
+        self._value.extend(data[start:end])
+
+    def _on_part_end(self):
+        if not self._is_file and self._name:
+            self.fields[self._name] = self._value.decode("utf-8", errors="replace")
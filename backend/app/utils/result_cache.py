@@ -0,0 +1,132 @@
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from app.utils.logging import AppLogger
+from app.utils.lru_cache import LRUCache
+
+logger = AppLogger().get_logger()
+
+class DiskCache:
+    """
+    Least-recently-used cache of byte strings in a directory, one file per key, bounded by the total file size.
+    Files left by a previous process are indexed at startup, oldest access first.
+
+    Attributes:
+        directory (str): Directory of the cache files.
+        max_bytes (int): Maximum total size of the files.
+        nbytes (int): Current total size of the files.
+
+    Methods:
+        get(key): Returns the cached bytes, or None.
+        put(key, data): Writes the bytes, evicting the least recently used files to stay within `max_bytes`.
+    """
+
+    SUFFIX = ".cache"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(self.SUFFIX):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_atime, name[:-len(self.SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self.nbytes += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            if key not in self._files:
+                return None
+            self._files.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as file:
+                data = file.read()
+            os.utime(self._path(key))
+            return data
+        except OSError:
+            with self._lock:
+                self.nbytes -= self._files.pop(key, 0)
+            return None
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+
+        # Written to a temporary file first, so readers never see a partial file
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, self._path(key))
+
+        with self._lock:
+            self.nbytes += len(data) - self._files.pop(key, 0)
+            self._files[key] = len(data)
+            evicted = []
+            while self.nbytes > self.max_bytes:
+                evicted_key, size = self._files.popitem(last=False)
+                self.nbytes -= size
+                evicted.append(evicted_key)
+
+        for evicted_key in evicted:
+            try:
+                os.remove(self._path(evicted_key))
+            except OSError:
+                pass
+
+class ResultCache:
+    """
+    Cache of picklable results in memory, with an optional on-disk tier that survives restarts.
+    Both tiers evict least recently used results first and are bounded by the pickled size of the results.
+
+    Attributes:
+        memory (LRUCache): In-memory tier.
+        disk (Optional[DiskCache]): On-disk tier, None when disabled.
+
+    Methods:
+        get(key): Returns the cached result or None. Disk hits are promoted to memory.
+        put(key, value): Stores a result in both tiers.
+
+    Example:
+        >>> cache = ResultCache(max_bytes=256 * 2 ** 20, disk_dir="/var/cache/transcriptions", disk_max_bytes=2 * 2 ** 30)
+        >>> cache.put(key, (segments, info))
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str | None = None, disk_max_bytes: int = 0):
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(disk_dir, disk_max_bytes) if disk_dir and disk_max_bytes else None
+
+    def get(self, key: Hashable) -> Any:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+
+        data = self.disk.get(str(key))
+        if data is None:
+            return None
+        try:
+            value = pickle.loads(data)
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache file {key}: {e}")
+            return None
+        self.memory.put(key, value, len(data))
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.memory.put(key, value, len(data))
+        if self.disk is not None:
+            self.disk.put(str(key), data)
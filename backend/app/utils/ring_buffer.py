@@ -0,0 +1,94 @@
+import numpy as np
+
+
+class PCMRingBuffer:
+    """
+    A bounded ring buffer for mono PCM samples, addressed by absolute sample index.
+
+    The buffer keeps the most recent `capacity` samples of a stream. Samples are addressed by their
+    absolute position in the stream (0 is the very first sample ever appended), so callers can keep
+    stable offsets while older audio is overwritten or discarded.
+
+    Attributes:
+        capacity (int): Maximum number of samples kept in memory.
+        start (int): Absolute index of the oldest sample still available.
+        end (int): Absolute index one past the newest sample.
+
+    Methods:
+        append(samples): Appends samples, overwriting the oldest ones when the buffer is full.
+        read(start): Returns a contiguous copy of the samples from absolute index `start` to `end`.
+        discard_until(index): Drops all samples before absolute index `index`.
+    """
+
+    def __init__(self, capacity: int, dtype=np.float32):
+        """
+        Parameters:
+            capacity (int): Maximum number of samples kept in memory.
+            dtype (numpy.dtype): Sample type. Default is float32.
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=dtype)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, samples: np.ndarray):
+        """
+        Appends samples to the buffer. If the buffer overflows, the oldest samples are dropped.
+
+        Parameters:
+            samples (np.ndarray): 1-D array of samples.
+        """
+        samples = np.asarray(samples, dtype=self._data.dtype).reshape(-1)
+        count = len(samples)
+        if count == 0:
+            return
+
+        if count > self.capacity:
+            # Only the tail can fit, skip what would be overwritten anyway
+            samples = samples[-self.capacity:]
+            self.end += count - self.capacity
+            count = self.capacity
+
+        position = self.end % self.capacity
+        first = min(count, self.capacity - position)
+        self._data[position:position + first] = samples[:first]
+        if first < count:
+            self._data[:count - first] = samples[first:]
+
+        self.end += count
+        self.start = max(self.start, self.end - self.capacity)
+
+    def read(self, start: int | None = None) -> np.ndarray:
+        """
+        Returns a contiguous copy of the samples between absolute index `start` and `end`.
+
+        Parameters:
+            start (Optional[int]): Absolute sample index. It is clamped to the oldest available sample. Default is `self.start`.
+
+        Returns:
+            np.ndarray: Copy of the requested samples.
+        """
+        if start is None or start < self.start:
+            start = self.start
+        if start >= self.end:
+            return np.zeros(0, dtype=self._data.dtype)
+
+        begin = start % self.capacity
+        end = self.end % self.capacity
+        if begin < end:
+            return self._data[begin:end].copy()
+        return np.concatenate((self._data[begin:], self._data[:end]))
+
+    def discard_until(self, index: int):
+        """
+        Drops all samples before absolute index `index`.
+
+        Parameters:
+            index (int): Absolute sample index.
+        """
+        self.start = min(max(self.start, index), self.end)
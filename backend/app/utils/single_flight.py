@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller of a key starts the work, callers arriving while it runs wait for the same result
+    (or exception). The work runs in its own task, so a caller going away does not cancel it for the others.
+
+    Methods:
+        do(key, fn): Runs `fn()` unless a call with the same key is already running, and returns its result.
+
+    Example:
+        >>> single_flight = SingleFlight()
+        >>> result = await single_flight.do(audio_hash, lambda: transcribe(audio))
+    """
+
+    def __init__(self):
+        self._running: Dict[Hashable, asyncio.Task] = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._running)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Parameters:
+            key (Hashable): Identity of the work
+            fn (Callable[[], Awaitable[T]]): Starts the work, only called when no call with `key` is running
+
+        Returns:
+            The result of the running or started call.
+        """
+        task = self._running.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._running[key] = task
+            task.add_done_callback(lambda _: self._running.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
@@ -0,0 +1,72 @@
+import json
+from typing import AsyncIterator, Callable
+
+from app.exceptions.inference_exceptions import InferenceQueueFullError, ModelServerError
+from app.utils.logging import AppLogger
+from fastapi.responses import StreamingResponse
+
+logger = AppLogger().get_logger()
+
+
+def format_event(event: str, data) -> str:
+    """
+    Formats one Server-Sent Event with JSON data.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def token_event_response(tokens: AsyncIterator[str], result_key: str, on_done: Callable[[str], None] | None = None) -> StreamingResponse:
+    """
+    Streams generated text as Server-Sent Events.
+
+    Sends a `token` event ({"token": str}) for each piece of text, then a `done` event with the full text under `result_key`.
+    The first token is awaited before the response starts, so errors raised before generation (e.g. a full queue)
+    can still be answered with a proper HTTP status. Errors after it end the stream with an `error` event
+    ({"code": str, "message": str}) instead of `done`, so clients can tell them from a dropped connection.
+
+    Parameters:
+        tokens (AsyncIterator[str]): Generated text, e.g. `NorskLlama38b.stream(...)`
+        result_key (str): Key of the full text in the `done` event, e.g. "summary"
+        on_done (Optional[Callable[[str], None]]): Called with the full text once it is generated, e.g. to persist it
+
+    Returns:
+        StreamingResponse: text/event-stream response
+    """
+    try:
+        first_token = await anext(tokens)
+    except StopAsyncIteration:
+        first_token = None
+
+    async def events():
+        text = []
+        if first_token is not None:
+            text.append(first_token)
+            yield format_event("token", {"token": first_token})
+
+        try:
+            async for token in tokens:
+                text.append(token)
+                yield format_event("token", {"token": token})
+        except Exception as e:
+            logger.error(f"Streamed generation failed: {e}")
+            yield format_event("error", error_data(e))
+            return
+
+        result = "".join(text)
+        if on_done is not None:
+            on_done(result)
+        yield format_event("done", {result_key: result})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Tell nginx not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def error_data(error: Exception) -> dict:
+    """ Data of the `error` event of a failed generation, the codes of the websocket errors """
+    if isinstance(error, InferenceQueueFullError):
+        return {"code": "busy", "message": error.message, "retry_after": error.retry_after}
+    if isinstance(error, ModelServerError):
+        return {"code": "unavailable", "message": error.message}
+    return {"code": "generation_failed", "message": "Generation failed"}
@@ -0,0 +1,66 @@
+import re
+from typing import List
+
+# Whitespace after the end of a sentence
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+def split_segments(text: str) -> List[str]:
+    """
+    Splits a transcription into its segments (non-empty lines).
+    """
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Splits a segment into sentences, keeping the punctuation.
+    """
+    return [sentence for sentence in SENTENCE_BOUNDARY.split(text) if sentence]
+
+def split_words(text: str, tokens: int, max_tokens: int) -> List[str]:
+    """
+    Splits text without sentence boundaries into pieces of whole words of about `max_tokens` tokens each.
+    Tokens per word are estimated from the total, so pieces are made a bit smaller than the limit.
+
+    Parameters:
+        text (str): Text to split
+        tokens (int): Number of tokens of the text
+        max_tokens (int): Maximum number of tokens of a piece
+
+    Returns:
+        List[str]: Pieces in order
+    """
+    words = text.split()
+    if not words:
+        return []
+    words_per_piece = max(1, int(len(words) * max_tokens * 0.8 / max(tokens, 1)))
+    return [" ".join(words[start:start + words_per_piece]) for start in range(0, len(words), words_per_piece)]
+
+def pack_chunks(units: List[str], tokens: List[int], max_tokens: int, separator: str = "\n") -> List[str]:
+    """
+    Packs consecutive units into as few chunks as possible of at most `max_tokens` tokens each.
+    Units are never split, a unit longer than `max_tokens` gets a chunk of its own.
+
+    Parameters:
+        units (List[str]): Texts in order, e.g. segments of a transcription
+        tokens (List[int]): Number of tokens of each unit
+        max_tokens (int): Maximum number of tokens of a chunk
+        separator (str): Joins the units of a chunk, counted as one token. Default is a newline.
+
+    Returns:
+        List[str]: Chunks in order
+
+    Example:
+        >>> pack_chunks(["a b", "c", "d e f"], [2, 1, 3], max_tokens=4)
+        ['a b\\nc', 'd e f']
+    """
+    chunks = []
+    chunk, chunk_tokens = [], 0
+    for unit, unit_tokens in zip(units, tokens):
+        if chunk and chunk_tokens + 1 + unit_tokens > max_tokens:
+            chunks.append(separator.join(chunk))
+            chunk, chunk_tokens = [], 0
+        chunk_tokens += unit_tokens + (1 if chunk else 0)
+        chunk.append(unit)
+    if chunk:
+        chunks.append(separator.join(chunk))
+    return chunks
@@ -0,0 +1,101 @@
+import struct
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import numpy as np
+from app.ai.audio import OpusDecoder, decode_pcm16
+from app.exceptions.audio_exceptions import InvalidAudioFrameError
+from app.utils.metrics import audio_decode_seconds
+
+AUDIO_FRAME_VERSION = 1
+
+SAMPLE_FORMAT_PCM16 = 1
+SAMPLE_FORMAT_OPUS = 2
+SAMPLE_FORMATS = {SAMPLE_FORMAT_PCM16: "pcm16", SAMPLE_FORMAT_OPUS: "opus"}
+
+# version, sample format, channels, padding, sample rate, sequence number, timestamp in milliseconds
+AUDIO_FRAME_HEADER = struct.Struct("<BBBxIIQ")
+
+@dataclass
+class AudioFrameHeader:
+    """
+    version (int): framing version, `AUDIO_FRAME_VERSION`
+    sample_format (int): `SAMPLE_FORMAT_PCM16` (little-endian 16-bit PCM) or `SAMPLE_FORMAT_OPUS` (one raw Opus packet)
+    channels (int): number of interleaved channels
+    sample_rate (int): sample rate of the payload
+    sequence_no (int): frame number, plays the role of chunk_start_no of JSON audio messages
+    timestamp (int): client timestamp of the frame in milliseconds
+    """
+    version: int
+    sample_format: int
+    channels: int
+    sample_rate: int
+    sequence_no: int
+    timestamp: int
+
+def parse_audio_frame(frame: bytes) -> Tuple[AudioFrameHeader, memoryview]:
+    """
+    Splits a binary websocket message into its header and payload.
+
+    Raises:
+        InvalidAudioFrameError: If the header is truncated, or its version, format or rate are not supported.
+    """
+    if len(frame) < AUDIO_FRAME_HEADER.size:
+        raise InvalidAudioFrameError(f"{len(frame)} bytes is shorter than the {AUDIO_FRAME_HEADER.size} byte header")
+
+    header = AudioFrameHeader(*AUDIO_FRAME_HEADER.unpack_from(frame))
+    if header.version != AUDIO_FRAME_VERSION:
+        raise InvalidAudioFrameError(f"unsupported version {header.version}")
+    if header.sample_format not in SAMPLE_FORMATS:
+        raise InvalidAudioFrameError(f"unsupported sample format {header.sample_format}")
+    if not header.channels or not header.sample_rate:
+        raise InvalidAudioFrameError("channels and sample rate must be positive")
+
+    return header, memoryview(frame)[AUDIO_FRAME_HEADER.size:]
+
+def encode_audio_frame(payload: bytes, sequence_no: int, timestamp: int, sample_format: int = SAMPLE_FORMAT_PCM16, sample_rate: int = 16000, channels: int = 1) -> bytes:
+    """
+    Builds a binary audio frame, the client side of `parse_audio_frame`.
+    """
+    return AUDIO_FRAME_HEADER.pack(AUDIO_FRAME_VERSION, sample_format, channels, sample_rate, sequence_no, timestamp) + payload
+
+class AudioFrameDecoder:
+    """
+    Decodes the binary audio frames of one connection into 16 kHz mono float32 samples.
+    Keeps one Opus decoder per stream format, as Opus frames depend on the previous ones.
+
+    Methods:
+        decode(frame): Parses and decodes one frame.
+    """
+
+    def __init__(self):
+        self._opus_decoders: Dict[Tuple[int, int], OpusDecoder] = {}
+
+    def decode(self, frame: bytes) -> Tuple[AudioFrameHeader, np.ndarray]:
+        """
+        Parameters:
+            frame (bytes): Binary websocket message
+
+        Returns:
+            tuple: Frame header and decoded samples
+
+        Raises:
+            InvalidAudioFrameError: If the frame can't be parsed or decoded.
+        """
+        header, payload = parse_audio_frame(frame)
+
+        if header.sample_format == SAMPLE_FORMAT_PCM16:
+            if len(payload) % (2 * header.channels):
+                raise InvalidAudioFrameError("PCM16 payload is not a whole number of samples")
+            with audio_decode_seconds.labels("pcm16").time():
+                return header, decode_pcm16(payload, source_rate=header.sample_rate, channels=header.channels)
+
+        key = (header.sample_rate, header.channels)
+        decoder = self._opus_decoders.get(key)
+        if decoder is None:
+            decoder = self._opus_decoders[key] = OpusDecoder(source_rate=header.sample_rate, channels=header.channels)
+        try:
+            with audio_decode_seconds.labels("opus").time():
+                return header, decoder.decode(bytes(payload))
+        except Exception as e:
+            raise InvalidAudioFrameError(f"Opus packet can't be decoded ({e})")
@@ -1,9 +1,24 @@
+import asyncio
+import json
+from typing import List
 
-
-from app.ai.models.faster_whisper import faster_whisper_model
-from app.utils.connection_manager import ConnectionManager
+import app.constants as constants
+import numpy as np
+from app.ai.audio import SAMPLE_RATE, decode_base64_audio
+from app.ai.executor import whisper_executor
+from app.config import settings
+from app.exceptions.audio_exceptions import InvalidAudioFrameError
+from app.exceptions.inference_exceptions import InferenceQueueFullError, ModelServerError
+from app.services.language_identification import LanguageIdentifier
+from app.services.persistence_service import NOTE_SUMMARY, SOURCE_WEBSOCKET, persistence_service
+from app.services.streaming_transcription import StreamingTranscriptionSession
+from app.services.summarization_service import summarization_service
+from app.services.transcription_service import compact_words, transcription_service, whisper_model
+from app.utils.connection_manager import Connection, ConnectionManager
 from app.utils.logging import AppLogger
-from fastapi import WebSocket
+from app.utils.metrics import transcription_words, websocket_sessions
+from app.websockets.audio_frames import AUDIO_FRAME_VERSION, SAMPLE_FORMATS, AudioFrameDecoder
+from fastapi import WebSocket, WebSocketDisconnect
 
 
 class TranscriptionConnectionManager(ConnectionManager):
@@ -11,33 +26,86 @@ class TranscriptionConnectionManager(ConnectionManager):
     Transcription Connection Manager
     """
 
-manager = TranscriptionConnectionManager()
+manager = TranscriptionConnectionManager(
+    max_queue_size=settings.websocket_send_queue_size,
+    slow_consumer_policy=settings.websocket_slow_consumer_policy,
+    send_timeout_seconds=settings.websocket_send_timeout_seconds
+)
+websocket_sessions.set_function(lambda: len(manager.connections))
 
 logger = AppLogger().get_logger()
 
-configuration = {
+default_configuration = {
     "language": "en",
     "chunk_length_ms": 500,
     "language_probability_threshold": 0.65,
+    "streaming": False,
+    "binary": False,
+    "response_format": "words",
+    "probabilities": False,
 }
 
 async def transcription_websocket(websocket: WebSocket):
     logger.info("Hello")
-    await manager.connect(websocket)
+    connection = await manager.connect(websocket)
+    # The connection id is the id of the persisted session
+    persistence_service.start_session(SOURCE_WEBSOCKET, session_id=connection.session_id)
+
+    configuration = {**default_configuration}
+    session = None
+    frame_decoder = None
+    summary_tasks = set()
+    # Settles the language of "auto" sessions before anything is transcribed
+    language_identifier = LanguageIdentifier(max_seconds=settings.language_id_max_seconds)
 
     try:
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            if message.get("bytes") is not None:
+                # Binary audio frames are always transcribed incrementally
+                if frame_decoder is None:
+                    await send_error(connection, "invalid_frame", 'Binary audio frames need {"type": "config", "data": {"binary": true}} first')
+                    continue
+                if session is None:
+                    session = StreamingTranscriptionSession(whisper_model, configuration)
+                await stream_audio_frame(connection, session, frame_decoder, message["bytes"], language_identifier)
+                continue
+
+            data = json.loads(message["text"])
             if data["type"] == "config":
                 configuration.update(data["data"])
-            if data['type'] == 'audio':
-                segments, info = faster_whisper_model.transcribe_from_blobs(blobs=data['data'], cfg=configuration)
-                if configuration['language'] == "auto" and info.language_probability >= configuration['language_probability_threshold'] and len(segments) > 0:
-                    configuration['language'] = info.language
-                    await websocket.send_json({
-                        "type": "language",
-                        "data": info.language
+                if configuration["binary"] and frame_decoder is None:
+                    frame_decoder = AudioFrameDecoder()
+                    await connection.send_json({
+                        "type": "protocol",
+                        "data": {"binary": True, "version": AUDIO_FRAME_VERSION, "sample_formats": list(SAMPLE_FORMATS.values())}
                     })
+            if data["type"] == "summarize":
+                # Runs next to the audio loop, so transcription goes on while the summary streams
+                task = asyncio.create_task(stream_summary(connection, data["data"]))
+                summary_tasks.add(task)
+                task.add_done_callback(summary_tasks.discard)
+            if data['type'] == 'audio' and configuration["streaming"]:
+                if session is None:
+                    session = StreamingTranscriptionSession(whisper_model, configuration)
+                await stream_audio(connection, session, data, language_identifier)
+            elif data['type'] == 'audio':
+                try:
+                    if configuration['language'] == "auto":
+                        segments, info = await transcribe_auto_language(connection, configuration, language_identifier, data)
+                    else:
+                        segments, info = await transcription_service.transcribe_blobs(data['data'], cfg=configuration)
+                except InferenceQueueFullError as e:
+                    await send_busy(connection, e)
+                    continue
+                except ModelServerError as e:
+                    await send_error(connection, "unavailable", e.message)
+                    continue
+                if configuration["response_format"] == "compact":
+                    await send_compact_words(connection, segments, data, configuration)
                 else:
                     words = []
                     for segment in segments:
@@ -52,12 +120,265 @@ async def transcription_websocket(websocket: WebSocket):
                                 "is_good": True,
                                 "chunk_num": data['chunk_start_no'] + chunk_number,
                             })
-                    
-                    await websocket.send_json({
+
+                    transcription_words.labels("websocket").inc(len(words))
+                    if persistence_service.enabled:
+                        persistence_service.add_words(connection.session_id, compact_words(segments, offset_ms=data['timestamp'], probabilities=True))
+                    await connection.send_json({
                         "type": "word",
                         "data": words
-                    })    
-               
+                    })
+
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
         logger.error(f"Error: {e}")
-        manager.disconnect(websocket)
+    finally:
+        manager.disconnect(connection)
+        for task in summary_tasks:
+            task.cancel()
+        # Flushes the words of the session soon
+        persistence_service.close_session(connection.session_id, language=None if configuration["language"] == "auto" else configuration["language"])
+
+async def send_compact_words(connection: Connection, segments, data: dict, configuration: dict):
+    """
+    Sends the words of an audio message as parallel arrays, check `compact_words`.
+    "chunk_num" is the chunk each word ends in, every word is final ("is_good").
+    """
+    words = compact_words(segments, offset_ms=data['timestamp'], probabilities=configuration["probabilities"])
+    chunk_length_ms = configuration["chunk_length_ms"]
+    words["chunk_num"] = [data['chunk_start_no'] + (end - data['timestamp']) // chunk_length_ms for end in words["end"]]
+
+    transcription_words.labels("websocket").inc(len(words["words"]))
+    if configuration["probabilities"]:
+        persistence_service.add_words(connection.session_id, words)
+    elif persistence_service.enabled:
+        persistence_service.add_words(connection.session_id, compact_words(segments, offset_ms=data['timestamp'], probabilities=True))
+    await connection.send_json({
+        "type": "word",
+        "data": words
+    })
+
+async def stream_audio(connection: Connection, session: StreamingTranscriptionSession, data: dict, language_identifier: LanguageIdentifier):
+    """
+    Handles an audio message of a streaming session.
+    Only new chunks are decoded, off the event loop, only the uncommitted audio is transcribed, and only changed words are sent.
+
+    Parameters:
+        connection (Connection): Client connection
+        session (StreamingTranscriptionSession): Transcription state of the connection
+        data (dict): Audio message
+        language_identifier (LanguageIdentifier): Language detection state of the connection
+    """
+    # Decoding (base64, WAV or WebM/Opus, resampling) runs in a thread so it never blocks the other connections
+    blobs = session.new_blobs(data['data'], data['chunk_start_no'])
+    chunks = await asyncio.to_thread(decode_chunks, [blob for _, blob in blobs])
+    appended = 0
+    for (chunk_no, _), samples in zip(blobs, chunks):
+        appended += session.add_samples(samples, chunk_no, data['timestamp'])
+    if not appended:
+        return
+
+    await transcribe_window(connection, session, language_identifier)
+
+async def stream_audio_frame(connection: Connection, session: StreamingTranscriptionSession, frame_decoder: AudioFrameDecoder, frame: bytes, language_identifier: LanguageIdentifier):
+    """
+    Handles a binary audio frame: a fixed header followed by PCM16 samples or one Opus packet, check `app.websockets.audio_frames`.
+    Frames can be a lot shorter than JSON chunks, the window is transcribed once `chunk_length_ms` of new audio is buffered.
+
+    Parameters:
+        connection (Connection): Client connection
+        session (StreamingTranscriptionSession): Transcription state of the connection
+        frame_decoder (AudioFrameDecoder): Decoder state of the connection
+        frame (bytes): Binary websocket message
+        language_identifier (LanguageIdentifier): Language detection state of the connection
+    """
+    try:
+        # Opus decoding and resampling run in a thread, frames of the connection are still decoded one at a time and in order
+        header, samples = await asyncio.to_thread(frame_decoder.decode, frame)
+    except InvalidAudioFrameError as e:
+        await send_error(connection, "invalid_frame", e.message)
+        return
+
+    if not session.add_samples(samples, chunk_no=header.sequence_no, timestamp=header.timestamp):
+        return
+    if session.pending_samples < session.configuration["chunk_length_ms"] * SAMPLE_RATE // 1000:
+        return
+
+    await transcribe_window(connection, session, language_identifier)
+
+async def transcribe_window(connection: Connection, session: StreamingTranscriptionSession, language_identifier: LanguageIdentifier):
+    """
+    Transcribes the uncommitted audio of a streaming session and sends the changed words.
+    In "auto" mode nothing is transcribed before the language is settled, the audio stays in the window until then.
+    """
+    configuration = session.configuration
+    try:
+        if configuration['language'] == "auto":
+            # Only audio the previous detections did not see, at least `LANGUAGE_ID_MIN_SECONDS` of it
+            start = max(language_identifier.position, session.buffer.start)
+            if session.buffer.end - start < settings.language_id_min_seconds * SAMPLE_RATE:
+                return
+            end = session.buffer.end
+            settled = await identify_language(connection, configuration, language_identifier, session.buffer.read(start))
+            # Moved only once a detection ran, skipped audio is detected with the next message
+            language_identifier.position = end
+            if not settled:
+                return
+
+        # The audio is already buffered, a skipped decode is caught up by the next message
+        segments, info = await whisper_executor.run(session.decode)
+    except InferenceQueueFullError as e:
+        await send_busy(connection, e)
+        return
+    except ModelServerError as e:
+        await send_error(connection, "unavailable", e.message)
+        return
+
+    committed, tentative = session.commit(segments)
+    if not committed and tentative is None:
+        return
+
+    # Only new committed words, and the tentative words when they changed
+    transcription_words.labels("websocket").inc(len(committed))
+    if committed and persistence_service.enabled:
+        persistence_service.add_words(connection.session_id, {
+            "words": [word["word"] for word in committed],
+            "start": [word["timestamp"][0] for word in committed],
+            "end": [word["timestamp"][1] for word in committed],
+        })
+    data = {"committed": committed}
+    if tentative is not None:
+        data["tentative"] = tentative
+    # Tentative words are replaced by the next delta, only deltas without committed words can be dropped
+    await connection.send_json({
+        "type": "word_delta",
+        "data": data
+    }, droppable=not committed)
+
+async def transcribe_auto_language(connection: Connection, configuration: dict, language_identifier: LanguageIdentifier, data: dict):
+    """
+    Transcribes a non-streaming audio message of an "auto" session whose language is not settled yet.
+    The chunks that were not received before are kept for language detection, which runs once there are
+    `LANGUAGE_ID_MIN_SECONDS` of them. While the language is not settled, the message is transcribed in the
+    most probable language so far, so no words are lost and Whisper doesn't detect the language again.
+    The blobs are decoded once, for both.
+
+    Parameters:
+        connection (Connection): Client connection
+        configuration (dict): Transcription configuration of the connection
+        language_identifier (LanguageIdentifier): Language detection state of the connection
+        data (dict): Audio message
+
+    Returns:
+        tuple: Segments and transcription info of the message
+
+    Raises:
+        InferenceQueueFullError: If the whisper queue is full.
+        ModelServerError: If the model server is unavailable.
+    """
+    chunks = await asyncio.to_thread(decode_chunks, data['data'])
+    pending = language_identifier.add_chunks(chunks, data['chunk_start_no'])
+    if pending >= settings.language_id_min_seconds * SAMPLE_RATE:
+        audio = await asyncio.to_thread(np.concatenate, language_identifier.pending)
+        await identify_language(connection, configuration, language_identifier, audio)
+        # Cleared only once a detection ran, skipped chunks are detected with the next message
+        language_identifier.pending = []
+
+    cfg = {**configuration, "language": language_identifier.best() or "auto"}
+    audio = await asyncio.to_thread(np.concatenate, chunks) if chunks else np.zeros(0, dtype=np.float32)
+    return await transcription_service.transcribe_audio(audio, cfg=cfg)
+
+async def identify_language(connection: Connection, configuration: dict, language_identifier: LanguageIdentifier, audio: np.ndarray) -> bool:
+    """
+    Detects the language of new audio of an "auto" session (one encoder pass, check `FasterWhisperModel.detect_language`)
+    and adds it to the evidence of the session. Once the language is settled, it is set in the configuration
+    of the connection and sent to the client as a "language" message.
+
+    Parameters:
+        connection (Connection): Client connection
+        configuration (dict): Transcription configuration of the connection
+        language_identifier (LanguageIdentifier): Language detection state of the connection
+        audio (np.ndarray): Audio the previous detections did not see
+
+    Returns:
+        bool: Whether the language is settled
+
+    Raises:
+        InferenceQueueFullError: If the whisper queue is full, the audio was not examined.
+        ModelServerError: If the model server is unavailable, the audio was not examined.
+    """
+    probabilities, speech_seconds = await whisper_executor.run(whisper_model.detect_language, audio, max_seconds=settings.language_id_max_seconds)
+
+    language = language_identifier.add(probabilities, speech_seconds, threshold=configuration['language_probability_threshold'])
+    if language is None:
+        return False
+
+    configuration['language'] = language
+    await connection.send_json({
+        "type": "language",
+        "data": language
+    })
+    return True
+
+def decode_chunks(blobs: List[str]) -> List[np.ndarray]:
+    """ Audio of each base64 blob of an audio message """
+    return [decode_base64_audio(blob) for blob in blobs]
+
+async def stream_summary(connection: Connection, data: dict):
+    """
+    Streams a summary of a transcription to the client while it is generated.
+    Sends a "summary_token" message for each piece of text, then a "summary" message with the full summary.
+
+    Parameters:
+        connection (Connection): Client connection
+        data (dict): {"transcription": str, "prompt_name": Optional[str], "prompt_version": Optional[int]}
+    """
+    summary = []
+    try:
+        # Transcriptions longer than the model context are summarized in chunks before the first token
+        async for token in summarization_service.stream_summary(
+            transcription=data["transcription"],
+            prompt_name=data.get("prompt_name", constants.LANGFUSE_PROMPT_NORSK_SUMMARIZATION_DEFAULT),
+            prompt_version=data.get("prompt_version"),
+            langfuse_args={"name": "summarization"}
+        ):
+            summary.append(token)
+            # The "summary" message has the full text, so tokens can be dropped for a slow client
+            await connection.send_json({
+                "type": "summary_token",
+                "data": token
+            }, droppable=True)
+    except InferenceQueueFullError as e:
+        await send_busy(connection, e)
+        return
+    except Exception as e:
+        logger.error(f"Error while streaming summary: {e}")
+        return
+
+    summary = "".join(summary)
+    persistence_service.add_note(NOTE_SUMMARY, summary, session_id=connection.session_id,
+                                 prompt_name=data.get("prompt_name", constants.LANGFUSE_PROMPT_NORSK_SUMMARIZATION_DEFAULT), prompt_version=data.get("prompt_version"))
+    await connection.send_json({
+        "type": "summary",
+        "data": summary
+    })
+
+async def send_busy(connection: Connection, error: InferenceQueueFullError):
+    """
+    Tells the client that a message was skipped because an inference queue is full.
+    """
+    await send_error(connection, "busy", error.message, retry_after=error.retry_after)
+
+async def send_error(connection: Connection, code: str, message: str, **details):
+    """
+    Tells the client that a message was skipped, e.g. because it is invalid.
+    """
+    await connection.send_json({
+        "type": "error",
+        "data": {
+            "code": code,
+            "message": message,
+            **details,
+        }
+    })
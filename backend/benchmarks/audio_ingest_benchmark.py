@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of the audio ingest path of FasterWhisperModel.
+
+Compares the former tempfile based path (pydub parse + concatenation, WAV export to a temporary
+file, decoding the file again inside `WhisperModel.transcribe`) with the in-memory path of
+`app.ai.audio`. Only ingest is measured, the model is not loaded.
+
+Usage (from the backend directory):
+    python -m benchmarks.audio_ingest_benchmark --chunks 20 --chunk-ms 500 --sample-rate 48000
+"""
+import argparse
+import base64
+import io
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from app.ai.audio import decode_base64_audio
+from benchmarks.fixtures import make_blob
+
+
+def tempfile_ingest(blobs):
+    """ The former `transcribe_from_blobs` path, up to the array `WhisperModel.transcribe` decodes """
+    from faster_whisper.audio import decode_audio
+    from pydub import AudioSegment
+
+    combined_audio = AudioSegment.silent(duration=0)
+    for base64_blob in blobs:
+        audio_bytes = base64.b64decode(base64_blob)
+        combined_audio += AudioSegment.from_file(io.BytesIO(audio_bytes), format="wav")
+
+    with tempfile.NamedTemporaryFile(suffix='.wav') as fp:
+        combined_audio.export(fp.name, format='wav')
+        fp.flush()
+        return decode_audio(fp.name)
+
+def in_memory_ingest(blobs):
+    """ The current `transcribe_from_blobs` path """
+    return np.concatenate([decode_base64_audio(blob) for blob in blobs])
+
+def measure(fn, blobs, repeat: int):
+    fn(blobs)  # warmup
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(blobs)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(blobs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median_ms": float(np.median(timings) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "peak_alloc_kb": peak / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20, help="Blobs per request")
+    parser.add_argument("--chunk-ms", type=int, default=500, help="Duration of a blob")
+    parser.add_argument("--sample-rate", type=int, default=48000, help="Sample rate of the blobs")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    blobs = [make_blob(args.chunk_ms, args.sample_rate, seed) for seed in range(args.chunks)]
+    print(f"{args.chunks} x {args.chunk_ms} ms blobs at {args.sample_rate} Hz")
+
+    results = {}
+    for name, fn in (("tempfile", tempfile_ingest), ("in_memory", in_memory_ingest)):
+        results[name] = measure(fn, blobs, args.repeat)
+        print(f"{name:>10}: median {results[name]['median_ms']:.2f} ms, p95 {results[name]['p95_ms']:.2f} ms, peak alloc {results[name]['peak_alloc_kb']:.0f} KiB")
+
+    saving = results["tempfile"]["median_ms"] - results["in_memory"]["median_ms"]
+    print(f"saving per request: {saving:.2f} ms ({saving / results['tempfile']['median_ms'] * 100:.0f}%)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Fake model backends for the benchmarks. They replace only the model computation of the app singletons,
+with sleeps of a configurable speed, so queues, batching, caches, decoding and the HTTP and websocket
+layers are measured for real, without weights or a GPU.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from app.ai.audio import SAMPLE_RATE
+from faster_whisper.transcribe import Segment, Word
+
+# One fake word per this many seconds of audio
+WORD_SECONDS = 0.4
+# Words per fake segment
+SEGMENT_WORDS = 5
+
+class FakeTokenizer:
+    """ Whitespace tokenizer with the call interface of a transformers tokenizer """
+
+    def __call__(self, text, add_special_tokens: bool = True):
+        texts = [text] if isinstance(text, str) else text
+        ids = [[1] * add_special_tokens + [hash(word) % 32000 for word in item.split()] for item in texts]
+        return SimpleNamespace(input_ids=ids[0] if isinstance(text, str) else ids)
+
+def fake_transcription(audio: np.ndarray, rtf: float, on_segment=None):
+    """
+    Sleeps `rtf` times the duration of the audio, like a model with that real-time factor, and returns
+    one word per `WORD_SECONDS` of audio. Sleeping releases the GIL, as CTranslate2 does.
+    With `on_segment`, segments are passed to it one by one as their time is slept.
+    """
+    duration = len(audio) / SAMPLE_RATE
+    if on_segment is None:
+        time.sleep(duration * rtf)
+    for segment in fake_segments(duration) if on_segment else []:
+        time.sleep((segment.end - segment.start) * rtf)
+        on_segment(segment)
+    info = SimpleNamespace(language="no", language_probability=1.0, duration=duration, duration_after_vad=duration)
+    return fake_segments(duration), info
+
+def fake_segments(duration: float) -> list:
+    """ Segments of `SEGMENT_WORDS` words, one word per `WORD_SECONDS` of `duration` seconds """
+    words = [Word(start=index * WORD_SECONDS, end=(index + 1) * WORD_SECONDS, word=" ord", probability=0.9) for index in range(int(duration / WORD_SECONDS))]
+    segments = []
+    for index in range(0, len(words), SEGMENT_WORDS):
+        segment_words = words[index:index + SEGMENT_WORDS]
+        segments.append(Segment(
+            id=len(segments), seek=0, start=segment_words[0].start, end=segment_words[-1].end,
+            text="".join(word.word for word in segment_words), tokens=[], avg_logprob=-0.2,
+            compression_ratio=1.0, no_speech_prob=0.01, words=segment_words, temperature=0.0
+        ))
+    return segments
+
+def install_fake_whisper(rtf: float = 0.05):
+    """ Makes `faster_whisper_model` fake its transcriptions, check `fake_transcription` """
+    from app.ai.model_registry import model_registry
+    from app.ai.models.faster_whisper import faster_whisper_model
+
+    faster_whisper_model.transcribe_from_array = lambda audio, cfg=None, on_segment=None: fake_transcription(audio, rtf, on_segment)
+    model_registry.register(faster_whisper_model.name, load=lambda: None, unload=lambda: None)
+
+def install_fake_llm(prefill_ms_per_token: float = 0.05, decode_ms: float = 20):
+    """
+    Makes the Norsk Llama singleton fake its generations. Prefill takes `prefill_ms_per_token` per prompt token
+    of the longest prompt, each decode step takes `decode_ms` for the whole batch, as on a GPU.
+    """
+    from app.ai.model_registry import model_registry
+    from app.ai.models.llms.norsk_llama3_8b import model
+
+    def generate_batch(input_ids, cfg, prefixes=None):
+        time.sleep(max(len(ids) for ids in input_ids) * prefill_ms_per_token / 1000)
+        time.sleep(cfg["max_new_tokens"] * decode_ms / 1000)
+        return [" ".join(["ord"] * cfg["max_new_tokens"]) for _ in input_ids]
+
+    def generate_stream(input_ids, cfg, on_token, stop_event: threading.Event | None = None, prefix=None):
+        time.sleep(len(input_ids) * prefill_ms_per_token / 1000)
+        tokens = []
+        for _ in range(cfg["max_new_tokens"]):
+            if stop_event is not None and stop_event.is_set():
+                break
+            time.sleep(decode_ms / 1000)
+            tokens.append(" ord")
+            on_token(" ord")
+        return "".join(tokens)
+
+    model.tokenizer = FakeTokenizer()
+    model.scheduler.generate_batch = generate_batch
+    model.generate_stream = generate_stream
+    model_registry.register(model.name, load=lambda: None, unload=lambda: None)
@@ -0,0 +1,69 @@
+"""
+Synthetic inputs shared by the benchmarks, generated from a seed so runs are reproducible.
+"""
+import base64
+import io
+import wave
+
+import numpy as np
+from app.ai.audio import SAMPLE_RATE
+
+TRANSCRIPT_LINES = [
+    "Lege: Hva kan jeg hjelpe deg med i dag?",
+    "Pasient: Jeg har hatt hodepine og feber i tre dager.",
+    "Lege: Har du tatt noe mot smertene?",
+    "Pasient: Jeg har tatt paracet to ganger om dagen, men det hjelper lite.",
+    "Lege: Har du vært kvalm eller stiv i nakken?",
+    "Pasient: Litt kvalm, men ikke stiv i nakken.",
+]
+
+def make_recording(seconds: float, seed: int = 0) -> np.ndarray:
+    """ Tone bursts with pauses and some noise, float32 at 16 kHz """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    bursts = np.sin(2 * np.pi * 0.2 * t) > -0.3
+    samples = 0.3 * np.sin(2 * np.pi * 220 * t) * bursts + 0.02 * rng.standard_normal(len(t))
+    return samples.astype(np.float32)
+
+def make_speech(seconds: float, seed: int = 0) -> np.ndarray:
+    """
+    Vowel-like signal at 16 kHz: a gliding 120 Hz harmonic source shaped by three formants, in syllables
+    and phrases. Unlike `make_recording`, VAD detects it as speech, so VAD and decoding are exercised.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    phase = 2 * np.pi * np.cumsum(120 + 20 * np.sin(2 * np.pi * 0.5 * t + seed)) / SAMPLE_RATE
+    source = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 30))
+
+    frequencies = np.fft.rfftfreq(n, 1 / SAMPLE_RATE)
+    response = sum(1 / (1 + ((frequencies - center) / bandwidth) ** 2) for center, bandwidth in ((700, 130), (1220, 70), (2600, 160)))
+    samples = np.fft.irfft(np.fft.rfft(source) * response, n)
+
+    syllables = (np.sin(2 * np.pi * 3 * t) > -0.2) * (np.sin(2 * np.pi * 0.2 * t) > -0.3)
+    samples = samples * syllables
+    samples = 0.3 * samples / max(np.abs(samples).max(), 1e-9) + 0.01 * rng.standard_normal(n)
+    return samples.astype(np.float32)
+
+def encode_wav(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> str:
+    """ Base64 encoded mono PCM16 WAV of float samples, the format clients send """
+    fp = io.BytesIO()
+    with wave.open(fp, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+    return base64.b64encode(fp.getvalue()).decode()
+
+def make_blob(duration_ms: int, sample_rate: int, seed: int) -> str:
+    """ Base64 encoded mono PCM16 WAV chunk with a tone and some noise """
+    rng = np.random.default_rng(seed)
+    t = np.arange(duration_ms * sample_rate // 1000) / sample_rate
+    samples = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))
+    return encode_wav(samples, sample_rate)
+
+def make_transcript(lines: int, seed: int = 0) -> str:
+    """ Doctor-patient conversation of `lines` lines, numbered so different seeds give different texts """
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(TRANSCRIPT_LINES), size=lines)
+    return "\n".join(f"{TRANSCRIPT_LINES[pick]} ({seed}.{number})" for number, pick in enumerate(picks))
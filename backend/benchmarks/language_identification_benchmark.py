@@ -0,0 +1,88 @@
+"""
+Benchmark of the start of a websocket streaming session with language "auto": transcribing the window after
+every chunk until Whisper is sure of the language (the former path), against the language identification
+stage (`FasterWhisperModel.detect_language` every `LANGUAGE_ID_MIN_SECONDS` of new audio, evidence accumulated
+by `LanguageIdentifier`).
+
+Reports the Whisper time spent before the language is settled, the calls and the median time of a call, and
+how much audio was needed. Random models are never sure of a language, so the former path runs for the whole
+recording and the new one settles after `LANGUAGE_ID_MAX_SECONDS` of speech; use --model and --audio with
+a real recording to compare detection latency.
+
+Without --model a small random multilingual Whisper is built locally.
+
+Usage (from the backend directory):
+    python -m benchmarks.language_identification_benchmark --seconds 12
+    python -m benchmarks.language_identification_benchmark --model large-v3 --device cuda --compute-type float16 --audio consultation.wav
+"""
+import argparse
+import time
+
+import numpy as np
+from app.ai.audio import SAMPLE_RATE, decode_audio
+from benchmarks.fixtures import make_speech
+from benchmarks.tiny_models import build_tiny_whisper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Model size or path, default is a random multilingual model built in /tmp")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--audio", help="Audio file, default is synthetic speech")
+    parser.add_argument("--seconds", type=float, default=12, help="Audio streamed at most")
+    parser.add_argument("--chunk-ms", type=int, default=500)
+    parser.add_argument("--threshold", type=float, default=0.65, help="language_probability_threshold of the session")
+    args = parser.parse_args()
+
+    from app.ai.model_registry import model_registry
+    from app.ai.models.faster_whisper import faster_whisper_model
+    from app.config import settings
+    from app.services.language_identification import LanguageIdentifier
+
+    faster_whisper_model.model_size = args.model or build_tiny_whisper("/tmp/benchmark-whisper-multilingual-64", multilingual=True)
+    faster_whisper_model.device = args.device
+    faster_whisper_model.compute_type = args.compute_type
+    model_registry.load(faster_whisper_model.name)
+
+    if args.audio:
+        with open(args.audio, "rb") as file:
+            audio = decode_audio(file.read())[:int(args.seconds * SAMPLE_RATE)]
+    else:
+        audio = make_speech(args.seconds)
+    chunk = args.chunk_ms * SAMPLE_RATE // 1000
+    ends = range(chunk, len(audio) + 1, chunk)
+    print(f"model {faster_whisper_model.model_size} on {args.device} ({args.compute_type}), {len(audio) / SAMPLE_RATE:.0f} s streamed in {args.chunk_ms} ms chunks")
+
+    def report(name, timings, language, end):
+        settled = f"settled on {language!r} after {end / SAMPLE_RATE:.1f} s" if language else "not settled"
+        print(f"{name:>21}: {sum(timings):.2f} s of Whisper in {len(timings)} calls, median {np.median(timings) * 1000:.0f} ms, {settled}")
+
+    # Former path, the whole window transcribed after every chunk
+    faster_whisper_model.transcribe_from_array(audio[:chunk], cfg={"language": "auto", "batch_size": 1})  # warmup
+    timings, language, end = [], None, len(audio)
+    for end in ends:
+        start = time.perf_counter()
+        segments, info = faster_whisper_model.transcribe_from_array(audio[:end], cfg={"language": "auto", "batch_size": 1})
+        timings.append(time.perf_counter() - start)
+        if info.language_probability >= args.threshold and segments:
+            language = info.language
+            break
+    report("transcribe per chunk", timings, language, end)
+
+    # Language identification stage
+    identifier = LanguageIdentifier(max_seconds=settings.language_id_max_seconds)
+    timings, end = [], len(audio)
+    for end in ends:
+        if end - identifier.position < settings.language_id_min_seconds * SAMPLE_RATE:
+            continue
+        start = time.perf_counter()
+        probabilities, speech_seconds = faster_whisper_model.detect_language(audio[identifier.position:end], max_seconds=settings.language_id_max_seconds)
+        timings.append(time.perf_counter() - start)
+        identifier.position = end
+        if identifier.add(probabilities, speech_seconds, threshold=args.threshold):
+            break
+    report("language identification", timings, identifier.language, end)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Benchmark of the LLM generation backends, transformers and int8 CTranslate2 (check `app.ai.models.llms.backends`).
+
+Each backend runs in its own subprocess, so memory is measured separately: resident memory after loading and
+its high water mark. The CTranslate2 conversion runs in a subprocess before, and is cached. Summaries of
+synthetic consultations are streamed with greedy decoding, reporting the median time to first token and
+tokens/s, and a batch of prompts is generated at once. Quantization changes the logits slightly, so the
+number of outputs identical to the first backend is reported, not required.
+
+Without --model a small random Llama is built locally.
+
+Usage (from the backend directory):
+    python -m benchmarks.llm_backend_benchmark --runs 5
+    python -m benchmarks.llm_backend_benchmark --backends ctranslate2 --compute-type int8_float32 --threads 8
+    python -m benchmarks.llm_backend_benchmark --model bineric/NorskGPT-Llama3-8b --max-new-tokens 256
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+from benchmarks.fixtures import make_transcript
+from benchmarks.tiny_models import build_tiny_llama
+
+def memory_mb() -> dict:
+    """ Resident memory and its high water mark of this process, Linux only """
+    memory = {}
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                memory[line[:5].lower()] = round(int(line.split()[1]) / 1024, 1)
+    return memory
+
+def create_backend(args):
+    from app.ai.models.llms.backends import BACKEND_CTRANSLATE2, CTranslate2Backend, TransformersBackend
+
+    if args.backend == BACKEND_CTRANSLATE2:
+        return CTranslate2Backend(compute_type=args.compute_type, threads=args.threads, cache_dir=args.cache_dir)
+    return TransformersBackend()
+
+def run_backend(args) -> dict:
+    """ Benchmark of one backend, in the subprocess """
+    import app.ai.prompts as prompts
+    from app.ai.models.llms.norsk_llama3_8b import GREEDY_CONFIG
+
+    backend = create_backend(args)
+    if args.convert:
+        backend.convert(args.model)
+        return {}
+
+    start = time.perf_counter()
+    backend.load(args.model)
+    load_seconds = time.perf_counter() - start
+    loaded = memory_mb()
+
+    cfg = {**GREEDY_CONFIG, "max_new_tokens": args.max_new_tokens}
+    prompt_ids = [
+        backend.tokenizer(prompts.default_prompt.format(content=make_transcript(args.transcript_lines, seed=run))).input_ids
+        for run in range(args.runs)
+    ]
+
+    def generate(ids):
+        first_token = []
+        start = time.perf_counter()
+        text = backend.generate_one(ids, cfg, on_token=lambda piece: first_token or first_token.append(time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        tokens = len(backend.tokenizer(text, add_special_tokens=False).input_ids)
+        return text, tokens, (first_token[0] if first_token else time.perf_counter()) - start, elapsed
+
+    generate(prompt_ids[0][:64])  # warmup
+
+    texts, tokens, first_token_seconds, seconds = [], 0, [], 0.0
+    for ids in prompt_ids:
+        text, count, first_token, elapsed = generate(ids)
+        texts.append(text)
+        tokens += count
+        first_token_seconds.append(first_token)
+        seconds += elapsed
+
+    start = time.perf_counter()
+    batch_texts = backend.generate_batch(prompt_ids, cfg)
+    batch_seconds = time.perf_counter() - start
+    batch_tokens = sum(len(backend.tokenizer(text, add_special_tokens=False).input_ids) for text in batch_texts)
+
+    return {
+        "device": backend.device,
+        "prompt_tokens": len(prompt_ids[0]),
+        "load_seconds": round(load_seconds, 2),
+        "loaded_rss_mb": loaded["vmrss"],
+        "peak_rss_mb": memory_mb()["vmhwm"],
+        "median_time_to_first_token_ms": round(float(np.median(first_token_seconds)) * 1000, 1),
+        "tokens_per_second": round(tokens / seconds, 1),
+        "batch_tokens_per_second": round(batch_tokens / batch_seconds, 1),
+        "texts": texts,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Model id or path, default is a random model built in /tmp")
+    parser.add_argument("--backends", default="transformers,ctranslate2", help="Comma separated backends to compare")
+    parser.add_argument("--compute-type", default="int8", help="CTranslate2 quantization, e.g. int8, int8_float32, int8_float16")
+    parser.add_argument("--threads", type=int, default=0, help="CTranslate2 threads, 0 for all cores")
+    parser.add_argument("--cache-dir", default="/tmp/benchmark-ctranslate2", help="Directory of the converted models")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--transcript-lines", type=int, default=12)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--convert", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        print(json.dumps(run_backend(args)))
+        return
+
+    args.model = args.model or build_tiny_llama("/tmp/benchmark-llama-256", hidden_size=256, layers=4)
+    options = ["--model", args.model, "--compute-type", args.compute_type, "--threads", str(args.threads), "--cache-dir", args.cache_dir,
+               "--max-new-tokens", str(args.max_new_tokens), "--transcript-lines", str(args.transcript_lines), "--runs", str(args.runs)]
+
+    results = {}
+    for name in args.backends.split(","):
+        command = [sys.executable, "-m", "benchmarks.llm_backend_benchmark", "--backend", name, *options]
+        if name == "ctranslate2":
+            subprocess.run([*command, "--convert"], check=True, stdout=subprocess.DEVNULL)
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+
+    reference = next(iter(results.values()))
+    print(f"model {args.model}, prompts of {reference['prompt_tokens']} tokens, {args.max_new_tokens} new tokens, greedy")
+    for name, result in results.items():
+        label = f"{name} {args.compute_type}" if name == "ctranslate2" else name
+        identical = sum(text == other for text, other in zip(result["texts"], reference["texts"]))
+        print(
+            f"{label:>18} on {result['device']}: loaded in {result['load_seconds']} s, rss {result['loaded_rss_mb']} MiB (peak {result['peak_rss_mb']} MiB), "
+            f"time to first token {result['median_time_to_first_token_ms']} ms, {result['tokens_per_second']} tokens/s, "
+            f"batch of {args.runs} {result['batch_tokens_per_second']} tokens/s, identical outputs {identical} of {len(result['texts'])}"
+        )
+
+if __name__ == "__main__":
+    main()
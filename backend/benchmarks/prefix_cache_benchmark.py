@@ -0,0 +1,63 @@
+"""
+Benchmark of prompt prefix key/value caching in NorskLlama38b.
+
+Measures time to first token (prefill plus one decode step) of summarization prompts sharing one
+template, with and without the cached prefix. Without --model a small random Llama is built locally.
+Runs on the backend of LLM_BACKEND, on ctranslate2 the prefix is cached as static prompt.
+
+Usage (from the backend directory):
+    python -m benchmarks.prefix_cache_benchmark --prefix-repeat 8 --runs 10
+    python -m benchmarks.prefix_cache_benchmark --model bineric/NorskGPT-Llama3-8b
+"""
+import argparse
+import time
+
+import numpy as np
+from benchmarks.tiny_models import build_tiny_llama
+
+TRANSCRIPT = "Lege: Hva kan jeg hjelpe deg med i dag? Pasient: Jeg har hatt hodepine og feber i tre dager. "
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Model id or path, default is a random model built in /tmp")
+    parser.add_argument("--prefix-repeat", type=int, default=8, help="Repeats of the default instructions, to get a long static prefix")
+    parser.add_argument("--transcript-repeat", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    import app.ai.prompts as prompts
+    from app.ai.model_registry import model_registry
+    from app.ai.models.llms.norsk_llama3_8b import model
+
+    model.model_id = args.model or build_tiny_llama("/tmp/benchmark-llama-256", hidden_size=256, layers=4)
+    model_registry.load(model.name)
+
+    instructions = prompts.default_prompt.split("{content}")[0]
+    template = instructions * args.prefix_repeat + "{content}\n\nOppsummering:\n"
+    prefix = template.split("{content}")[0]
+    cfg = {"max_new_tokens": 1, "top_k": 1}
+
+    def prompt_ids(run: int):
+        return model.tokenizer(template.format(content=f"{run}. {TRANSCRIPT * args.transcript_repeat}")).input_ids
+
+    results = {}
+    for name, use_prefix in (("full prefill", False), ("cached prefix", True)):
+        model.generate_one(prompt_ids(0), cfg, prefix=prefix if use_prefix else None)  # warmup, builds the cache entry
+        timings = []
+        for run in range(args.runs):
+            ids = prompt_ids(run)
+            start = time.perf_counter()
+            model.generate_one(ids, cfg, prefix=prefix if use_prefix else None)
+            timings.append(time.perf_counter() - start)
+        results[name] = float(np.median(timings) * 1000)
+
+    prefix_tokens = len(model.tokenizer(prefix).input_ids)
+    print(f"model {model.model_id} on {model.backend.device}, prompt {len(prompt_ids(0))} tokens, static prefix {prefix_tokens} tokens")
+    for name, median_ms in results.items():
+        print(f"{name:>14}: median time to first token {median_ms:.1f} ms")
+    print(f"speedup {results['full prefill'] / results['cached prefix']:.2f}x")
+    if hasattr(model.backend, "prefix_cache"):
+        print(f"cache {model.backend.prefix_cache.nbytes / 2 ** 20:.1f} MiB")
+
+if __name__ == "__main__":
+    main()
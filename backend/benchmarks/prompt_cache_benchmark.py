@@ -0,0 +1,109 @@
+"""
+Benchmark of prompt lookup on the request path against a local stub Langfuse server.
+
+Compares fetching the prompt from Langfuse on every request (the former behaviour of
+`get_summarization_prompt`) with the in-process `PromptRegistry`, with Langfuse up (answering
+after --latency-ms) and down (answering 500).
+
+Usage (from the backend directory):
+    python -m benchmarks.prompt_cache_benchmark --latency-ms 50 --requests 200
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+PROMPT_NAME = "norsk-summarization-prompt"
+
+class StubLangfuseHandler(BaseHTTPRequestHandler):
+    latency_seconds = 0.05
+    healthy = True
+    requests = 0
+
+    def do_GET(self):
+        StubLangfuseHandler.requests += 1
+        time.sleep(self.latency_seconds)
+
+        if not self.healthy or not self.path.startswith("/api/public/v2/prompts/"):
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        body = json.dumps({
+            "name": PROMPT_NAME,
+            "version": 1,
+            "type": "text",
+            "prompt": "Oppsummer samtalen:\n{{content}}\n",
+            "config": {},
+            "labels": ["production"],
+            "tags": [],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLangfuseHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def measure(fn, requests: int):
+    StubLangfuseHandler.requests = 0
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        "median_ms": float(np.median(timings) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "server_requests": StubLangfuseHandler.requests,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=int, default=50, help="Response time of the stub Langfuse server")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    StubLangfuseHandler.latency_seconds = args.latency_ms / 1000
+    server = start_stub_server()
+
+    # Settings are read at import, point them to the stub first
+    os.environ["LANGFUSE_HOST"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("LANGFUSE_PUBLIC_KEY", "pk-lf-benchmark")
+    os.environ.setdefault("LANGFUSE_SECRET_KEY", "sk-lf-benchmark")
+    import app.ai.prompts as prompts
+
+    def uncached():
+        try:
+            prompts.fetch_prompt(PROMPT_NAME).compile(content="Hei")
+        except Exception:
+            prompts.default_prompt.format(content="Hei")
+
+    def cached():
+        prompts.get_summarization_prompt(content="Hei", prompt_name=PROMPT_NAME)
+
+    prompts.prompt_registry.refresh(PROMPT_NAME)
+    for healthy in (True, False):
+        StubLangfuseHandler.healthy = healthy
+        state = "up" if healthy else "down"
+        requests = args.requests if healthy else max(args.requests // 20, 5)
+        for name, fn in (("uncached", uncached), ("registry", cached)):
+            result = measure(fn, requests)
+            print(f"langfuse {state:>4} {name:>9}: median {result['median_ms']:.3f} ms, p95 {result['p95_ms']:.3f} ms, {result['server_requests']} server requests for {requests} lookups")
+
+    print(f"registry hits {prompts.prompt_registry.hits}, misses {prompts.prompt_registry.misses}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
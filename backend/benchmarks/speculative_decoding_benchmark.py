@@ -0,0 +1,92 @@
+"""
+Benchmark of speculative decoding with a draft model in NorskLlama38b.
+
+Generates summaries of synthetic consultations with the summarization prompt, without and with the draft
+model, and reports tokens/s, the speedup and the share of drafted tokens the model accepted. With --greedy
+both runs must give the same text, which is checked.
+
+Without --model and --draft-model, small random Llamas sharing one tokenizer are built locally. Random
+models don't agree with each other, so expect an acceptance rate near zero. --draft-model self drafts with
+the model itself, where every drafted token is accepted, which shows the overhead of verification.
+
+Usage (from the backend directory):
+    python -m benchmarks.speculative_decoding_benchmark --greedy --runs 3
+    python -m benchmarks.speculative_decoding_benchmark --draft-model self --lookahead 8
+    python -m benchmarks.speculative_decoding_benchmark --model bineric/NorskGPT-Llama3-8b --draft-model meta-llama/Llama-3.2-1B
+"""
+import argparse
+import time
+
+from benchmarks.fixtures import make_transcript
+from benchmarks.tiny_models import build_tiny_llama
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Model id or path, default is a random model built in /tmp")
+    parser.add_argument("--draft-model", help="Draft model id or path, or self. Default is a smaller random model built in /tmp")
+    parser.add_argument("--lookahead", type=int, default=5, help="Tokens drafted per step")
+    parser.add_argument("--schedule", default="heuristic", choices=["heuristic", "constant"])
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--transcript-lines", type=int, default=12)
+    parser.add_argument("--greedy", action="store_true", help="Greedy decoding instead of sampling, outputs must match")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    import app.ai.prompts as prompts
+    from app.ai.model_registry import model_registry
+    from app.ai.models.llms.norsk_llama3_8b import DEFAULT_CONFIG, GREEDY_CONFIG, model
+    from app.utils.metrics import llm_draft_accepted_tokens, llm_draft_tokens
+
+    model.model_id = args.model or build_tiny_llama("/tmp/benchmark-llama-256", hidden_size=256, layers=4)
+    if args.draft_model == "self":
+        draft_model_id = model.model_id
+    else:
+        draft_model_id = args.draft_model or build_tiny_llama("/tmp/benchmark-llama-draft-64", hidden_size=64, layers=1)
+    model_registry.load(model.name)
+
+    model.backend.draft_model_id = draft_model_id
+    model.backend.draft_lookahead = args.lookahead
+    model.backend.draft_schedule = args.schedule
+    model.backend.load_draft_model()
+
+    cfg = {**DEFAULT_CONFIG, **(GREEDY_CONFIG if args.greedy else {}), "max_new_tokens": args.max_new_tokens}
+    prompt_ids = [
+        model.tokenizer(prompts.default_prompt.format(content=make_transcript(args.transcript_lines, seed=run))).input_ids
+        for run in range(args.runs)
+    ]
+
+    def generate(ids, speculative: bool):
+        model.backend.draft_enabled = speculative
+        start = time.perf_counter()
+        text = model.generate_one(ids, cfg)
+        elapsed = time.perf_counter() - start
+        return text, len(model.tokenizer(text, add_special_tokens=False).input_ids), elapsed
+
+    # Warmup of both paths
+    generate(prompt_ids[0][:64], speculative=False)
+    generate(prompt_ids[0][:64], speculative=True)
+
+    drafted_before, accepted_before = llm_draft_tokens.labels().value, llm_draft_accepted_tokens.labels().value
+    results = {False: [0, 0.0], True: [0, 0.0]}
+    identical = 0
+    for ids in prompt_ids:
+        texts = []
+        for speculative in (False, True):
+            text, tokens, elapsed = generate(ids, speculative)
+            results[speculative][0] += tokens
+            results[speculative][1] += elapsed
+            texts.append(text)
+        identical += texts[0] == texts[1]
+
+    drafted = llm_draft_tokens.labels().value - drafted_before
+    accepted = llm_draft_accepted_tokens.labels().value - accepted_before
+    print(f"model {model.model_id}, draft {draft_model_id} on {model.backend.device}, prompts of {len(prompt_ids[0])} tokens, {'greedy' if args.greedy else 'sampling'}")
+    for speculative, (tokens, elapsed) in results.items():
+        print(f"{'speculative' if speculative else 'baseline':>12}: {tokens} tokens in {elapsed:.2f} s, {tokens / elapsed:.1f} tokens/s")
+    speedup = (results[True][0] / results[True][1]) / (results[False][0] / results[False][1])
+    print(f"speedup {speedup:.2f}x, acceptance rate {accepted / max(drafted, 1):.1%} ({int(accepted)} of {int(drafted)} drafted tokens)")
+    if args.greedy:
+        print(f"identical outputs: {identical} of {len(prompt_ids)}")
+
+if __name__ == "__main__":
+    main()
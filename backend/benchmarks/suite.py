@@ -0,0 +1,341 @@
+"""
+Benchmark suite of the API, runnable offline on a CPU-only machine, with results in JSON so runs can be compared.
+
+Starts the app with uvicorn in a subprocess, on either fake model backends (`benchmarks.fake_models`, model
+compute replaced by sleeps, everything else real) or tiny random local models (`benchmarks.tiny_models`),
+and measures it from this process with synthetic inputs (`benchmarks.fixtures`):
+
+    rest_transcription  POST /api/v1/transcription, latency and real-time factor (latency / audio duration)
+    websocket           /ws/transcription in streaming mode with N concurrent real-time sessions, latency from
+                        each audio chunk to the next word message
+    llm                 POST /api/v1/summarize/stream, time to first token and tokens/s of one stream, and
+                        tokens/s of N concurrent POST /api/v1/summarize requests (batched generation)
+    memory              Peak RSS of the server process
+
+Usage (from the backend directory):
+    python -m benchmarks.suite --backend fake --output /tmp/fake.json
+    python -m benchmarks.suite --backend tiny --scenarios rest_transcription,llm --output /tmp/tiny.json
+    python -m benchmarks.suite --compare /tmp/before.json /tmp/after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+from benchmarks.fixtures import encode_wav, make_speech, make_transcript
+
+SCENARIOS = ("rest_transcription", "websocket", "llm")
+TINY_WHISPER_PATH = "/tmp/benchmark-whisper-64"
+TINY_LLAMA_PATH = "/tmp/benchmark-llama-256"
+
+def summarize_timings(timings_s) -> dict:
+    """ Median, p95, p99 and max of durations in seconds, in milliseconds """
+    timings_ms = np.asarray(timings_s) * 1000
+    if not len(timings_ms):
+        return {"count": 0}
+    return {
+        "count": len(timings_ms),
+        "median_ms": round(float(np.median(timings_ms)), 3),
+        "p95_ms": round(float(np.percentile(timings_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(timings_ms, 99)), 3),
+        "max_ms": round(float(timings_ms.max()), 3),
+    }
+
+# Server
+
+def serve(args):
+    """ Runs the app on the chosen backend, in the server subprocess """
+    import uvicorn
+
+    if args.backend == "fake":
+        from benchmarks.fake_models import install_fake_llm, install_fake_whisper
+        install_fake_whisper(rtf=args.fake_rtf)
+        install_fake_llm(prefill_ms_per_token=args.fake_prefill_ms, decode_ms=args.fake_decode_ms)
+    else:
+        from app.ai.models.llms.norsk_llama3_8b import model
+        model.model_id = TINY_LLAMA_PATH
+
+    from app.ai.models.llms import norsk_llama3_8b
+    norsk_llama3_8b.DEFAULT_CONFIG["max_new_tokens"] = args.max_new_tokens
+
+    from app.main import app
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", ws="websockets")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(args) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "WHISPER_DEVICE": "cpu",
+        "WHISPER_COMPUTE_TYPE": "int8",
+        # Every request is measured, not answered from the caches
+        "TRANSCRIPTION_CACHE_MB": "0",
+        "SUMMARY_CACHE_MB": "0",
+    }
+    if args.backend == "tiny":
+        from benchmarks.tiny_models import build_tiny_llama, build_tiny_whisper
+        env["WHISPER_MODEL_SIZE"] = build_tiny_whisper(TINY_WHISPER_PATH)
+        build_tiny_llama(TINY_LLAMA_PATH, hidden_size=256, layers=4)
+
+    command = [sys.executable, "-m", "benchmarks.suite", "--serve", "--port", str(args.port), "--backend", args.backend,
+               "--max-new-tokens", str(args.max_new_tokens), "--fake-rtf", str(args.fake_rtf),
+               "--fake-prefill-ms", str(args.fake_prefill_ms), "--fake-decode-ms", str(args.fake_decode_ms)]
+    return subprocess.Popen(command, env=env)
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/health/ready", timeout=5) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("server did not get ready")
+
+def peak_rss_mb(pid: int) -> float | None:
+    """ High water mark of the resident memory of a process, Linux only """
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+# Scenarios
+
+def post_json(url: str, body: dict) -> dict:
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        return json.loads(response.read())
+
+async def bench_rest_transcription(base_url: str, args) -> dict:
+    timings, rtfs, words = [], [], 0
+    for run in range(args.runs):
+        # A new recording every run, so nothing is cached
+        audio = make_speech(args.audio_seconds, seed=run)
+        body = {"blob": encode_wav(audio), "config": {"language": "en"}}
+        start = time.perf_counter()
+        result = await asyncio.to_thread(post_json, f"{base_url}/api/v1/transcription", body)
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        rtfs.append(elapsed / args.audio_seconds)
+        words += len(result)
+
+    return {
+        "audio_seconds": args.audio_seconds,
+        "latency": summarize_timings(timings),
+        "rtf_median": round(float(np.median(rtfs)), 5),
+        "words": words,
+    }
+
+async def websocket_session(url: str, session: int, args) -> tuple[list, int, int]:
+    import websockets
+
+    chunk_seconds = args.chunk_ms / 1000
+    audio = make_speech(args.chunks * chunk_seconds, seed=1000 + session)
+    chunk_samples = len(audio) // args.chunks
+    blobs = [encode_wav(audio[index * chunk_samples:(index + 1) * chunk_samples]) for index in range(args.chunks)]
+
+    latencies, missed, errors = [], 0, 0
+    async with websockets.connect(url, max_size=None) as websocket:
+        await websocket.send(json.dumps({"type": "config", "data": {"streaming": True, "language": "en", "chunk_length_ms": args.chunk_ms}}))
+        started = time.perf_counter()
+        for index, blob in enumerate(blobs):
+            sent = time.perf_counter()
+            await websocket.send(json.dumps({"type": "audio", "data": [blob], "chunk_start_no": index, "timestamp": index * args.chunk_ms}))
+            try:
+                while True:
+                    message = json.loads(await asyncio.wait_for(websocket.recv(), timeout=max(1.0, 4 * chunk_seconds)))
+                    if message["type"] in ("word_delta", "word", "error"):
+                        break
+                if message["type"] == "error":
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - sent)
+            except asyncio.TimeoutError:
+                missed += 1
+            # Chunks are sent in real time, like a microphone
+            await asyncio.sleep(max(0.0, started + (index + 1) * chunk_seconds - time.perf_counter()))
+    return latencies, missed, errors
+
+async def bench_websocket(base_url: str, args) -> dict:
+    url = base_url.replace("http://", "ws://") + "/ws/transcription"
+    results = await asyncio.gather(*(websocket_session(url, session, args) for session in range(args.sessions)))
+    latencies = [latency for session_latencies, _, _ in results for latency in session_latencies]
+    return {
+        "sessions": args.sessions,
+        "chunks_per_session": args.chunks,
+        "chunk_ms": args.chunk_ms,
+        "chunk_latency": summarize_timings(latencies),
+        "missed": sum(missed for _, missed, _ in results),
+        "errors": sum(errors for _, _, errors in results),
+    }
+
+def stream_summary(url: str, transcription: str) -> tuple[float, float, str]:
+    """ Time to the first token event, total time and full text of a streamed summary """
+    request = urllib.request.Request(url, data=json.dumps({"transcription": transcription}).encode(), headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    first_token = None
+    text = ""
+    with urllib.request.urlopen(request, timeout=600) as response:
+        event = None
+        for line in response:
+            line = line.decode().rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+            elif line.startswith("data: ") and event == "done":
+                text = json.loads(line[len("data: "):])["summary"]
+    return first_token, time.perf_counter() - start, text
+
+def load_tokenizer(backend: str):
+    if backend == "fake":
+        from benchmarks.fake_models import FakeTokenizer
+        return FakeTokenizer()
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(TINY_LLAMA_PATH)
+
+async def bench_llm(base_url: str, args) -> dict:
+    tokenizer = load_tokenizer(args.backend)
+    count = lambda text: len(tokenizer(text, add_special_tokens=False).input_ids)
+
+    ttfts, rates = [], []
+    for run in range(args.runs):
+        ttft, total, text = await asyncio.to_thread(stream_summary, f"{base_url}/api/v1/summarize/stream", make_transcript(args.transcript_lines, seed=run))
+        ttfts.append(ttft)
+        rates.append(count(text) / max(total - ttft, 1e-9))
+
+    start = time.perf_counter()
+    summaries = await asyncio.gather(*(
+        asyncio.to_thread(post_json, f"{base_url}/api/v1/summarize", {"transcription": make_transcript(args.transcript_lines, seed=100 + request)})
+        for request in range(args.concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    tokens = sum(count(summary["summary"]) for summary in summaries)
+
+    return {
+        "max_new_tokens": args.max_new_tokens,
+        "prompt_lines": args.transcript_lines,
+        "ttft": summarize_timings(ttfts),
+        "stream_tokens_per_second": round(float(np.median(rates)), 2),
+        "concurrency": args.concurrency,
+        "batched_tokens_per_second": round(tokens / elapsed, 2),
+    }
+
+# Reports
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as file:
+        before = flatten(json.load(file)["results"])
+    with open(after_path) as file:
+        after = flatten(json.load(file)["results"])
+
+    print(f"{'metric':<45} {'before':>12} {'after':>12} {'change':>9}")
+    for key in sorted(before.keys() & after.keys()):
+        change = f"{(after[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else ""
+        print(f"{key:<45} {before[key]:>12g} {after[key]:>12g} {change:>9}")
+
+async def run_scenarios(base_url: str, scenarios, args) -> dict:
+    benchmarks = {"rest_transcription": bench_rest_transcription, "websocket": bench_websocket, "llm": bench_llm}
+    results = {}
+    for scenario in scenarios:
+        print(f"running {scenario}...", file=sys.stderr)
+        results[scenario] = await benchmarks[scenario](base_url, args)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("fake", "tiny"), default="fake")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated scenarios")
+    parser.add_argument("--output", help="JSON file of the results, printed when not set")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compares two result files and exits")
+    parser.add_argument("--runs", type=int, default=5, help="Sequential requests of the REST and LLM scenarios")
+    parser.add_argument("--audio-seconds", type=float, default=30, help="Duration of the REST recordings")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent websocket sessions")
+    parser.add_argument("--chunks", type=int, default=20, help="Audio chunks per websocket session")
+    parser.add_argument("--chunk-ms", type=int, default=500)
+    parser.add_argument("--transcript-lines", type=int, default=40, help="Lines of the summarized transcriptions")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent summaries of the batched LLM measurement")
+    parser.add_argument("--fake-rtf", type=float, default=0.05, help="Real-time factor of the fake whisper")
+    parser.add_argument("--fake-prefill-ms", type=float, default=0.05, help="Prefill time per prompt token of the fake LLM")
+    parser.add_argument("--fake-decode-ms", type=float, default=20, help="Time per decode step of the fake LLM")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.serve:
+        serve(args)
+        return
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    args.port = args.port or free_port()
+    base_url = f"http://127.0.0.1:{args.port}"
+    process = start_server(args)
+    try:
+        wait_ready(base_url, process)
+        results = asyncio.run(run_scenarios(base_url, scenarios, args))
+        results["memory"] = {"server_peak_rss_mb": peak_rss_mb(process.pid)}
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("serve", "compare", "output")},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
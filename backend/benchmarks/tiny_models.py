@@ -0,0 +1,158 @@
+"""
+Builds small random Llama checkpoints with a character level tokenizer, and small random English-only or
+multilingual Whisper models in CTranslate2 format, so model code paths can be benchmarked offline on a CPU-only
+machine. Outputs are gibberish, timings and memory are what matter.
+
+Usage (from the backend directory):
+    python -m benchmarks.tiny_models /tmp/tiny-llama --hidden-size 256 --layers 4
+    python -m benchmarks.tiny_models /tmp/tiny-whisper --whisper --hidden-size 64 --layers 2
+    python -m benchmarks.tiny_models /tmp/tiny-whisper-multilingual --whisper --multilingual
+"""
+import argparse
+import os
+
+# Text tokens of the multilingual Whisper vocabulary, the last one is empty, which is how CTranslate2 tells the models apart
+MULTILINGUAL_TEXT_TOKENS = 50257
+
+
+def build_tiny_llama(path: str, hidden_size: int = 64, layers: int = 2, heads: int = 4, seed: int = 0) -> str:
+    """
+    Saves a random Llama model and tokenizer to `path`, unless it exists already.
+
+    Returns:
+        str: `path`, usable as model id
+    """
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+
+    import torch
+    import transformers
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+
+    vocabulary = ["<|begin_of_text|>", "<|end_of_text|>", "<|eot_id|>"]
+    vocabulary += [chr(code) for code in range(32, 127)] + list("æøåÆØÅ\n")
+    tokenizer = Tokenizer(models.WordLevel(vocab={token: i for i, token in enumerate(vocabulary)}, unk_token=" "))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer.decoder = decoders.Fuse()
+    transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token="<|begin_of_text|>",
+        eos_token="<|end_of_text|>"
+    ).save_pretrained(path)
+
+    config = transformers.LlamaConfig(
+        vocab_size=len(vocabulary),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=heads,
+        num_key_value_heads=max(heads // 2, 1),
+        max_position_embeddings=8192,
+        bos_token_id=0,
+        eos_token_id=1,
+    )
+    torch.manual_seed(seed)
+    transformers.LlamaForCausalLM(config).save_pretrained(path)
+    return path
+
+def build_tiny_whisper(path: str, hidden_size: int = 64, layers: int = 2, heads: int = 2, seed: int = 0, multilingual: bool = False) -> str:
+    """
+    Saves a random English-only Whisper model in CTranslate2 format to `path`, unless it exists already.
+    The tokenizer has byte tokens and the special tokens faster-whisper looks up, so it loads without the hub.
+    With `multilingual` the text tokens are padded to the layout of the multilingual vocabulary, so CTranslate2
+    takes it for a multilingual model and language detection works.
+
+    Returns:
+        str: `path`, usable as faster-whisper model size or path
+    """
+    if os.path.exists(os.path.join(path, "model.bin")):
+        return path
+
+    import tempfile
+
+    import ctranslate2
+    import torch
+    import transformers
+    from faster_whisper.tokenizer import _LANGUAGE_CODES
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+
+    # Same layout as the Whisper vocabulary: text, end of text, start of transcript, languages, tasks, timestamps
+    special_tokens = ["<|endoftext|>", "<|startoftranscript|>"]
+    special_tokens += [f"<|{code}|>" for code in _LANGUAGE_CODES]
+    special_tokens += ["<|translate|>", "<|transcribe|>", "<|startoflm|>", "<|startofprev|>", "<|nospeech|>", "<|notimestamps|>"]
+    special_tokens += [f"<|{i * 0.02:.2f}|>" for i in range(1501)]
+    vocabulary = sorted(pre_tokenizers.ByteLevel.alphabet())
+    if multilingual:
+        vocabulary += [f"pad{i}" for i in range(MULTILINGUAL_TEXT_TOKENS - len(vocabulary) - 1)] + [""]
+    vocabulary += special_tokens
+    vocabulary = {token: i for i, token in enumerate(vocabulary)}
+
+    tokenizer = Tokenizer(models.BPE(vocab=vocabulary, merges=[]))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.add_special_tokens(special_tokens)
+
+    end_of_text = vocabulary["<|endoftext|>"]
+    config = transformers.WhisperConfig(
+        vocab_size=len(vocabulary),
+        num_mel_bins=80,
+        d_model=hidden_size,
+        encoder_layers=layers,
+        decoder_layers=layers,
+        encoder_attention_heads=heads,
+        decoder_attention_heads=heads,
+        encoder_ffn_dim=hidden_size * 2,
+        decoder_ffn_dim=hidden_size * 2,
+        pad_token_id=end_of_text,
+        bos_token_id=end_of_text,
+        eos_token_id=end_of_text,
+        decoder_start_token_id=vocabulary["<|startoftranscript|>"],
+    )
+    torch.manual_seed(seed)
+    model = transformers.WhisperForConditionalGeneration(config)
+    model.generation_config.no_timestamps_token_id = vocabulary["<|notimestamps|>"]
+    model.generation_config.is_multilingual = multilingual
+    model.generation_config.suppress_tokens = []
+    model.generation_config.begin_suppress_tokens = [end_of_text]
+    model.generation_config.alignment_heads = [[layers - 1, head] for head in range(heads)]
+    model.generation_config.lang_to_id = {f"<|{code}|>": vocabulary[f"<|{code}|>"] for code in _LANGUAGE_CODES}
+
+    with tempfile.TemporaryDirectory() as checkpoint:
+        transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>", unk_token="<|endoftext|>").save_pretrained(checkpoint)
+        transformers.WhisperFeatureExtractor(feature_size=80).save_pretrained(checkpoint)
+        model.save_pretrained(checkpoint)
+        ctranslate2.converters.TransformersConverter(
+            checkpoint,
+            copy_files=["tokenizer.json", "preprocessor_config.json"]
+        ).convert(path, force=True)
+
+    if multilingual:
+        # Recent transformers drop lang_to_id when loading the generation config, so the converter misses the language tokens
+        import json
+
+        config_path = os.path.join(path, "config.json")
+        with open(config_path) as file:
+            ct2_config = json.load(file)
+        ct2_config["lang_ids"] = sorted(vocabulary[f"<|{code}|>"] for code in _LANGUAGE_CODES)
+        with open(config_path, "w") as file:
+            json.dump(ct2_config, file)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--whisper", action="store_true", help="Build a Whisper model instead of a Llama")
+    parser.add_argument("--hidden-size", type=int, default=64)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--heads", type=int, help="Default is 4 for Llama, 2 for Whisper")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--multilingual", action="store_true", help="Multilingual Whisper, with language detection")
+    args = parser.parse_args()
+
+    if args.whisper:
+        print(build_tiny_whisper(args.path, hidden_size=args.hidden_size, layers=args.layers, heads=args.heads or 2, seed=args.seed, multilingual=args.multilingual))
+    else:
+        print(build_tiny_llama(args.path, hidden_size=args.hidden_size, layers=args.layers, heads=args.heads or 4, seed=args.seed))
+
+if __name__ == "__main__":
+    main()
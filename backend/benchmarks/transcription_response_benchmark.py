@@ -0,0 +1,87 @@
+"""
+Benchmark of the transcription response formats: one object per word ("words", the default) against
+parallel arrays ("compact", check `compact_words`).
+
+POST /api/v1/transcription is sent through the real router and FastAPI serialization, with the transcription
+replaced by fake segments of the given length, so only building and serializing the response is measured.
+The websocket "word" message is measured in process: the dicts of the default format serialized with json,
+against the compact arrays serialized with orjson as the websocket writer does.
+
+Usage (from the backend directory):
+    python -m benchmarks.transcription_response_benchmark --minutes 60 --runs 10
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import orjson
+from benchmarks.fake_models import WORD_SECONDS, fake_segments
+
+def median_ms(function, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=60, help="Length of the transcribed recording")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    from app.routers import transcription_router
+    from app.services.transcription_service import compact_words
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    segments = fake_segments(args.minutes * 60)
+    info = None
+
+    async def transcribe_blobs(blobs, cfg=None):
+        return segments, info
+
+    transcription_router.transcription_service.transcribe_blobs = transcribe_blobs
+    app = FastAPI()
+    app.include_router(transcription_router.router, prefix="/api/v1")
+    client = TestClient(app)
+
+    print(f"{args.minutes:g} minutes, {int(args.minutes * 60 / WORD_SECONDS)} words")
+    baseline = None
+    for name, config in (
+        ("words", {}),
+        ("compact", {"response_format": "compact"}),
+        ("compact with probabilities", {"response_format": "compact", "probabilities": True}),
+    ):
+        def request():
+            response = client.post("/api/v1/transcription", json={"blob": "", "config": config})
+            response.raise_for_status()
+            return response.content
+
+        size = len(request())  # warmup
+        elapsed = median_ms(request, args.runs)
+        baseline = baseline or elapsed
+        print(f"REST {name:>26}: median {elapsed:.1f} ms ({baseline / elapsed:.1f}x), {size / 2 ** 10:.0f} KiB")
+
+    def websocket_words():
+        words = [
+            {"word": word.word, "timestamp": [int(word.start * 1000), int(word.end * 1000)], "is_good": True, "chunk_num": int(word.end * 1000 // 500)}
+            for segment in segments for word in segment.words
+        ]
+        return json.dumps({"type": "word", "data": words}, separators=(",", ":"), ensure_ascii=False)
+
+    def websocket_compact():
+        words = compact_words(segments)
+        words["chunk_num"] = [end // 500 for end in words["end"]]
+        return orjson.dumps({"type": "word", "data": words})
+
+    baseline = None
+    for name, function in (("words", websocket_words), ("compact", websocket_compact)):
+        elapsed = median_ms(function, args.runs)
+        baseline = baseline or elapsed
+        print(f"websocket {name:>21}: median {elapsed:.1f} ms ({baseline / elapsed:.1f}x), {len(function()) / 2 ** 10:.0f} KiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Real-time factor of long-form transcription, sequential against batched decoding.
+
+Transcribes one recording with FasterWhisperModel twice: window after window (batch_size 1, the former
+REST path) and with windows decoded in batches. RTF is processing time divided by audio duration,
+lower is better. Without --model a small random Whisper is built locally, and without --audio a
+synthetic recording is used with fixed windows instead of VAD, as VAD finds no speech in it.
+
+Usage (from the backend directory):
+    python -m benchmarks.transcription_rtf_benchmark --minutes 5 --batch-size 8
+    python -m benchmarks.transcription_rtf_benchmark --model large-v3 --device cuda --compute-type float16 --audio consultation.wav
+"""
+import argparse
+import time
+
+import numpy as np
+from app.ai.audio import SAMPLE_RATE, decode_audio
+from benchmarks.fixtures import make_recording
+from benchmarks.tiny_models import build_tiny_whisper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Model size or path, default is a random model built in /tmp")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--audio", help="Audio file, default is a synthetic recording")
+    parser.add_argument("--minutes", type=float, default=5, help="Duration of the synthetic recording")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--beam-size", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=1)
+    args = parser.parse_args()
+
+    from app.ai.model_registry import model_registry
+    from app.ai.models.faster_whisper import faster_whisper_model
+
+    faster_whisper_model.model_size = args.model or build_tiny_whisper("/tmp/benchmark-whisper-64")
+    faster_whisper_model.device = args.device
+    faster_whisper_model.compute_type = args.compute_type
+    model_registry.load(faster_whisper_model.name)
+
+    if args.audio:
+        with open(args.audio, "rb") as file:
+            audio = decode_audio(file.read())
+    else:
+        audio = make_recording(args.minutes * 60)
+    duration = len(audio) / SAMPLE_RATE
+    print(f"model {faster_whisper_model.model_size} on {args.device} ({args.compute_type}), {duration:.0f} s of audio")
+
+    cfg = {"beam_size": args.beam_size, "vad_filter": bool(args.audio)}
+    results = {}
+    for name, batch_size in (("sequential", 1), (f"batched x{args.batch_size}", args.batch_size)):
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            segments, _ = faster_whisper_model.transcribe_from_array(audio, cfg={**cfg, "batch_size": batch_size})
+            timings.append(time.perf_counter() - start)
+        results[name] = float(np.median(timings))
+        words = sum(len(segment.words or []) for segment in segments)
+        print(f"{name:>12}: {results[name]:.2f} s, RTF {results[name] / duration:.4f}, {len(segments)} segments, {words} words")
+
+    sequential, batched = results.values()
+    print(f"speedup {sequential / batched:.2f}x")
+
+if __name__ == "__main__":
+    main()
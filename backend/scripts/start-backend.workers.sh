@@ -0,0 +1,6 @@
+#!/bin/bash
+# Models run in one model server process, the API runs in several workers connected to it over a Unix-domain socket
+export MODEL_SERVER_SOCKET=${MODEL_SERVER_SOCKET:-/tmp/ara-model-server.sock}
+python -m app.ai.model_server &
+while [ ! -S "$MODEL_SERVER_SOCKET" ]; do sleep 0.5; done
+gunicorn -w ${API_WORKERS:-4} -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000 -t 600 app.main:app --log-config ./config.ini
@@ -0,0 +1,110 @@
+"""
+Tests of `BatchScheduler` with a fake `generate_batch`, which records the batches it is called with.
+"""
+import asyncio
+import threading
+
+from app.ai.executor import InferenceExecutor
+from app.ai.models.llms.batching import BatchScheduler
+
+GREEDY = {"do_sample": False, "max_new_tokens": 10}
+SAMPLING = {"do_sample": True, "temperature": 0.6, "max_new_tokens": 10}
+
+class FakeModel:
+    """ Records every batch and answers each prompt with its first token, blocks while `release` is not set """
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate_batch(self, input_ids, cfg, prefixes):
+        self.release.wait()
+        self.batches.append(([ids[0] for ids in input_ids], cfg, prefixes))
+        return [f"output {ids[0]}" for ids in input_ids]
+
+def run(test, **kwargs):
+    """ Runs a test coroutine with a scheduler on its own executor """
+    async def main():
+        model = FakeModel()
+        executor = InferenceExecutor("test-llm", max_queue_size=4)
+        try:
+            await test(model, BatchScheduler(model.generate_batch, executor, **kwargs))
+        finally:
+            model.release.set()
+            executor.shutdown()
+    asyncio.run(main())
+
+def prompt(number: int, length: int = 5) -> list:
+    return [number] * length
+
+def test_concurrent_requests_share_a_batch():
+    async def test(model, scheduler):
+        outputs = await asyncio.gather(*[scheduler.submit(prompt(i), GREEDY, prefix="summary") for i in range(3)])
+        assert outputs == ["output 0", "output 1", "output 2"]
+        assert model.batches == [([0, 1, 2], GREEDY, ["summary"] * 3)]
+        assert scheduler.pending == 0
+    run(test)
+
+def test_different_configurations_are_never_mixed():
+    async def test(model, scheduler):
+        cfgs = [GREEDY, SAMPLING, dict(GREEDY), {**SAMPLING, "temperature": 0.9}]
+        outputs = await asyncio.gather(*[scheduler.submit(prompt(i), cfgs[i % 4]) for i in range(8)])
+        assert outputs == [f"output {i}" for i in range(8)]
+        batches = sorted((numbers, cfg["temperature"] if cfg["do_sample"] else None) for numbers, cfg, _ in model.batches)
+        # Equal configurations share a batch even when they are different dicts
+        assert batches == [([0, 2, 4, 6], None), ([1, 5], 0.6), ([3, 7], 0.9)]
+    run(test)
+
+def test_token_budget_splits_batches():
+    async def test(model, scheduler):
+        # 2 * (30 + 10) tokens fit the budget, 3 * (30 + 10) don't
+        outputs = await asyncio.gather(*[scheduler.submit(prompt(i, length=30), GREEDY) for i in range(5)])
+        assert outputs == [f"output {i}" for i in range(5)]
+        assert [numbers for numbers, _, _ in model.batches] == [[0, 1], [2, 3], [4]]
+    run(test, max_batch_tokens=100)
+
+def test_full_batch_runs_without_waiting():
+    async def test(model, scheduler):
+        # The timer would only flush after 10 s
+        outputs = await asyncio.wait_for(asyncio.gather(*[scheduler.submit(prompt(i), GREEDY) for i in range(3)]), 2)
+        assert outputs == ["output 0", "output 1", "output 2"]
+        assert [numbers for numbers, _, _ in model.batches] == [[0, 1, 2]]
+    run(test, max_wait_ms=10000, max_batch_size=3)
+
+def test_timer_waits_while_the_model_is_busy():
+    async def test(model, scheduler):
+        # Keeps the only worker busy
+        model.release.clear()
+        busy = asyncio.ensure_future(scheduler.submit(prompt(0), GREEDY))
+        await asyncio.sleep(0.05)
+        assert scheduler.executor.is_busy
+
+        # The timer fires several times meanwhile, and is armed again each time
+        first = asyncio.ensure_future(scheduler.submit(prompt(1), GREEDY))
+        await asyncio.sleep(0.1)
+        second = asyncio.ensure_future(scheduler.submit(prompt(2), GREEDY))
+        await asyncio.sleep(0.1)
+        assert scheduler.pending == 2
+
+        model.release.set()
+        assert await asyncio.gather(busy, first, second) == ["output 0", "output 1", "output 2"]
+        assert [numbers for numbers, _, _ in model.batches] == [[0], [1, 2]]
+    run(test, max_wait_ms=20)
+
+def test_timer_flushes_a_partial_batch():
+    async def test(model, scheduler):
+        assert await scheduler.submit(prompt(0), GREEDY) == "output 0"
+        await asyncio.sleep(0.05)
+        assert await scheduler.submit(prompt(1), GREEDY) == "output 1"
+        assert [numbers for numbers, _, _ in model.batches] == [[0], [1]]
+    run(test, max_wait_ms=20)
+
+def test_errors_reach_every_request_of_the_batch():
+    async def test(model, scheduler):
+        def fail(input_ids, cfg, prefixes):
+            raise RuntimeError("out of memory")
+        scheduler.generate_batch = fail
+        results = await asyncio.gather(*[scheduler.submit(prompt(i), GREEDY) for i in range(2)], return_exceptions=True)
+        assert [str(result) for result in results] == ["out of memory"] * 2
+    run(test)
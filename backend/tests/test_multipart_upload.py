@@ -0,0 +1,97 @@
+"""
+Tests of `MultipartUpload`, fed with request bodies split into chunks at arbitrary points.
+"""
+import asyncio
+
+import pytest
+from app.exceptions.transcription_job_exceptions import InvalidUploadError, UploadTooLargeError
+from app.utils.multipart_upload import MultipartUpload
+
+BOUNDARY = "----boundary1234"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+RECORDING = bytes(range(256)) * 40
+
+def form(*parts: tuple) -> bytes:
+    """ Multipart body of (name, value) text fields and (name, filename, content) files """
+    body = b""
+    for part in parts:
+        if len(part) == 2:
+            name, value = part
+            body += f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode() + value.encode()
+        else:
+            name, filename, content = part
+            body += (
+                f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode() + content
+        body += b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+async def chunked(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+        # Lets other tasks run, like a request body arriving over the network
+        await asyncio.sleep(0)
+
+async def split_at(body: bytes, *positions: int):
+    for start, end in zip((0, *positions), (*positions, len(body))):
+        yield body[start:end]
+
+def read(upload: MultipartUpload) -> bytes:
+    async def main():
+        return b"".join([chunk async for chunk in upload.file_chunks()])
+    return asyncio.run(main())
+
+@pytest.mark.parametrize("size", [1, 7, 64, 1000, 10 ** 6])
+def test_file_and_fields_in_any_chunking(size):
+    body = form(("config", '{"language": "no"}'), ("file", "consultation.wav", RECORDING))
+    upload = MultipartUpload(CONTENT_TYPE, chunked(body, size))
+    assert read(upload) == RECORDING
+    assert upload.fields == {"config": '{"language": "no"}'}
+
+def test_boundary_split_across_chunks():
+    body = form(("file", "consultation.wav", RECORDING), ("config", "{}"))
+    # The delimiter after the file starts right after its content
+    delimiter = body.index(f"\r\n--{BOUNDARY}".encode(), len(RECORDING))
+    for offset in (1, 2, 5, len(BOUNDARY)):
+        upload = MultipartUpload(CONTENT_TYPE, split_at(body, delimiter + offset))
+        assert read(upload) == RECORDING
+        assert upload.fields == {"config": "{}"}
+
+def test_fields_after_the_file_are_complete_once_it_is_read():
+    body = form(("file", "consultation.wav", RECORDING), ("config", '{"language": "en"}'))
+    upload = MultipartUpload(CONTENT_TYPE, chunked(body, 512))
+
+    async def main():
+        chunks = upload.file_chunks()
+        first = await chunks.__anext__()
+        # The field is still on the way
+        assert upload.fields == {}
+        return first + b"".join([chunk async for chunk in chunks])
+    assert asyncio.run(main()) == RECORDING
+    assert upload.fields == {"config": '{"language": "en"}'}
+
+def test_size_limit_is_enforced_while_uploading():
+    received = []
+
+    async def body():
+        yield form(("file", "consultation.wav", RECORDING))[:2000]
+        received.append(2000)
+        # Never reached, the upload stops at the first chunk over the limit
+        yield b"\x00" * 10 ** 6
+        received.append(10 ** 6)
+
+    upload = MultipartUpload(CONTENT_TYPE, body(), max_file_bytes=1000)
+    with pytest.raises(UploadTooLargeError):
+        read(upload)
+    assert received == []
+
+def test_invalid_forms():
+    with pytest.raises(InvalidUploadError):
+        MultipartUpload("multipart/form-data", chunked(b"", 1))
+    with pytest.raises(InvalidUploadError, match="missing"):
+        read(MultipartUpload(CONTENT_TYPE, chunked(form(("config", "{}")), 10)))
+    with pytest.raises(InvalidUploadError, match="only one file"):
+        read(MultipartUpload(CONTENT_TYPE, chunked(form(("audio", "a.wav", RECORDING)), 100)))
+    with pytest.raises(InvalidUploadError, match="only one file"):
+        read(MultipartUpload(CONTENT_TYPE, chunked(form(("file", "a.wav", b"a"), ("file", "b.wav", b"b")), 100)))
@@ -0,0 +1,163 @@
+"""
+Tests of the buffering of `PersistenceService`, with a stub engine whose transactions fail on demand, so no
+database is needed. Writes to a real database are tested in test_persistence_service.py.
+"""
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+
+from app.services.persistence_service import MAX_ATTEMPTS, NOTE_SUMMARY, NOTES, SESSIONS, SOURCE_REST, WORDS, PersistenceService
+
+class StubEngine:
+    """ Records the rows of every committed transaction, `begin()` fails while `fail` is set """
+
+    def __init__(self):
+        self.fail = False
+        self.written = {SESSIONS.name: [], WORDS.name: [], NOTES.name: [], "closed": []}
+
+    @asynccontextmanager
+    async def begin(self):
+        if self.fail:
+            raise ConnectionError("database unreachable")
+        connection = StubConnection()
+        yield connection
+        for table, rows in connection.rows:
+            self.written[table].extend(rows)
+
+class StubConnection:
+    def __init__(self):
+        self.rows = []
+
+    async def execute(self, statement, rows):
+        self.rows.append(("closed" if statement.is_update else statement.table.name, rows))
+
+class StubDatabase:
+    def __init__(self):
+        self.engine = StubEngine()
+
+    async def dispose(self):
+        pass
+
+def service(**kwargs) -> PersistenceService:
+    return PersistenceService(StubDatabase(), **{"enabled": True, "batch_size": 50, **kwargs})
+
+def words(count: int, offset: int = 0) -> dict:
+    return {
+        "words": [f" w{offset + i}" for i in range(count)],
+        "start": [(offset + i) * 100 for i in range(count)],
+        "end": [(offset + i) * 100 + 90 for i in range(count)],
+    }
+
+def drop_next_batch(persistence: PersistenceService):
+    """ Fails the next batch until its rows are dropped """
+    persistence.database.engine.fail = True
+    for _ in range(MAX_ATTEMPTS):
+        assert not asyncio.run(persistence.flush())
+    persistence.database.engine.fail = False
+
+def test_rows_are_written_and_accounted():
+    persistence = service()
+    session_id = persistence.start_session(SOURCE_REST)
+    persistence.add_words(session_id, words(70))
+    persistence.add_note(NOTE_SUMMARY, "summary", session_id=session_id)
+    persistence.close_session(session_id, language="no")
+    assert persistence._buffered == 73
+
+    assert asyncio.run(persistence.flush())
+    written = persistence.database.engine.written
+    assert [row["seq"] for row in written[WORDS.name]] == list(range(70))
+    assert written["closed"][0]["b_words"] == 70 and written["closed"][0]["b_language"] == "no"
+    assert written[NOTES.name][0]["session_id"] == uuid.UUID(session_id)
+    assert persistence._buffered == 0
+
+def test_failed_batch_is_kept_for_the_next_flush():
+    persistence = service()
+    session_id = persistence.start_session(SOURCE_REST)
+    persistence.add_words(session_id, words(30))
+
+    persistence.database.engine.fail = True
+    assert not asyncio.run(persistence.flush())
+    persistence.add_words(session_id, words(30, offset=30))
+    assert persistence._buffered == 61
+
+    persistence.database.engine.fail = False
+    assert asyncio.run(persistence.flush())
+    assert [row["seq"] for row in persistence.database.engine.written[WORDS.name]] == list(range(60))
+    assert persistence._buffered == 0
+
+def test_drop_removes_words_and_closes_of_dropped_sessions():
+    persistence = service()
+    dropped_id = persistence.start_session(SOURCE_REST)
+    # 50 words go in the batch that is dropped, 20 stay in the buffer
+    persistence.add_words(dropped_id, words(70))
+    persistence.database.engine.fail = True
+    assert not asyncio.run(persistence.flush())
+    kept_id = persistence.start_session(SOURCE_REST)
+    persistence.add_words(kept_id, words(5))
+    persistence.close_session(dropped_id)
+    persistence.close_session(kept_id)
+    assert persistence._buffered == 1 + 70 + 1 + 5 + 2
+
+    drop_next_batch(persistence)
+    # The session row and its 50 words of the batch, its 20 buffered words and its close are gone
+    assert persistence._buffered == 1 + 5 + 1
+    assert uuid.UUID(dropped_id) in persistence._dropped_sessions
+
+    # Later rows of the dropped session are ignored
+    persistence.add_words(dropped_id, words(10, offset=70))
+    persistence.close_session(dropped_id)
+    assert persistence._buffered == 7
+
+    assert asyncio.run(persistence.flush())
+    written = persistence.database.engine.written
+    assert [row["id"] for row in written[SESSIONS.name]] == [uuid.UUID(kept_id)]
+    assert {row["session_id"] for row in written[WORDS.name]} == {uuid.UUID(kept_id)}
+    assert [row["b_id"] for row in written["closed"]] == [uuid.UUID(kept_id)]
+    assert persistence._buffered == 0
+
+def test_notes_are_detached_from_dropped_sessions():
+    persistence = service()
+    dropped_id = persistence.start_session(SOURCE_REST)
+    persistence.database.engine.fail = True
+    assert not asyncio.run(persistence.flush())
+    # Buffered while the batch with the session is retried, and after it was dropped
+    persistence.add_note(NOTE_SUMMARY, "before the drop", session_id=dropped_id)
+    drop_next_batch(persistence)
+    persistence.add_note(NOTE_SUMMARY, "after the drop", session_id=dropped_id)
+    persistence.add_note(NOTE_SUMMARY, "without session")
+    assert persistence._buffered == 3
+
+    assert asyncio.run(persistence.flush())
+    notes = persistence.database.engine.written[NOTES.name]
+    assert [(note["content"], note["session_id"]) for note in notes] == [("before the drop", None), ("after the drop", None), ("without session", None)]
+    assert persistence._buffered == 0
+
+def test_words_beyond_the_buffer_are_dropped_and_their_seq_skipped():
+    persistence = service(max_buffered_rows=20)
+    session_id = persistence.start_session(SOURCE_REST)
+    persistence.add_words(session_id, words(15))
+    # Doesn't fit, the 10 positions are skipped
+    persistence.add_words(session_id, words(10, offset=15))
+    persistence.add_words(session_id, words(4, offset=25))
+    assert persistence._buffered == 20
+    # Notes beyond the buffer are dropped too
+    persistence.add_note(NOTE_SUMMARY, "dropped note", session_id=session_id)
+    assert persistence._buffered == 20
+
+    assert asyncio.run(persistence.flush())
+    persistence.close_session(session_id)
+    assert asyncio.run(persistence.flush())
+    written = persistence.database.engine.written
+    assert [row["seq"] for row in written[WORDS.name]] == list(range(15)) + list(range(25, 29))
+    # The close counts every word added, so the next session of the id continues after them
+    assert written["closed"][0]["b_words"] == 29
+    assert written[NOTES.name] == []
+    assert persistence._buffered == 0
+
+def test_nothing_is_buffered_when_disabled():
+    persistence = service(enabled=False)
+    assert persistence.start_session(SOURCE_REST) is None
+    persistence.add_words(str(uuid.uuid4()), words(5))
+    persistence.add_note(NOTE_SUMMARY, "note")
+    assert persistence._buffered == 0
+    assert asyncio.run(persistence.flush())
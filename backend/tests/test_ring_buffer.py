@@ -0,0 +1,57 @@
+"""
+Tests of `PCMRingBuffer`, addressed by absolute sample index while old samples are overwritten.
+"""
+import numpy as np
+import pytest
+from app.utils.ring_buffer import PCMRingBuffer
+
+def samples(start: int, count: int) -> np.ndarray:
+    """ Samples whose value is their absolute index, so reads show where they come from """
+    return np.arange(start, start + count, dtype=np.float32)
+
+def test_append_and_read():
+    buffer = PCMRingBuffer(8)
+    buffer.append(samples(0, 5))
+    assert (buffer.start, buffer.end, len(buffer)) == (0, 5, 5)
+    assert buffer.read().tolist() == list(range(5))
+    assert buffer.read(3).tolist() == [3, 4]
+    assert buffer.read(5).tolist() == []
+    buffer.append(np.zeros(0))
+    assert buffer.end == 5
+
+def test_wraparound_keeps_absolute_indices():
+    buffer = PCMRingBuffer(8)
+    for start in range(0, 20, 3):
+        buffer.append(samples(start, 3))
+    # 21 samples appended, the last 8 are kept across the end of the array
+    assert (buffer.start, buffer.end, len(buffer)) == (13, 21, 8)
+    assert buffer.read().tolist() == list(range(13, 21))
+    assert buffer.read(18).tolist() == [18, 19, 20]
+    # Overwritten samples are clamped to the oldest one
+    assert buffer.read(2).tolist() == list(range(13, 21))
+
+def test_overflow_keeps_the_tail():
+    buffer = PCMRingBuffer(8)
+    buffer.append(samples(0, 3))
+    buffer.append(samples(3, 20))
+    assert (buffer.start, buffer.end) == (15, 23)
+    assert buffer.read().tolist() == list(range(15, 23))
+    buffer.append(samples(23, 8))
+    assert buffer.read().tolist() == list(range(23, 31))
+
+def test_discard_until():
+    buffer = PCMRingBuffer(8)
+    buffer.append(samples(0, 6))
+    buffer.discard_until(4)
+    assert buffer.read().tolist() == [4, 5]
+    # Discarding never moves back, nor past the end
+    buffer.discard_until(2)
+    assert buffer.start == 4
+    buffer.discard_until(100)
+    assert (buffer.start, len(buffer)) == (6, 0)
+    buffer.append(samples(6, 10))
+    assert buffer.read().tolist() == list(range(8, 16))
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        PCMRingBuffer(0)
@@ -0,0 +1,67 @@
+"""
+Tests of speculative decoding in `TransformersBackend`, with small random Llamas sharing one tokenizer built
+by `benchmarks.tiny_models`. Greedy decoding must give the same text with and without the draft model.
+"""
+import pytest
+from app.ai.models.llms.backends import TransformersBackend
+from app.utils.metrics import llm_draft_tokens
+from benchmarks.tiny_models import build_tiny_llama
+
+GREEDY = {"do_sample": False, "max_new_tokens": 24}
+
+@pytest.fixture(scope="module")
+def model_ids(tmp_path_factory):
+    path = tmp_path_factory.mktemp("llamas")
+    return (
+        build_tiny_llama(str(path / "model"), hidden_size=64, layers=2, seed=0),
+        build_tiny_llama(str(path / "draft"), hidden_size=32, layers=1, seed=1),
+    )
+
+@pytest.fixture(scope="module")
+def backend(model_ids):
+    model_id, draft_model_id = model_ids
+    backend = TransformersBackend(draft_model_id=draft_model_id, draft_lookahead=4, draft_schedule="constant")
+    backend.load(model_id)
+    yield backend
+    backend.unload()
+
+def prompt(backend: TransformersBackend, text: str = "Pasienten har hatt feber i tre dager.") -> list:
+    return backend.tokenizer(text).input_ids
+
+def test_greedy_output_is_the_same_with_and_without_draft_model(backend):
+    for text in ["Pasienten har hatt feber i tre dager.", "Lege: Hva kan jeg hjelpe deg med?"]:
+        backend.draft_enabled = False
+        baseline = backend.generate_one(prompt(backend, text), GREEDY)
+        backend.draft_enabled = True
+        speculative = backend.generate_one(prompt(backend, text), GREEDY)
+        assert speculative == baseline
+        assert baseline
+
+def test_draft_tokens_are_counted(backend):
+    backend.draft_enabled = True
+    drafted = llm_draft_tokens.labels().value
+    backend.generate_one(prompt(backend), GREEDY)
+    assert llm_draft_tokens.labels().value > drafted
+
+    # Without the draft model nothing is drafted
+    backend.draft_enabled = False
+    drafted = llm_draft_tokens.labels().value
+    backend.generate_one(prompt(backend), GREEDY)
+    assert llm_draft_tokens.labels().value == drafted
+
+def test_without_draft_model_prompts_are_decoded_normally(model_ids, backend):
+    model_id, _ = model_ids
+    plain = TransformersBackend()
+    plain.load(model_id)
+    try:
+        assert plain.draft_model is None
+        drafted = llm_draft_tokens.labels().value
+        text = plain.generate_one(prompt(plain), GREEDY)
+        assert llm_draft_tokens.labels().value == drafted
+        backend.draft_enabled = False
+        assert text == backend.generate_one(prompt(backend), GREEDY)
+        # Batches are never decoded speculatively
+        backend.draft_enabled = True
+        assert backend.generate_batch([prompt(backend)], GREEDY) == [text]
+    finally:
+        plain.unload()
@@ -0,0 +1,68 @@
+"""
+Tests of the LocalAgreement-2 commitment of `HypothesisBuffer`.
+"""
+from app.services.streaming_transcription import HypothesisBuffer, TimedWord
+
+def hypothesis(text: str, start: float = 0.0, step: float = 0.5) -> list:
+    """ Words of `text`, each `step` seconds long from `start` """
+    return [TimedWord(start + i * step, start + (i + 1) * step, f" {word}") for i, word in enumerate(text.split())]
+
+def texts(words: list) -> str:
+    return "".join(word.text for word in words).strip()
+
+def test_words_are_committed_when_two_hypotheses_agree():
+    buffer = HypothesisBuffer()
+    buffer.insert(hypothesis("jeg har hatt"))
+    # Nothing to agree with yet
+    assert buffer.flush() == []
+    assert texts(buffer.tentative) == "jeg har hatt"
+
+    buffer.insert(hypothesis("jeg har vondt i"))
+    assert texts(buffer.flush()) == "jeg har"
+    assert texts(buffer.tentative) == "vondt i"
+    assert buffer.last_committed_end == 1.0
+
+    # Committed words come back in the next hypothesis of the window and are not committed again
+    buffer.insert(hypothesis("jeg har vondt i hodet"))
+    assert texts(buffer.flush()) == "vondt i"
+    assert texts(buffer.committed_in_window) == "jeg har vondt i"
+    assert texts(buffer.tentative) == "hodet"
+
+def test_disagreement_commits_nothing():
+    buffer = HypothesisBuffer()
+    buffer.insert(hypothesis("hun har feber"))
+    buffer.flush()
+    buffer.insert(hypothesis("han har feber"))
+    assert buffer.flush() == []
+    assert texts(buffer.tentative) == "han har feber"
+
+def test_repeated_words_at_the_committed_boundary_are_dropped():
+    buffer = HypothesisBuffer()
+    buffer.insert(hypothesis("tre dager"))
+    buffer.flush()
+    buffer.insert(hypothesis("tre dager"))
+    assert texts(buffer.flush()) == "tre dager"
+    assert buffer.last_committed_end == 1.0
+
+    # The last committed word is transcribed again, straddling the committed end
+    buffer.insert([TimedWord(0.95, 1.4, " dager")] + hypothesis("med feber", start=1.4))
+    assert texts(buffer.flush()) == ""
+    assert texts(buffer.tentative) == "med feber"
+
+def test_flush_all_commits_the_whole_hypothesis():
+    buffer = HypothesisBuffer()
+    buffer.insert(hypothesis("takk for i dag"))
+    assert texts(buffer.flush_all()) == "takk for i dag"
+    assert buffer.tentative == []
+    assert buffer.last_committed_end == 2.0
+
+def test_pop_committed_trims_at_word_ends():
+    buffer = HypothesisBuffer()
+    buffer.insert(hypothesis("en to tre fire"))
+    buffer.flush_all()
+    # "to" ends at 1.0, "tre" at 1.5 is still in the window
+    assert texts(buffer.pop_committed(1.2)) == "en to"
+    assert texts(buffer.committed_in_window) == "tre fire"
+    assert buffer.pop_committed(1.2) == []
+    assert texts(buffer.pop_committed(2.0)) == "tre fire"
+    assert buffer.committed_in_window == []
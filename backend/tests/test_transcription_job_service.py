@@ -0,0 +1,163 @@
+"""
+Tests of `TranscriptionJobService` with a fake model, in a temporary jobs directory.
+"""
+import asyncio
+import base64
+import os
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from app.exceptions.inference_exceptions import InferenceQueueFullError
+from app.exceptions.transcription_job_exceptions import InvalidUploadError, TranscriptionJobNotFinishedError, UploadTooLargeError
+from app.services.transcription_job_service import JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, TranscriptionJobService
+from benchmarks.fixtures import encode_wav, make_recording
+
+RECORDING = base64.b64decode(encode_wav(make_recording(2)))
+
+class FakeModel:
+    """ Returns one segment per second of audio, blocks while `release` is not set """
+
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def transcribe_from_array(self, audio, cfg, on_segment=None):
+        self.release.wait()
+        self.calls.append((len(audio), cfg))
+        if self.error:
+            raise self.error
+        segments = []
+        for second in range(len(audio) // 16000):
+            word = SimpleNamespace(word=f" ord{second}", start=second, end=second + 0.5, probability=0.9)
+            segment = SimpleNamespace(start=second, end=second + 1, text=word.word, words=[word])
+            on_segment(segment)
+            segments.append(segment)
+        return segments, SimpleNamespace(language=cfg.get("language") or "no")
+
+async def chunks(data: bytes, size: int = 4096):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+async def wait_for_status(service: TranscriptionJobService, job_id: str, status: str) -> dict:
+    for _ in range(200):
+        job = await service.get(job_id)
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"job is {job['status']}, not {status}")
+
+def run(test, tmp_path, **kwargs):
+    async def main():
+        model = FakeModel(kwargs.pop("error", None))
+        service = TranscriptionJobService(model, str(tmp_path), **kwargs)
+        try:
+            await test(model, service)
+        finally:
+            model.release.set()
+            await asyncio.gather(*service._tasks)
+    asyncio.run(main())
+
+def test_job_goes_through_queued_running_completed(tmp_path):
+    async def test(model, service):
+        model.release.clear()
+        job = await service.create(chunks(RECORDING), {"language": "en"})
+        assert job["status"] == JOB_QUEUED
+        assert job["size"] == len(RECORDING) and job["segments"] == 0
+
+        await wait_for_status(service, job["id"], JOB_RUNNING)
+        with pytest.raises(TranscriptionJobNotFinishedError):
+            await service.result(job["id"])
+
+        model.release.set()
+        completed = await wait_for_status(service, job["id"], JOB_COMPLETED)
+        assert completed["language"] == "en" and completed["segments"] == 2
+        assert completed["duration"] == 2.0
+        # Decoded recordings are not kept
+        assert not os.path.exists(os.path.join(service.directory, job["id"], "audio"))
+        segments, cfg = await service.result(job["id"])
+        assert [segment["text"] for segment in segments] == [" ord0", " ord1"]
+        assert segments[1]["words"] == [{"word": " ord1", "start": 1000, "end": 1500, "probability": 0.9}]
+        assert cfg == {"language": "en"}
+        assert await service.segments(job["id"], 1) == segments[1:]
+
+        events = [event async for event in service.stream(job["id"])]
+        assert [name for name, _ in events] == ["segment", "segment", "done"]
+        assert events[-1][1]["status"] == JOB_COMPLETED
+    run(test, tmp_path)
+
+def test_settings_read_after_the_upload(tmp_path):
+    async def test(model, service):
+        form = {}
+
+        async def upload():
+            async for chunk in chunks(RECORDING):
+                yield chunk
+            form["config"] = {"language": "sv"}
+
+        job = await service.create(upload(), lambda: form["config"])
+        assert job["config"] == {"language": "sv"}
+        completed = await wait_for_status(service, job["id"], JOB_COMPLETED)
+        assert completed["language"] == "sv"
+    run(test, tmp_path)
+
+def test_failed_jobs(tmp_path):
+    async def test(model, service):
+        job = await service.create(chunks(RECORDING), {})
+        failed = await wait_for_status(service, job["id"], JOB_FAILED)
+        assert failed["error"] == "out of memory"
+        with pytest.raises(TranscriptionJobNotFinishedError, match="out of memory"):
+            await service.result(job["id"])
+
+        job = await service.create(chunks(b"not a recording"), {})
+        failed = await wait_for_status(service, job["id"], JOB_FAILED)
+        assert "can't be decoded" in failed["error"]
+    run(test, tmp_path, error=RuntimeError("out of memory"))
+
+def test_rejected_uploads_leave_nothing_behind(tmp_path):
+    async def test(model, service):
+        with pytest.raises(UploadTooLargeError):
+            await service.create(chunks(RECORDING), {})
+        with pytest.raises(InvalidUploadError):
+            await service.create(chunks(b""), {})
+        assert os.listdir(service.directory) == []
+
+        model.release.clear()
+        await service.create(chunks(RECORDING[:1000]), {})
+        with pytest.raises(InferenceQueueFullError):
+            await service.create(chunks(RECORDING[:1000]), {})
+    run(test, tmp_path, max_upload_bytes=len(RECORDING) - 1, max_jobs=1)
+
+def test_cleanup_fails_jobs_of_stopped_workers_and_deletes_expired_jobs(tmp_path):
+    async def test(model, service):
+        model.release.clear()
+        job = await service.create(chunks(RECORDING), {})
+        await wait_for_status(service, job["id"], JOB_RUNNING)
+
+        # Jobs of a worker that exited, and of one whose pid was reused by this process
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        stopped_ids = ["1" * 32, "2" * 32]
+        for job_id, changes in zip(stopped_ids, [{"pid": exited.pid, "process_start": None}, {"process_start": "1"}]):
+            os.makedirs(os.path.join(service.directory, job_id))
+            service._write_status(job_id, {**job, "id": job_id, "status": JOB_QUEUED, **changes})
+        assert service.cleanup() == 0
+        assert (await service.get(job["id"]))["status"] == JOB_RUNNING
+        for job_id in stopped_ids:
+            stopped = await service.get(job_id)
+            assert stopped["status"] == JOB_FAILED and stopped["error"] == "The worker running the job stopped"
+
+        # Finished jobs are deleted after the TTL, as are abandoned uploads
+        model.release.set()
+        await wait_for_status(service, job["id"], JOB_COMPLETED)
+        os.makedirs(os.path.join(service.directory, "0" * 32))
+        service.ttl_seconds = 0
+        time.sleep(0.01)
+        assert service.cleanup() == 4
+        assert os.listdir(service.directory) == []
+    run(test, tmp_path)